@@ -0,0 +1,5 @@
+"""
+Django cache backend for a cluster of Redis masters, sharded and failed over
+by the DisredisClient.
+
+"""
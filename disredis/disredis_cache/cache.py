@@ -0,0 +1,179 @@
+import math
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:  # Python 3
+    import pickle
+
+from django.core.cache.backends.base import BaseCache
+try:
+    from django.core.cache.backends.base import DEFAULT_TIMEOUT
+except ImportError:  # Backwards compatibility for Django <1.6
+    DEFAULT_TIMEOUT = None
+
+from disredis.disredis_client.client import get_shared_client
+
+try:
+    string_types = basestring
+    integer_types = (int, long)
+except NameError:  # Python 3
+    string_types = str
+    integer_types = (int,)
+
+
+# Every zlib stream written with the default window size starts with this
+# byte, while pickles start with the protocol opcode '\x80'.
+ZLIB_HEADER = b"x"
+
+# Increment a key only if it already exists, so incr() can raise ValueError
+# for a missing key without a separate round trip.
+INCR_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('incrby', KEYS[1], ARGV[1])
+end
+return false
+"""
+
+
+class DisredisCache(BaseCache):
+    """
+    Cache backend storing values on the masters known to the Sentinels in
+    LOCATION, a list (or comma separated string) of "host:port" addresses.
+
+    Integers are stored as plain numbers so that incr() and decr() can be
+    done atomically by Redis. All other values are pickled, and compressed
+    with zlib when their pickle is at least OPTIONS['COMPRESS_MIN_LENGTH']
+    bytes long. OPTIONS['WEIGHTS'] are the weights of the masters, as for
+    DisredisClient; use the same ones as SESSION_REDIS_WEIGHTS.
+
+    Keys are sharded like any other disredis key, so a {} hashtag in a cache
+    key keeps it on the same master as other keys with that hashtag.
+    """
+    def __init__(self, server, params):
+        super(DisredisCache, self).__init__(params)
+        if isinstance(server, string_types):
+            server = [address.strip() for address in server.split(",")]
+        self._sentinel_addresses = server
+        options = params.get("OPTIONS", {})
+        self._compress_min_length = options.get("COMPRESS_MIN_LENGTH")
+        self._compress_level = options.get("COMPRESS_LEVEL", 6)
+        self._weights = options.get("WEIGHTS")
+
+    @property
+    def _client(self):
+        """
+        The DisredisClient shared by all caches and sessions in this process
+        that use the same Sentinels.
+        """
+        return get_shared_client(self._sentinel_addresses,
+                                 weights=self._weights)
+
+    def _make_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _get_expiry(self, timeout=DEFAULT_TIMEOUT):
+        """
+        Returns the expiry in whole seconds for ``timeout``, or None if the
+        value shouldn't expire.
+        """
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return None
+        return int(math.ceil(timeout))
+
+    def _encode(self, value):
+        if isinstance(value, integer_types) and not isinstance(value, bool):
+            return value
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if (self._compress_min_length is not None and
+                len(data) >= self._compress_min_length):
+            data = zlib.compress(data, self._compress_level)
+        return data
+
+    def _decode(self, data):
+        try:
+            return int(data)
+        except ValueError:
+            pass
+        if data[:1] == ZLIB_HEADER:
+            data = zlib.decompress(data)
+        return pickle.loads(data)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._make_key(key, version=version)
+        expiry = self._get_expiry(timeout)
+        if expiry is not None and expiry <= 0:
+            # The value would expire straight away, so only report whether
+            # it could have been added.
+            return not self._client.exists(key)
+        return bool(self._client.set(key, self._encode(value), ex=expiry,
+            nx=True))
+
+    def get(self, key, default=None, version=None):
+        value = self._client.get(self._make_key(key, version=version))
+        if value is None:
+            return default
+        return self._decode(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._make_key(key, version=version)
+        expiry = self._get_expiry(timeout)
+        if expiry is not None and expiry <= 0:
+            self._client.delete(key)
+        else:
+            self._client.set(key, self._encode(value), ex=expiry)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._make_key(key, version=version)
+        expiry = self._get_expiry(timeout)
+        if expiry is None:
+            return bool(self._client.persist(key) or self._client.exists(key))
+        if expiry <= 0:
+            return bool(self._client.delete(key))
+        return bool(self._client.expire(key, expiry))
+
+    def delete(self, key, version=None):
+        return bool(self._client.delete(self._make_key(key, version=version)))
+
+    def has_key(self, key, version=None):
+        return bool(self._client.exists(self._make_key(key, version=version)))
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = self._client.mget(
+            [self._make_key(key, version=version) for key in keys])
+        return dict((key, self._decode(value))
+                    for key, value in zip(keys, values) if value is not None)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expiry = self._get_expiry(timeout)
+        if expiry is not None and expiry <= 0:
+            self.delete_many(data, version=version)
+            return []
+        self._client.execute_batch([
+            ("set", self._make_key(key, version=version),
+                (self._encode(value),), {"ex": expiry})
+            for key, value in data.items()])
+        return []
+
+    def delete_many(self, keys, version=None):
+        keys = [self._make_key(key, version=version) for key in keys]
+        if keys:
+            self._client.delete(*keys)
+
+    def incr(self, key, delta=1, version=None):
+        made_key = self._make_key(key, version=version)
+        value = self._client.eval(INCR_SCRIPT, 1, made_key, delta)
+        if value is None:
+            raise ValueError("Key '%s' not found" % key)
+        return value
+
+    def clear(self):
+        self._client.flushdb()
+
+    def close(self, **kwargs):
+        # The client is shared by the whole process, so leave it connected.
+        pass
@@ -0,0 +1,168 @@
+"""
+Tests for the disredis cache backend.
+
+"""
+from unittest import TestCase
+
+from django.conf import settings as django_settings
+if not django_settings.configured:
+    django_settings.configure(SECRET_KEY="disredis-tests",
+                              SESSION_REDIS_SENTINEL_URLS=["127.0.0.1:6383"])
+
+from disredis.disredis_cache.cache import ZLIB_HEADER, DisredisCache
+from disredis.disredis_client import client as client_module
+from disredis.disredis_client import test_client
+from disredis.disredis_client.client import DisredisClient, Node
+
+
+class CacheRedis(test_client.MockStrictRedis):
+    """
+    A mock Redis connection that stores numbers as Redis does, and runs the
+    cache's increment script.
+    """
+    def set(self, key, value, ex=None, px=None, nx=False, xx=False):
+        if not isinstance(value, bytes):
+            value = ("%d" % value).encode("ascii")
+        return super(CacheRedis, self).set(key, value, ex=ex, px=px, nx=nx,
+                                           xx=xx)
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def expire(self, key, time):
+        self.ttls[key] = time
+        return key in self.data
+
+    def persist(self, key):
+        if self.ttls.get(key) is None:
+            return False
+        self.ttls[key] = None
+        return True
+
+    def eval(self, script, numkeys, key, delta):
+        if key not in self.data:
+            return None
+        value = int(self.data[key]) + int(delta)
+        self.data[key] = ("%d" % value).encode("ascii")
+        return value
+
+
+class TestDisredisCache(TestCase):
+    """
+    Unit tests for the cache backend, on two mock Redis nodes.
+    """
+    def setUp(self):
+        self.old_client = DisredisClient.redis_client_class
+        DisredisClient.redis_client_class = CacheRedis
+        Node.redis_client_class = CacheRedis
+        client_module._shared_clients.clear()
+        self.cache = DisredisCache("127.0.0.1:6383, 127.0.0.1:6384", {
+            "TIMEOUT": 300,
+            "OPTIONS": {"COMPRESS_MIN_LENGTH": 100},
+        })
+
+    def tearDown(self):
+        DisredisClient.redis_client_class = self.old_client
+        Node.redis_client_class = self.old_client
+        client_module._shared_clients.clear()
+
+    def _stored(self, key):
+        "Returns the connection holding ``key`` and the key it is stored as"
+        key = self.cache.make_key(key)
+        return self.cache._client.get_node_for_key(key).connection, key
+
+    def test_set_get(self):
+        """
+        Test setting, adding, getting and deleting values.
+        """
+        self.assertEqual(self.cache.get("test"), None)
+        self.assertEqual(self.cache.get("test", "default"), "default")
+        self.cache.set("test", {"a": [1, 2]})
+        self.assertEqual(self.cache.get("test"), {"a": [1, 2]})
+        self.assertTrue(self.cache.has_key("test"))
+
+        self.assertFalse(self.cache.add("test", "other"))
+        self.assertEqual(self.cache.get("test"), {"a": [1, 2]})
+        self.assertTrue(self.cache.add("new", "value"))
+        self.assertEqual(self.cache.get("new"), "value")
+
+        self.assertTrue(self.cache.delete("test"))
+        self.assertFalse(self.cache.delete("test"))
+        self.assertFalse(self.cache.has_key("test"))
+        self.assertEqual(self.cache.get("test", version=2), None)
+
+    def test_get_set_many(self):
+        """
+        Test getting and setting keys spread over both nodes at once.
+        """
+        data = {"a": "one", "b": 2, "c": ["three"]}
+        self.cache.set_many(data)
+        self.assertEqual(self.cache.get_many(["a", "b", "c", "d"]), data)
+        nodes = set(self._stored(key)[0] for key in data)
+        self.assertEqual(len(nodes), 2)
+        self.cache.delete_many(["a", "b"])
+        self.assertEqual(self.cache.get_many(["a", "b", "c"]),
+                         {"c": ["three"]})
+
+    def test_incr_decr(self):
+        """
+        Test that integers are stored as numbers, so that incr() and decr()
+        can be done by Redis, and that a missing key can't be incremented.
+        """
+        self.cache.set("count", 10)
+        connection, key = self._stored("count")
+        self.assertEqual(connection.data[key], b"10")
+        self.assertEqual(self.cache.incr("count"), 11)
+        self.assertEqual(self.cache.incr("count", 5), 16)
+        self.assertEqual(self.cache.decr("count", 6), 10)
+        self.assertEqual(self.cache.get("count"), 10)
+        self.assertRaises(ValueError, self.cache.incr, "missing")
+        self.assertRaises(ValueError, self.cache.decr, "missing")
+
+        self.cache.set("flag", True)
+        self.assertTrue(self.cache.get("flag") is True)
+
+    def test_compression(self):
+        """
+        Test that values are compressed once they are long enough, and read
+        back either way.
+        """
+        self.cache.set("small", "x")
+        self.cache.set("large", "x" * 1000)
+        connection, key = self._stored("small")
+        self.assertNotEqual(connection.data[key][:1], ZLIB_HEADER)
+        connection, key = self._stored("large")
+        self.assertEqual(connection.data[key][:1], ZLIB_HEADER)
+        self.assertTrue(len(connection.data[key]) < 100)
+        self.assertEqual(self.cache.get("small"), "x")
+        self.assertEqual(self.cache.get("large"), "x" * 1000)
+        self.assertEqual(self.cache.get_many(["small", "large"]),
+                         {"small": "x", "large": "x" * 1000})
+
+    def test_timeouts(self):
+        """
+        Test that timeouts become expiries in whole seconds, that None never
+        expires, and that a value that would expire straight away isn't
+        stored.
+        """
+        self.cache.set("default", 1)
+        self.cache.set("short", 1, timeout=0.5)
+        self.cache.set("forever", 1, timeout=None)
+        self.cache.set_many({"many": 1}, timeout=20)
+        for key, ttl in (("default", 300), ("short", 1), ("forever", None),
+                         ("many", 20)):
+            connection, stored = self._stored(key)
+            self.assertEqual(connection.ttls[stored], ttl)
+
+        self.cache.set("default", 1, timeout=0)
+        self.assertFalse(self.cache.has_key("default"))
+        self.assertTrue(self.cache.add("gone", 1, timeout=-1))
+        self.assertFalse(self.cache.has_key("gone"))
+
+        self.assertTrue(self.cache.touch("short", 60))
+        connection, stored = self._stored("short")
+        self.assertEqual(connection.ttls[stored], 60)
+        self.assertTrue(self.cache.touch("short", None))
+        self.assertEqual(connection.ttls[stored], None)
+        self.assertTrue(self.cache.touch("short", 0))
+        self.assertFalse(self.cache.has_key("short"))
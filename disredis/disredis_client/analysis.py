@@ -0,0 +1,203 @@
+"""
+Reports on how data is spread over the masters of a disredis cluster.
+
+distribution_report() compares the share of the keys each master should own,
+given the client's weights, with the share of the keys and memory it
+actually holds. keyspace_report() SCANs every master to find the hashtags
+with the most keys and memory, and how uneven the masters are. Run this
+module to print the reports for a cluster:
+
+    python -m disredis.disredis_client.analysis \\
+        --weight node1=2 --scan SENTINEL_HOST:PORT ...
+
+"""
+from optparse import OptionParser
+
+from redis.exceptions import ResponseError
+
+from disredis.disredis_client.client import DisredisClient, key_hashtag
+from disredis.disredis_client.profiler import SpaceSaving
+
+
+def _share(part, total):
+    return float(part) / total if total else 0.0
+
+
+def distribution_report(client):
+    """
+    Returns a list with a dict for each node of ``client``, giving its
+    ``name``, ``weight``, the ``expected`` share of the keys, the number of
+    ``keys`` it holds and their ``key_share``, and the ``used_memory`` it
+    reports and its ``memory_share``.
+    """
+    slots = client._slots
+    keys = client.dbsize()
+    memory = client.info("memory")
+    total_keys = keys.aggregate
+    total_memory = sum(info.get("used_memory", 0)
+                       for info in memory.values())
+    report = []
+    for index, node in enumerate(client.nodes):
+        used_memory = memory[node.name].get("used_memory", 0)
+        report.append({
+            "name": node.name,
+            "weight": slots.count(index),
+            "expected": _share(slots.count(index), len(slots)),
+            "keys": keys[node.name],
+            "key_share": _share(keys[node.name], total_keys),
+            "used_memory": used_memory,
+            "memory_share": _share(used_memory, total_memory),
+        })
+    return report
+
+
+def format_report(report):
+    "Returns ``report``, from distribution_report(), as a text table"
+    lines = ["%-20s %6s %9s %12s %9s %14s %9s" % ("master", "weight",
+             "expected", "keys", "keys %", "used_memory", "memory %")]
+    for row in report:
+        lines.append("%-20s %6d %8.1f%% %12d %8.1f%% %14d %8.1f%%" % (
+            row["name"], row["weight"], row["expected"] * 100, row["keys"],
+            row["key_share"] * 100, row["used_memory"],
+            row["memory_share"] * 100))
+    return "\n".join(lines)
+
+
+def _scan_node(connection, sample_every, max_keys, scan_count, capacity):
+    """
+    SCAN the keys of one node, counting keys by hashtag and estimating
+    their memory from MEMORY USAGE of every ``sample_every``th key.
+    """
+    keys = sampled = sampled_bytes = 0
+    tag_keys = SpaceSaving(capacity)
+    tag_bytes = SpaceSaving(capacity)
+    memory_usage = True
+    for key in connection.scan_iter(count=scan_count):
+        keys += 1
+        tag = key_hashtag(key)
+        tag_keys.add(tag)
+        if memory_usage and (keys - 1) % sample_every == 0:
+            try:
+                usage = connection.execute_command("MEMORY USAGE", key)
+            except ResponseError:
+                memory_usage = False  # MEMORY USAGE needs Redis 4.0
+            else:
+                if usage is not None:  # the key expired since the SCAN
+                    sampled += 1
+                    sampled_bytes += usage
+                    tag_bytes.add(tag, usage * sample_every)
+        if max_keys and keys >= max_keys:
+            break
+    return {
+        "keys": keys,
+        "sampled": sampled,
+        "estimated_bytes": (sampled_bytes * keys // sampled
+                            if sampled else None),
+        "top_keys": tag_keys.top(),
+        "top_bytes": tag_bytes.top(),
+    }
+
+
+def _skew(values):
+    "Returns the largest of ``values`` divided by their mean"
+    values = [value for value in values if value is not None]
+    if not values or not sum(values):
+        return None
+    return max(values) * len(values) / float(sum(values))
+
+
+def keyspace_report(client, sample_every=100, max_keys=None,
+                    scan_count=1000, top=10):
+    """
+    SCAN every node of ``client`` in parallel, reading MEMORY USAGE of
+    every ``sample_every``th key, and stopping after ``max_keys`` keys on a
+    node if it is set. Returns a dict with:
+
+    ``nodes``, a dict by node name of the number of ``keys``, the number of
+    keys ``sampled`` and the ``estimated_bytes`` they use;
+
+    ``top_keys`` and ``top_bytes``, the ``top`` hashtags with the most keys
+    and the most estimated bytes, as ``(tag, count, error)`` tuples;
+
+    ``key_skew`` and ``byte_skew``, the busiest node's keys and bytes
+    divided by the average, where 1.0 is a perfectly even spread.
+    """
+    capacity = max(top * 10, 100)
+    nodes = list(client.nodes)
+    results = client._execute_on_nodes([
+        (node, lambda connection: _scan_node(connection, sample_every,
+            max_keys, scan_count, capacity))
+        for node in nodes])
+    # Every hashtag lives on one node, so the nodes' counts don't overlap.
+    top_keys = sorted([tag for result in results
+                       for tag in result["top_keys"]],
+                      key=lambda tag: tag[1], reverse=True)
+    top_bytes = sorted([tag for result in results
+                        for tag in result["top_bytes"]],
+                       key=lambda tag: tag[1], reverse=True)
+    return {
+        "nodes": dict((node.name, {"keys": result["keys"],
+                                   "sampled": result["sampled"],
+                                   "estimated_bytes":
+                                       result["estimated_bytes"]})
+                      for node, result in zip(nodes, results)),
+        "top_keys": top_keys[:top],
+        "top_bytes": top_bytes[:top],
+        "key_skew": _skew([result["keys"] for result in results]),
+        "byte_skew": _skew([result["estimated_bytes"] for result in results]),
+    }
+
+
+def format_keyspace_report(report):
+    "Returns ``report``, from keyspace_report(), as text"
+    lines = ["%-20s %12s %16s" % ("master", "keys", "estimated bytes")]
+    for name in sorted(report["nodes"]):
+        node = report["nodes"][name]
+        lines.append("%-20s %12d %16s" % (name, node["keys"],
+                     "-" if node["estimated_bytes"] is None
+                     else node["estimated_bytes"]))
+    for label, skew in (("key", report["key_skew"]),
+                        ("byte", report["byte_skew"])):
+        if skew is not None:
+            lines.append("%s skew (busiest / average): %.2f" % (label, skew))
+    for title, tags in (("hashtags by keys", report["top_keys"]),
+                        ("hashtags by bytes", report["top_bytes"])):
+        lines.append("")
+        lines.append("Top %s:" % title)
+        for tag, count, error in tags:
+            lines.append("  %-40r %14d (+/- %d)" % (tag, count, error))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = OptionParser(
+        usage="%prog [--weight NAME=WEIGHT ...] SENTINEL_HOST:PORT ...",
+        description="Report the expected and actual distribution of keys "
+                    "and memory over the masters of a disredis cluster.")
+    parser.add_option("--weight", action="append", default=[],
+                      metavar="NAME=WEIGHT",
+                      help="weight of a master, as given to the client")
+    parser.add_option("--scan", action="store_true", default=False,
+                      help="also SCAN every master for hot hashtags")
+    parser.add_option("--sample-every", type="int", default=100,
+                      metavar="N",
+                      help="read the MEMORY USAGE of every Nth key scanned")
+    parser.add_option("--max-keys", type="int", default=None, metavar="N",
+                      help="stop scanning a master after N keys")
+    options, addresses = parser.parse_args(argv)
+    if not addresses:
+        parser.error("at least one Sentinel address is needed")
+    weights = {}
+    for weight in options.weight:
+        name, value = weight.rsplit("=", 1)
+        weights[name] = int(value)
+    client = DisredisClient(addresses, weights=weights)
+    print(format_report(distribution_report(client)))
+    if options.scan:
+        print("")
+        print(format_keyspace_report(keyspace_report(client,
+            sample_every=options.sample_every, max_keys=options.max_keys)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Distributed Redis Client for asyncio
+
+The AsyncDisredisClient class finds the masters known to the Sentinels and
+shards keys across them exactly like DisredisClient, so both clients can be
+used on the same data, but it talks to Redis with redis-py's asyncio client.
+It requires Python 3 and redis-py 4.2 or newer.
+
+Nothing is connected until the first command is awaited.
+
+"""
+
+import asyncio
+import logging
+import os
+import weakref
+from functools import wraps
+
+from redis.asyncio import StrictRedis
+from redis.exceptions import ConnectionError
+
+from disredis.disredis_client.client import Node, build_slots, hash_key
+
+
+class AsyncNode(Node):
+    """
+    Represents a single master node in the Redis cluster, connected with an
+    asyncio client.
+    """
+    redis_client_class = StrictRedis
+
+
+def executeOnNode(func):
+    """
+    Decorator that will cause the coroutine to be awaited on the proper
+    redis node. In the case of a Connection failure, it will attempt to find
+    a new master node and perform the action there.
+    """
+    @wraps(func)
+    async def wrapper(self, key, *args, **kwargs):
+        return await self._execute_on_node(func.__name__, key, *args,
+            **kwargs)
+    return wrapper
+
+
+_shared_clients = weakref.WeakKeyDictionary()
+
+
+def get_shared_client(sentinel_addresses, weights=None):
+    """
+    Return the AsyncDisredisClient for ``sentinel_addresses`` that is shared
+    by every caller on the running event loop. asyncio connections belong to
+    the loop they were made on, so each loop gets its own client, and a
+    client created before the process forked is replaced.
+    """
+    clients = _shared_clients.setdefault(asyncio.get_running_loop(), {})
+    key = (tuple(sentinel_addresses), tuple(sorted((weights or {}).items())))
+    client = clients.get(key)
+    if client is None or client.pid != os.getpid():
+        client = clients[key] = AsyncDisredisClient(sentinel_addresses,
+                                                    weights)
+    return client
+
+
+class AsyncDisredisClient(object):
+    """
+    asyncio client object for a cluster of redis servers. The constructor
+    takes a list of Sentinel addresses in the form of "host:port". Redis
+    master nodes will be obtained from the Sentinels when the client is
+    first used. ``weights`` are master weights, as for DisredisClient.
+    """
+    redis_client_class = StrictRedis
+    node_class = AsyncNode
+    sentinel = None
+    nodes = None
+
+    def __init__(self, sentinel_addresses, weights=None):
+        self.pid = os.getpid()
+        self.weights = weights or {}
+        self.sentinel_addresses = list(sentinel_addresses)
+        self._nodes_lock = asyncio.Lock()
+
+    def _connect(self):
+        """
+        Create the connection to the next sentinel in line.
+        """
+        try:
+            address = self.sentinel_addresses.pop(0)
+        except IndexError:
+            raise ConnectionError("Out of available Sentinel addresses!")
+        logger = logging.getLogger('custommade_logging')
+        logger.info("Connecting to Sentinel %s" % address)
+        host, port = address.split(":")
+        self.sentinel = self.redis_client_class(host, int(port),
+            decode_responses=True)
+        self.sentinel_addresses.append(address)
+
+    async def _execute_sentinel_command(self, *args, **kwargs):
+        """
+        Run a command on a sentinel, but fail over to the next sentinel in the
+        list if there's a connection problem.
+        """
+        while True:
+            try:
+                if self.sentinel is None:
+                    self._connect()
+                return await self.sentinel.execute_command("SENTINEL", *args,
+                    **kwargs)
+            except ConnectionError:
+                self.sentinel = None
+                if self.sentinel_addresses:
+                    self.sentinel_addresses.pop()  # pull the current connection off
+                else:
+                    raise
+
+    async def _get_nodes(self):
+        """
+        Retrieve the list of nodes and their masters from the Sentinel server.
+        """
+        masterList = await self._execute_sentinel_command("MASTERS")
+        nodes = []
+        for master in masterList:
+            info = dict(zip(master[::2], master[1::2]))
+            nodes.append(self.node_class(info["name"], info["ip"],
+                info["port"]))
+        self._slots = build_slots(nodes, self.weights)
+        self.nodes = nodes
+
+    async def initialize(self):
+        """
+        Find the master nodes, unless that has already been done.
+        """
+        if self.nodes is None:
+            async with self._nodes_lock:
+                if self.nodes is None:
+                    await self._get_nodes()
+
+    async def get_master(self, node):
+        """
+        Returns the current master for a node. If it's different from the
+        passed in node, update our node list accordingly.
+        """
+        host, port = await self._execute_sentinel_command(
+            "get-master-addr-by-name", node.name)
+        if host == node.host and port == node.port:
+            return node
+        newNode = self.node_class(node.name, host, port)
+        self.nodes[self.nodes.index(node)] = newNode
+        return newNode
+
+    def get_node_for_key(self, key):
+        """
+        Returns a node for the given key, chosen the same way as
+        DisredisClient.get_node_for_key.
+        """
+        return self.nodes[self._slots[hash_key(key) % len(self._slots)]]
+
+    async def _execute_on_node(self, command, key, *args, **kwargs):
+        """
+        Await ``command`` on the node for ``key``.
+        """
+        return await self._execute_with_failover(key,
+            lambda connection: getattr(connection, command)(key, *args,
+                **kwargs))
+
+    async def _execute_with_failover(self, key, func):
+        """
+        Await ``func`` called with the connection to the node for ``key``. In
+        the case of a Connection failure, find the new master for the node
+        and try again with that connection.
+        """
+        await self.initialize()
+        node = self.get_node_for_key(key)
+        try:
+            return await func(node.connection)
+        except ConnectionError:
+            # if it fails a second time, then sentinel hasn't caught up, so
+            # we have no choice but to fail for real.
+            node = await self.get_master(node)
+            return await func(node.connection)
+
+    async def aclose(self):
+        "Close the connections to the sentinel and to every node"
+        for node in self.nodes or []:
+            await node.connection.aclose()
+        if self.sentinel is not None:
+            await self.sentinel.aclose()
+
+    async def get_with_ttl(self, name):
+        """
+        Return a ``(value, ttl)`` tuple for key ``name``, fetched from its
+        node in a single round trip.
+        """
+        async def get_with_ttl(connection):
+            pipe = connection.pipeline(transaction=False)
+            pipe.get(name)
+            pipe.ttl(name)
+            value, ttl = await pipe.execute()
+            # Match the sync client, where a missing ttl is None.
+            return value, ttl if ttl >= 0 else None
+        return await self._execute_with_failover(name, get_with_ttl)
+
+    async def delete(self, *names):
+        "Delete one or more keys specified by ``names``"
+        await self.initialize()
+        groups = {}
+        for name in names:
+            groups.setdefault(self.get_node_for_key(name), []).append(name)
+        counts = await asyncio.gather(*[
+            self._execute_with_failover(keys[0],
+                lambda connection, keys=keys: connection.delete(*keys))
+            for keys in groups.values()])
+        return sum(counts)
+
+    #### BASIC KEY COMMANDS ####
+    @executeOnNode
+    async def exists(self, name):
+        "Returns a boolean indicating whether key ``name`` exists"
+
+    @executeOnNode
+    async def expire(self, name, time):
+        """
+        Set an expire flag on key ``name`` for ``time`` seconds. ``time``
+        can be represented by an integer or a Python timedelta object.
+        """
+
+    @executeOnNode
+    async def get(self, name):
+        """
+        Return the value at key ``name``, or None if the key doesn't exist
+        """
+
+    @executeOnNode
+    async def incr(self, name, amount=1):
+        """
+        Increments the value of ``key`` by ``amount``.  If no key exists,
+        the value will be initialized as ``amount``
+        """
+
+    @executeOnNode
+    async def persist(self, name):
+        "Removes an expiration on ``name``"
+
+    @executeOnNode
+    async def set(self, name, value, ex=None, px=None, nx=False, xx=False):
+        """
+        Set the value at key ``name`` to ``value``
+
+        ``ex`` sets an expire flag on key ``name`` for ``ex`` seconds.
+
+        ``px`` sets an expire flag on key ``name`` for ``px`` milliseconds.
+
+        ``nx`` if set to True, set the value at key ``name`` to ``value`` if it
+            does not already exist.
+
+        ``xx`` if set to True, set the value at key ``name`` to ``value`` if it
+            already exists.
+        """
+
+    @executeOnNode
+    async def setex(self, name, time, value):
+        """
+        Set the value of key ``name`` to ``value`` that expires in ``time``
+        seconds. ``time`` can be represented by an integer or a Python
+        timedelta object.
+        """
+
+    @executeOnNode
+    async def ttl(self, name):
+        "Returns the number of seconds until the key ``name`` will expire"
+
+    #### HASH COMMANDS ####
+    @executeOnNode
+    async def hdel(self, name, *keys):
+        "Delete ``keys`` from hash ``name``"
+
+    @executeOnNode
+    async def hget(self, name, key):
+        "Return the value of ``key`` within the hash ``name``"
+
+    @executeOnNode
+    async def hgetall(self, name):
+        "Return a Python dict of the hash's name/value pairs"
+
+    @executeOnNode
+    async def hset(self, name, key, value):
+        """
+        Set ``key`` to ``value`` within hash ``name``
+        Returns 1 if HSET created a new field, otherwise 0
+        """
@@ -0,0 +1,187 @@
+"""
+Write-behind buffering of counter and set updates.
+
+A WriteBuffer takes incr, hincrby, sadd and zincrby calls and, instead of
+sending each one to Redis, merges them in memory: every increment of the
+same key (or hash field, or sorted set member) is added up, and set
+members are collected. The merged writes are sent in one pipeline per
+node when the buffer holds ``max_items`` of them, every ``flush_interval``
+seconds, and when the process exits.
+
+Writes are fire and forget: the calls don't return the new values, and
+writes still in the buffer are lost if the process dies, or dropped if
+they can't be sent when the buffer is flushed. A write that Redis refuses,
+such as an incr of a key holding a set, is dropped on its own.
+
+Neither the exit hook nor the flushing thread keeps a buffer alive, but
+one that is thrown away loses the writes it still holds, so buffers
+should be closed once they are no longer needed. The one returned by
+DisredisClient.write_buffer() is kept for the life of the client.
+
+"""
+import atexit
+import logging
+import threading
+import weakref
+
+
+class WriteBuffer(object):
+    """
+    Buffer of merged writes for ``client``, made with
+    DisredisClient.write_buffer(). At most ``max_items`` merged writes
+    (counting each set member as one) are held before they are flushed; a
+    background thread also flushes every ``flush_interval`` seconds, unless
+    it is None.
+    """
+    def __init__(self, client, max_items=10000, flush_interval=1.0):
+        self.client = client
+        self.max_items = max_items
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._size = 0
+        self._closed = threading.Event()
+        self.calls = 0
+        self.flushes = 0
+        self.sent = 0
+        self.dropped = 0
+        atexit.register(_close_at_exit, weakref.ref(self))
+        if flush_interval:
+            thread = threading.Thread(target=_flush_periodically,
+                args=(weakref.ref(self), self._closed, flush_interval))
+            thread.daemon = True
+            thread.start()
+
+    def _add(self, entry, amount=None, members=None):
+        """
+        Merge a write into the buffer. ``entry`` is ``(command, key, field)``
+        where field is None for incr and sadd.
+        """
+        with self._lock:
+            self.calls += 1
+            if members is not None:
+                pending = self._pending.setdefault(entry, set())
+                size = len(pending)
+                pending.update(members)
+                self._size += len(pending) - size
+            else:
+                if entry not in self._pending:
+                    self._size += 1
+                self._pending[entry] = self._pending.get(entry, 0) + amount
+            full = self._size >= self.max_items
+        if full:
+            self.flush()
+
+    def incr(self, name, amount=1):
+        "Increment the value of key ``name`` by ``amount``"
+        self._add(("INCRBY", name, None), amount=amount)
+
+    def hincrby(self, name, key, amount=1):
+        "Increment the value of ``key`` in hash ``name`` by ``amount``"
+        self._add(("HINCRBY", name, key), amount=amount)
+
+    def sadd(self, name, *values):
+        "Add ``value(s)`` to set ``name``"
+        self._add(("SADD", name, None), members=values)
+
+    def zincrby(self, name, value, amount=1):
+        "Increment the score of ``value`` in sorted set ``name`` by ``amount``"
+        self._add(("ZINCRBY", name, value), amount=amount)
+
+    def __len__(self):
+        return self._size
+
+    def flush(self):
+        """
+        Send every buffered write, in one pipeline per node, with the nodes
+        written to in parallel. Writes to a node that fails, and writes
+        that Redis refuses, are dropped and counted in ``dropped``.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._size = 0
+            if not pending:
+                return
+            commands = []
+            for (command, key, field), value in pending.items():
+                if command == "SADD":
+                    args = (command, key) + tuple(value)
+                elif command == "INCRBY":
+                    args = (command, key, value)
+                elif command == "HINCRBY":
+                    args = (command, key, field, value)
+                else:  # ZINCRBY
+                    args = (command, key, value, field)
+                commands.append(args)
+
+            def pipeline(indexes):
+                def execute(connection):
+                    pipe = connection.pipeline(transaction=False)
+                    for index in indexes:
+                        pipe.execute_command(*commands[index])
+                    return pipe.execute(raise_on_error=False)
+                return execute
+            groups = self.client._group_by_node(
+                [command[1] for command in commands])
+            results = self.client._execute_on_nodes(
+                [(node, pipeline(indexes)) for node, indexes in groups],
+                raise_errors=False)
+            self.flushes += 1
+            for (node, indexes), result in zip(groups, results):
+                if isinstance(result, Exception):
+                    errors = [result] * len(indexes)
+                else:
+                    errors = [value for value in result
+                              if isinstance(value, Exception)]
+                self.sent += len(indexes) - len(errors)
+                if errors:
+                    self.dropped += len(errors)
+                    logger = logging.getLogger('custommade_logging')
+                    logger.warning("Dropped %d buffered writes to %s: %s" %
+                                   (len(errors), node.name, errors[0]))
+
+    def close(self):
+        "Flush the buffer and stop flushing it in the background"
+        self._closed.set()
+        self.flush()
+
+    def stats(self):
+        """
+        Returns a dict with the number of ``calls`` made, ``pending`` merged
+        writes, ``flushes``, and merged writes ``sent`` and ``dropped``.
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "pending": self._size,
+                "flushes": self.flushes,
+                "sent": self.sent,
+                "dropped": self.dropped,
+            }
+
+
+def _flush_periodically(ref, closed, interval):
+    """
+    Flush the WriteBuffer ``ref`` refers to every ``interval`` seconds
+    until ``closed`` is set or the buffer is gone.
+    """
+    while not closed.is_set():
+        closed.wait(interval)
+        buffer = ref()
+        if buffer is None:
+            return
+        try:
+            buffer.flush()
+        except Exception:
+            logger = logging.getLogger('custommade_logging')
+            logger.exception("Couldn't flush the write buffer")
+        del buffer
+
+
+def _close_at_exit(ref):
+    "Close the WriteBuffer ``ref`` refers to, if it is still around"
+    buffer = ref()
+    if buffer is not None:
+        buffer.close()
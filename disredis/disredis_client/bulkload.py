@@ -0,0 +1,205 @@
+"""
+Bulk loading of keys into a disredis cluster.
+
+bulk_load() routes each ``(key, value)`` record to the node that owns it and
+hands the records to one worker thread per node in batches, each written in
+a single pipeline, so that every master is loaded in parallel. The queue of
+batches for a node is bounded, so reading the records is held up while a
+node falls behind, rather than the records piling up in memory. Run this
+module to load a file of tab separated keys and values:
+
+    python -m disredis.disredis_client.bulkload \\
+        --file data.tsv SENTINEL_HOST:PORT ...
+
+"""
+import logging
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+try:
+    from queue import Queue
+except ImportError:  # Python 2
+    from Queue import Queue
+
+from redis.exceptions import ConnectionError
+
+from disredis.disredis_client.client import DisredisClient
+
+
+class BulkLoader(object):
+    """
+    Loads records into ``client``, in pipelines of ``batch_size`` SETs per
+    node, with the keys given a time to live of ``ttl`` seconds if it is
+    set. At most ``queue_size`` batches wait for each node. A batch that
+    fails is retried ``retries`` times, ``retry_delay`` seconds apart, to
+    ride out a fail-over; if it still fails, its records are counted as
+    ``failed`` and the load goes on.
+    """
+    def __init__(self, client, batch_size=1000, queue_size=10, ttl=None,
+                 retries=3, retry_delay=1.0):
+        self.client = client
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.ttl = ttl
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self.loaded = {}
+        self.failed = 0
+
+    def _node(self, name):
+        "Returns the current node named ``name``, which changes on fail-over"
+        for node in self.client.nodes:
+            if node.name == name:
+                return node
+        raise ConnectionError("No master named %s" % name)
+
+    def _write(self, name, batch):
+        codec = self.client.codec
+
+        def execute(connection):
+            pipe = connection.pipeline(transaction=False)
+            for key, value in batch:
+                if codec is not None:
+                    value = codec.encode(value)
+                pipe.set(key, value, ex=self.ttl)
+            return pipe.execute()
+        attempt = 0
+        while True:
+            try:
+                # Finds the node's new master after a ConnectionError.
+                return self.client._execute_with_failover(self._node(name),
+                                                          execute)
+            except ConnectionError:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                time.sleep(self.retry_delay)
+
+    def _work(self, name, queue):
+        while True:
+            batch = queue.get()
+            if batch is None:
+                return
+            try:
+                self._write(name, batch)
+            except Exception as e:
+                with self._lock:
+                    self.failed += len(batch)
+                logger = logging.getLogger('custommade_logging')
+                logger.error("Couldn't load %d keys into %s: %s" %
+                             (len(batch), name, e))
+            else:
+                with self._lock:
+                    self.loaded[name] = self.loaded.get(name, 0) + len(batch)
+
+    def load(self, records):
+        """
+        Load ``records``, an iterable of ``(key, value)`` pairs, returning
+        the load's stats() once every record has been written.
+        """
+        start = time.time()
+        queues = {}
+        batches = {}
+        threads = []
+        for node in self.client.nodes:
+            queues[node.name] = Queue(self.queue_size)
+            batches[node.name] = []
+            thread = threading.Thread(target=self._work,
+                                      args=(node.name, queues[node.name]))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            for key, value in records:
+                name = self.client.get_node_for_key(key).name
+                batch = batches[name]
+                batch.append((key, value))
+                if len(batch) >= self.batch_size:
+                    queues[name].put(batch)  # waits while the node is behind
+                    batches[name] = []
+        finally:
+            for name, queue in queues.items():
+                if batches[name]:
+                    queue.put(batches[name])
+                queue.put(None)
+            for thread in threads:
+                thread.join()
+        return self.stats(time.time() - start)
+
+    def stats(self, seconds):
+        """
+        Returns a dict with the number of records ``loaded`` in total and by
+        node (``nodes``), the number that ``failed``, and the ``seconds``
+        taken and the resulting ``rate`` in records per second.
+        """
+        with self._lock:
+            loaded = sum(self.loaded.values())
+            return {
+                "loaded": loaded,
+                "nodes": dict(self.loaded),
+                "failed": self.failed,
+                "seconds": seconds,
+                "rate": loaded / seconds if seconds else None,
+            }
+
+
+def bulk_load(client, records, batch_size=1000, queue_size=10, ttl=None):
+    """
+    Load ``records``, an iterable of ``(key, value)`` pairs, into ``client``
+    with a BulkLoader, returning its stats.
+    """
+    return BulkLoader(client, batch_size=batch_size, queue_size=queue_size,
+                      ttl=ttl).load(records)
+
+
+def read_records(lines, separator="\t"):
+    "Generate ``(key, value)`` records from ``lines`` of separated text"
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line:
+            key, value = line.split(separator, 1)
+            yield key, value
+
+
+def main(argv=None):
+    parser = OptionParser(
+        usage="%prog [--file PATH] SENTINEL_HOST:PORT ...",
+        description="Load keys and values, one per line separated by a tab, "
+                    "into a disredis cluster.")
+    parser.add_option("--file", default=None, metavar="PATH",
+                      help="file to load (standard input by default)")
+    parser.add_option("--separator", default="\t",
+                      help="separator between a key and its value")
+    parser.add_option("--ttl", type="int", default=None, metavar="SECONDS",
+                      help="time to live of the loaded keys")
+    parser.add_option("--batch-size", type="int", default=1000, metavar="N",
+                      help="keys written to a master in each pipeline")
+    parser.add_option("--queue-size", type="int", default=10, metavar="N",
+                      help="batches waiting for a master before reading "
+                           "is held up")
+    options, addresses = parser.parse_args(argv)
+    if not addresses:
+        parser.error("at least one Sentinel address is needed")
+    client = DisredisClient(addresses)
+    lines = open(options.file) if options.file else sys.stdin
+    try:
+        stats = bulk_load(client, read_records(lines, options.separator),
+                          batch_size=options.batch_size,
+                          queue_size=options.queue_size, ttl=options.ttl)
+    finally:
+        if options.file:
+            lines.close()
+    for name in sorted(stats["nodes"]):
+        print("%-20s %12d" % (name, stats["nodes"][name]))
+    print("Loaded %d keys in %.1f seconds (%d keys/s), %d failed" % (
+        stats["loaded"], stats["seconds"], stats["rate"] or 0,
+        stats["failed"]))
+    if stats["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -16,18 +16,69 @@ when Sentinel executes the fail-over procedure.
 """
 
 import logging
+import os
+import random
+import threading
+import time
 from hashlib import sha1
 from functools import wraps
 
-from redis.client import StrictRedis
-from redis.exceptions import ConnectionError
+import redis
+from redis.client import StrictRedis, list_or_args
+from redis.exceptions import ConnectionError, DataError, LockError, WatchError
+
+from disredis.disredis_client.batching import WriteBuffer
+from disredis.disredis_client.codecs import decode_result, encode_arguments
+from disredis.disredis_client.coalesce import SingleFlight, copy_result
+from disredis.disredis_client.health import HealthChecker
+from disredis.disredis_client.keyspec import (MERGE_LIST, get_key_spec,
+    is_connection_command, merge_results)
+from disredis.disredis_client.pipeline import DisredisPipeline
+from disredis.disredis_client.profiler import value_size
+from disredis.disredis_client.redlock import LockMetrics, Redlock
+from disredis.disredis_client.structures import (PartitionedHash,
+    PartitionedSortedSet, ShardedCounter)
+from disredis.disredis_client.topology import load_topology, save_topology
+from disredis.disredis_client.tracing import CommandTrace
+
+try:
+    long
+except NameError:  # Python 3
+    long = int
+
+
+# Commands that only read data. Concurrent identical calls to these can safely
+# share a single round trip.
+READ_ONLY_COMMANDS = frozenset([
+    "bitcount", "exists", "get", "getbit", "getrange", "hexists", "hget",
+    "hgetall", "hkeys", "hlen", "hmget", "hscan", "hvals", "lindex", "llen",
+    "lrange",
+    "pttl", "scard", "sismember", "smembers", "strlen", "substr", "ttl",
+    "type", "zcard", "zcount", "zrange", "zrangebyscore", "zrank",
+    "zrevrange", "zrevrangebyscore", "zrevrank", "zscore",
+])
+
+
+def pool_connection(pool):
+    """
+    Take a connection from ``pool``. redis-py 5.3 deprecated the command
+    name that older versions need to be given.
+    """
+    if redis.VERSION >= (5, 3):
+        return pool.get_connection()
+    return pool.get_connection("PING")
 
 
 class Node(object):
     """
     Represents a single master node in the Redis cluster.
+
+    ``latency`` (an average PING round trip in seconds) and ``is_down`` are
+    kept up to date by the client's HealthChecker, if it has one.
     """
     redis_client_class = StrictRedis
+    latency = None
+    is_down = False
 
     def __init__(self, name, host, port):
         self.name = name
@@ -38,6 +89,72 @@ class Node(object):
         self.connection = self.redis_client_class(host, int(port))
 
 
+class NodeResults(dict):
+    """
+    The results of a command run on every node, keyed by node name, with the
+    results for the cluster as a whole combined into ``aggregate``.
+    """
+    def __init__(self, results, aggregate):
+        super(NodeResults, self).__init__(results)
+        self.aggregate = aggregate
+
+
+# INFO fields that are added up across nodes: counters, rates, memory and
+# the keyspace. Fields starting with one of SUMMED_INFO_PREFIXES are too.
+SUMMED_INFO_FIELDS = frozenset([
+    "blocked_clients", "calls", "connected_clients", "connected_slaves",
+    "count", "evicted_keys", "expired_keys", "expires", "failed_calls",
+    "instantaneous_input_kbps", "instantaneous_ops_per_sec",
+    "instantaneous_output_kbps", "keys", "keyspace_hits", "keyspace_misses",
+    "maxmemory", "pubsub_channels", "pubsub_patterns",
+    "rdb_changes_since_last_save", "rejected_calls", "rejected_connections",
+    "sync_full", "sync_partial_err", "sync_partial_ok", "usec",
+])
+SUMMED_INFO_PREFIXES = ("total_", "used_memory")
+# INFO fields for which the worst node speaks for the cluster.
+MAX_INFO_FIELDS = frozenset([
+    "latest_fork_usec", "mem_fragmentation_ratio",
+])
+MIN_INFO_FIELDS = frozenset([
+    "rdb_last_save_time", "uptime_in_days", "uptime_in_seconds",
+])
+
+
+def merge_info(infos):
+    """
+    Combine the INFO dicts of several nodes into one. Counters, rates and
+    memory sizes, such as keyspace_hits, instantaneous_ops_per_sec or
+    used_memory, are added up, and so are the keys in the per-database
+    sections. A few fields take the worst node's value instead, such as the
+    highest mem_fragmentation_ratio or the lowest uptime_in_seconds. Any
+    other value, such as process_id or tcp_port, is kept if every node
+    reports the same one, and can otherwise be found in the per-node INFO.
+    """
+    merged = {}
+    for field in set().union(*infos):
+        values = [info[field] for info in infos if field in info]
+        numeric = all(isinstance(value, (int, long, float)) and
+                      not isinstance(value, bool) for value in values)
+        if all(isinstance(value, dict) for value in values):
+            merged[field] = merge_info(values)
+        elif numeric and (field in SUMMED_INFO_FIELDS or
+                          field.startswith(SUMMED_INFO_PREFIXES)):
+            merged[field] = sum(values)
+        elif numeric and field in MAX_INFO_FIELDS:
+            merged[field] = max(values)
+        elif numeric and field in MIN_INFO_FIELDS:
+            merged[field] = min(values)
+        elif all(value == values[0] for value in values):
+            merged[field] = values[0]
+    return merged
+
+
+def common_items(dicts):
+    "Returns the items that have the same value in every one of ``dicts``"
+    return dict((field, value) for field, value in dicts[0].items()
+                if all(d.get(field) == value for d in dicts[1:]))
+
+
 def executeOnNode(func):
     """
     Decorator that will cause the function to be executed on the proper
@@ -46,37 +163,196 @@ def executeOnNode(func):
     """
     @wraps(func)
     def wrapper(self, key, *args, **kwargs):
-        node = self.get_node_for_key(key)
-        nodeFunc = getattr(node.connection, func.__name__)
-        try:
-            return nodeFunc(key, *args, **kwargs)
-        except ConnectionError:
-            # if it fails a second time, then sentinel hasn't caught up, so
-            # we have no choice but to fail for real.
-            node = self.get_master(node)
-            nodeFunc = getattr(node.connection, func.__name__)
-            return nodeFunc(key, *args, **kwargs)
+        return self._execute_on_node(func.__name__, key, *args, **kwargs)
     return wrapper
 
 
+def key_hashtag(key):
+    """
+    Returns the part of ``key`` that it is sharded on, as bytes: the string
+    between the brackets for keys with {} in them, otherwise the whole key.
+    """
+    if not isinstance(key, bytes):
+        key = key.encode("utf-8")
+    if b"{" in key and b"}" in key:
+        key = key[key.index(b"{") + 1: key.index(b"}")]
+    return key
+
+
+def hash_key(key):
+    """
+    Returns the integer hash used to shard ``key``. Keys with {} in them are
+    hashed on only the string between the brackets.
+    """
+    return int(sha1(key_hashtag(key)).hexdigest(), 16)
+
+
+def build_slots(nodes, weights=None):
+    """
+    Returns the slot table used to shard keys over ``nodes``: a list of node
+    indexes in which each node appears as many times as its weight in
+    ``weights``, a dict keyed by master name, so that it owns that share of
+    the keys. Nodes without a weight have a weight of 1, and with every
+    weight 1 the table is just the nodes in order.
+    """
+    weights = weights or {}
+    slots = []
+    for index, node in enumerate(nodes):
+        slots.extend([index] * int(weights.get(node.name, 1)))
+    if not slots:
+        raise ValueError("At least one node needs a weight above 0")
+    return slots
+
+
+def _hashable(value):
+    if isinstance(value, dict):
+        return tuple(sorted(value.items()))
+    return value
+
+
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+# Clients created before a fork. They are never used again, but are kept
+# referenced because redis-py shuts down the sockets of a connection when it
+# is garbage collected, and the parent process is still using them.
+_inherited_clients = []
+
+
+def get_shared_client(sentinel_addresses, **kwargs):
+    """
+    Return the DisredisClient for ``sentinel_addresses`` that is shared by
+    every caller in this process, creating it on first use rather than at
+    import time. A client created before the process forked is replaced, so
+    forked workers never share sockets with their parent or each other.
+    Keyword arguments that are None are left out, so that passing None
+    gets the same client as not passing the argument.
+    """
+    kwargs = dict((name, value) for name, value in kwargs.items()
+                  if value is not None)
+    key = (tuple(sentinel_addresses),
+           tuple(sorted((name, _hashable(value))
+                        for name, value in kwargs.items())))
+    pid = os.getpid()
+    client = _shared_clients.get(key)
+    if client is not None and client.pid == pid:
+        return client
+    with _shared_clients_lock:
+        client = _shared_clients.get(key)
+        if client is None or client.pid != pid:
+            if client is not None:
+                _inherited_clients.append(client)
+            client = DisredisClient(list(sentinel_addresses), **kwargs)
+            _shared_clients[key] = client
+        return client
+
+
 class DisredisClient(object):
     """
     StrictRedis-compatible client object for a cluster of redis servers. The
     constructor takes a list of Sentinel addresses in the form of "host:port".
     Redis master nodes will be obtained from the Sentinels.
+
+    If ``coalesce_reads`` is True, concurrent identical read commands made
+    from different threads share a single round trip and its result, each
+    getting its own copy of a dict, list or set.
+
+    ``codec`` is an optional object with ``encode`` and ``decode`` methods,
+    such as codecs.ZlibCodec, applied to the values of commands that store
+    and read values.
+
+    If ``health_check_interval`` is set, a background HealthChecker PINGs
+    every node and sentinel at that interval in seconds, and looks up the
+    new master of any node it finds down. Commands for that node go to
+    whichever master it found. Without a checker, a command whose
+    connection fails asks the Sentinels for the node's master, at most once
+    every ``master_lookup_interval`` seconds for each node.
+
+    Connections are normally opened on first use. With ``warm_connections``
+    set, that many connections to every node are opened in parallel while
+    the client is created, waiting at most ``startup_timeout`` seconds for
+    them before carrying on; any that are still connecting then are left to
+    finish in the background.
+
+    ``topology_cache`` is the path of a file in which to keep a snapshot of
+    the masters. If it exists when the client is created, the masters in it
+    are used straight away and checked against the Sentinels in a
+    background thread.
+
+    ``weights`` maps master names to integer weights, for clusters whose
+    masters differ in size: each master owns a share of the keys in
+    proportion to its weight (1 for masters not in it). Changing the
+    weights moves most keys to a different master, like adding a master.
+
+    ``profiler`` is an optional profiler.KeyProfiler, which is given a
+    sample of the commands sent to find hot nodes and hashtags.
+
+    ``hedged_reads`` is an optional hedge.HedgedReads. With it, a read-only
+    command that a master is slow to answer is also sent to one of its
+    replicas, and the first answer is used.
+
+    ``hooks`` is an optional list of hooks, such as tracing.SlowLog, called
+    before and after every command sent to a node; see add_hook().
     """
     redis_client_class = StrictRedis
     sentinel = None
     nodes = None
-
-    def __init__(self, sentinel_addresses):
+    read_coalescer = None
+    codec = None
+    health_checker = None
+    topology_cache = None
+    profiler = None
+    hedged_reads = None
+    # The fewest seconds between Sentinel lookups of a node's master after
+    # commands to it fail, when there is no health checker to do them.
+    master_lookup_interval = 1.0
+
+    def __init__(self, sentinel_addresses, coalesce_reads=False, codec=None,
+                 health_check_interval=None, warm_connections=0,
+                 startup_timeout=None, topology_cache=None, weights=None,
+                 profiler=None, hedged_reads=None, hooks=None):
+        self.pid = os.getpid()
         self.sentinel_addresses = sentinel_addresses
-        self._get_nodes()
+        # Held while a node is replaced by its new master, and while master
+        # lookups and write buffers are recorded.
+        self._nodes_lock = threading.Lock()
+        self._master_lookups = {}
+        self._write_buffers = {}
+        if coalesce_reads:
+            # Results such as hgetall's dict are copied for each caller.
+            self.read_coalescer = SingleFlight(share=copy_result)
+        self.codec = codec
+        self._computations = SingleFlight()
+        self.weights = weights or {}
+        self.profiler = profiler
+        self.hedged_reads = hedged_reads
+        self._hooks = list(hooks or [])
+        self.redlock_metrics = LockMetrics()
+        self.topology_cache = topology_cache
+        masters = topology_cache and load_topology(topology_cache)
+        if masters:
+            nodes = [Node(name, host, port) for name, host, port in masters]
+            self._slots = build_slots(nodes, self.weights)
+            self.nodes = nodes
+            self._revalidation = threading.Thread(
+                target=self._revalidate_nodes)
+            self._revalidation.daemon = True
+            self._revalidation.start()
+        else:
+            self._get_nodes()
+        if warm_connections:
+            self.warm_up(warm_connections, startup_timeout)
+        if health_check_interval:
+            self.health_checker = HealthChecker(self, health_check_interval)
+            self.health_checker.start()
 
     def _connect(self):
         """
-        Connect to a sentinel, accounting for sentinels that fail.
+        Connect to a sentinel, accounting for sentinels that fail. With a
+        health checker, the fastest sentinel that is up is tried first.
         """
+        if self.health_checker is not None:
+            self.sentinel_addresses.sort(
+                key=self.health_checker.sentinel_rank)
         while True:
             try:
                 address = self.sentinel_addresses.pop(0)
@@ -115,10 +391,88 @@ class DisredisClient(object):
         Retrieve the list of nodes and their masters from the Sentinel server.
         """
         masterList = self._execute_sentinel_command("MASTERS")
-        self.nodes = []
+        # Keep the nodes that haven't changed, and their connections.
+        current = dict(((node.name, node.host, node.port), node)
+                       for node in self.nodes or [])
+        nodes = []
         for master in masterList:
             info = dict(zip(master[::2], master[1::2]))
-            self.nodes.append(Node(info["name"], info["ip"], info["port"]))
+            address = (info["name"], info["ip"], info["port"])
+            nodes.append(current.get(address) or Node(*address))
+        slots = build_slots(nodes, self.weights)
+        # Swap both together, so a lookup never mixes new slots with the
+        # old nodes.
+        with self._nodes_lock:
+            self.nodes = nodes
+            self._slots = slots
+            self._save_topology()
+
+    def _revalidate_nodes(self):
+        """
+        Replace the nodes loaded from the topology snapshot with the masters
+        the Sentinels know about, if they can be reached.
+        """
+        try:
+            self._get_nodes()
+        except Exception:
+            logger = logging.getLogger('custommade_logging')
+            logger.exception("Couldn't check the topology snapshot against "
+                             "the Sentinels")
+
+    def _save_topology(self):
+        "Write the current masters to the topology snapshot, if there is one"
+        if self.topology_cache is None:
+            return
+        try:
+            save_topology(self.topology_cache, self.nodes)
+        except (IOError, OSError):
+            logger = logging.getLogger('custommade_logging')
+            logger.exception("Couldn't save the topology snapshot")
+
+    def warm_up(self, count, timeout=None):
+        """
+        Open ``count`` pooled connections to every node, all at the same
+        time. Returns once they are open, or after ``timeout`` seconds.
+        Failures are logged and otherwise ignored; a node that can't be
+        reached is dealt with when it is first used.
+        """
+        # Every connection is kept out of its pool until all of them are
+        # open, so that each thread opens a new one.
+        opened = []
+        lock = threading.Lock()
+        done = []
+
+        def connect(node):
+            pool = node.connection.connection_pool
+            try:
+                connection = pool_connection(pool)
+                connection.connect()
+            except Exception:
+                logger = logging.getLogger('custommade_logging')
+                logger.warning("Couldn't open a connection to %s - %s:%s" %
+                               (node.name, node.host, node.port))
+                return
+            with lock:
+                if done:
+                    pool.release(connection)
+                else:
+                    opened.append((pool, connection))
+
+        threads = [threading.Thread(target=connect, args=(node,))
+                   for node in self.nodes for i in range(count)]
+        deadline = None if timeout is None else time.time() + timeout
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            if deadline is None:
+                thread.join()
+            else:
+                thread.join(max(deadline - time.time(), 0))
+        with lock:
+            done.append(True)
+            for pool, connection in opened:
+                pool.release(connection)
 
     def get_master(self, node):
         """
@@ -129,19 +483,465 @@ class DisredisClient(object):
             node.name)
         if host == node.host and port == node.port:
             return node
-        newNode = Node(node.name, host, port)
-        self.nodes[self.nodes.index(node)] = newNode
+        with self._nodes_lock:
+            for index, current in enumerate(self.nodes):
+                if current.name == node.name:
+                    break
+            else:
+                return node
+            if current.host == host and current.port == port:
+                return current  # another thread has replaced it already
+            newNode = Node(node.name, host, port)
+            self.nodes[index] = newNode
+            self._save_topology()
         return newNode
 
+    def _current_node(self, node):
+        "Returns the node in the node list with the same name as ``node``"
+        for current in self.nodes:
+            if current.name == node.name:
+                return current
+        return node
+
+    def _new_master(self, node):
+        """
+        Returns the node to retry a command on after the connection to
+        ``node`` failed. If there is a health checker, it looks up new
+        masters itself, so this is the last one it found. Otherwise the
+        Sentinel is asked, but no more than once every
+        ``master_lookup_interval`` seconds for each node, so that a dead
+        master with lots of traffic doesn't flood it with lookups.
+        """
+        if self.health_checker is None:
+            now = time.time()
+            with self._nodes_lock:
+                due = (now - self._master_lookups.get(node.name, 0) >=
+                       self.master_lookup_interval)
+                if due:
+                    self._master_lookups[node.name] = now
+            if due:
+                return self.get_master(node)
+        return self._current_node(node)
+
+    def get_replica(self, node):
+        """
+        Returns a Node for a replica of ``node`` that the Sentinel considers
+        up, or None if it knows of none.
+        """
+        replicas = self._execute_sentinel_command("SLAVES", node.name)
+        for replica in replicas:
+            info = dict(zip(replica[::2], replica[1::2]))
+            flags = set(info.get("flags", "").split(","))
+            if not flags & set(["s_down", "o_down", "disconnected"]):
+                return Node(node.name, info["ip"], info["port"])
+        return None
+
     def get_node_for_key(self, key):
         """
         Returns a node for the given key. Keys with {} in them will be sharded
         based on only the string between the brackets. This is for future
         compatibility with Redis Cluster (and is also a nice feature to have).
         """
-        if "{" in key and "}" in key:
-            key = key[key.index("{") + 1: key.index("}")]
-        return self.nodes[int(sha1(key).hexdigest(), 16) % len(self.nodes)]
+        return self.nodes[self._slots[hash_key(key) % len(self._slots)]]
+
+    def _execute_on_node(self, command, key, *args, **kwargs):
+        """
+        Run ``command`` on the node that owns ``key``, passing its values
+        through the client's codec. Reads are coalesced with identical
+        reads already in flight if the client was created with
+        ``coalesce_reads``.
+        """
+        if self.codec is not None:
+            args, kwargs = encode_arguments(self.codec, command, args, kwargs)
+            return decode_result(self.codec, command,
+                self._coalesce(command, key, args, kwargs))
+        return self._coalesce(command, key, args, kwargs)
+
+    def _coalesce(self, command, key, args, kwargs):
+        """
+        Send ``command`` to the node for ``key``, or share the result of an
+        identical read that is already in flight.
+        """
+        if self.read_coalescer is not None and command in READ_ONLY_COMMANDS:
+            flight = (command, key, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(flight)
+            except TypeError:
+                pass  # unhashable arguments, e.g. a list of fields for hmget
+            else:
+                return self.read_coalescer.do(flight, self._send_command,
+                    command, key, args, kwargs)
+        return self._send_command(command, key, args, kwargs)
+
+    def _send_command(self, command, key, args, kwargs):
+        """
+        Send ``command`` to the node for ``key``. In the case of a Connection
+        failure, find the new master for the node and try again there.
+        """
+        node = self.get_node_for_key(key)
+        call = lambda connection: getattr(connection, command)(key, *args,
+            **kwargs)
+        if self.hedged_reads is not None and command in READ_ONLY_COMMANDS:
+            result = self.hedged_reads.read(self, node, call, command, key)
+        else:
+            result = self._execute_with_failover(node, call, command, key)
+        if self.profiler is not None and self.profiler.sample():
+            self._profile(node, key, args, result)
+        return result
+
+    def _profile(self, node, key, args, result):
+        "Record a sampled command with the client's profiler"
+        self.profiler.record(node.name, key_hashtag(key),
+            value_size(key) + value_size(args) + value_size(result))
+
+    def add_hook(self, hook):
+        """
+        Call ``hook.before(trace)`` and ``hook.after(trace)`` around every
+        command sent to a node, where ``trace`` is a tracing.CommandTrace
+        with the node, command, key and, afterwards, how long it took.
+        """
+        self._hooks = self._hooks + [hook]
+
+    def remove_hook(self, hook):
+        "Stop calling ``hook`` around commands"
+        self._hooks = [other for other in self._hooks if other is not hook]
+
+    def _execute_with_failover(self, node, func, command=None, key=None,
+                               trace=None):
+        """
+        Call ``func`` with the connection to ``node``. In the case of a
+        Connection failure, find the new master for the node and call it
+        again with that connection. ``command`` and ``key`` are only used
+        to describe the call to the client's hooks, and ``trace`` is the
+        CommandTrace to record a retry in, once the hooks have been called.
+        """
+        if node.is_down:
+            # The health checker has been asked for its new master already.
+            node = self._current_node(node)
+        if self._hooks and trace is None:
+            return self._execute_traced(node, func, command, key)
+        try:
+            return func(node.connection)
+        except ConnectionError:
+            # if it fails a second time, then sentinel hasn't caught up, so
+            # we have no choice but to fail for real.
+            master = self._new_master(node)
+            if trace is not None:
+                trace.retried = True
+                trace.node = master
+                trace.failover = master is not node
+            return func(master.connection)
+
+    def _execute_traced(self, node, func, command, key):
+        "Run _execute_with_failover() between the calls to the hooks"
+        hooks = self._hooks
+        trace = CommandTrace(node, command, key)
+        for hook in hooks:
+            hook.before(trace)
+        try:
+            return self._execute_with_failover(node, func, trace=trace)
+        except Exception as e:
+            trace.error = e
+            raise
+        finally:
+            trace.duration = time.time() - trace.start
+            for hook in hooks:
+                hook.after(trace)
+
+    def _execute_on_nodes(self, calls, raise_errors=True, command=None):
+        """
+        Run each ``(node, func)`` pair in ``calls`` as _execute_with_failover
+        does, with the nodes called in parallel. Returns the results in the
+        same order as ``calls``. If any call fails, its exception is raised
+        once all of them have finished, or if ``raise_errors`` is False,
+        returned in place of its result. ``command`` names the calls for
+        the client's hooks.
+        """
+        results = [None] * len(calls)
+        errors = []
+
+        def run(index, node, func):
+            try:
+                results[index] = self._execute_with_failover(node, func,
+                                                             command)
+            except Exception as e:
+                results[index] = e
+                errors.append(e)
+        if len(calls) < 2:
+            for index, (node, func) in enumerate(calls):
+                run(index, node, func)
+        else:
+            threads = [threading.Thread(target=run, args=(index, node, func))
+                       for index, (node, func) in enumerate(calls)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        if errors and raise_errors:
+            raise errors[0]
+        return results
+
+    def _keys_call(self, command, args):
+        "Returns a function calling ``command`` with ``args`` on a connection"
+        return lambda connection: getattr(connection, command)(*args)
+
+    def _group_by_node(self, keys):
+        """
+        Group ``keys`` by the node that owns them. Returns a list of
+        ``(node, indexes)`` pairs, where ``indexes`` are the positions in
+        ``keys`` of the keys that belong to ``node``.
+        """
+        groups = {}
+        nodes = []
+        for index, key in enumerate(keys):
+            node = self.get_node_for_key(key)
+            if node not in groups:
+                groups[node] = []
+                nodes.append(node)
+            groups[node].append(index)
+        return [(node, groups[node]) for node in nodes]
+
+    def _get_node_for_keys(self, keys):
+        """
+        Returns the single node that owns all of ``keys``. Raises a DataError
+        if they are spread over several nodes; use a common {} hashtag in
+        keys that have to be used together.
+        """
+        if not keys:
+            raise DataError("At least one key is needed to find a node")
+        nodes = set(self.get_node_for_key(key) for key in keys)
+        if len(nodes) != 1:
+            raise DataError("Keys in request don't hash to the same node")
+        return nodes.pop()
+
+    def _scatter(self, keys, make_call, command=None):
+        """
+        Split ``keys`` up by node and run ``make_call(indexes)`` on every node
+        in parallel, where ``indexes`` are the positions in ``keys`` of that
+        node's keys. Each call must return one result per index; these are
+        gathered into a list in the same order as ``keys``. ``command``
+        names the calls for the client's hooks.
+        """
+        groups = self._group_by_node(keys)
+        node_results = self._execute_on_nodes(
+            [(node, make_call(indexes)) for node, indexes in groups],
+            command=command)
+        results = [None] * len(keys)
+        for (node, indexes), values in zip(groups, node_results):
+            for index, value in zip(indexes, values):
+                results[index] = value
+        return results
+
+    def execute_batch(self, commands):
+        """
+        Execute ``commands``, a list of ``(command, key, args, kwargs)``
+        tuples, using one pipeline per node. The pipelines are sent to the
+        nodes in parallel, and the results are returned in the same order
+        as ``commands``.
+        """
+        if self.codec is not None:
+            commands = [(command, key) + encode_arguments(self.codec,
+                            command, args, kwargs)
+                        for command, key, args, kwargs in commands]
+
+        def pipeline(indexes):
+            def execute(connection):
+                pipe = connection.pipeline(transaction=False)
+                for index in indexes:
+                    command, key, args, kwargs = commands[index]
+                    getattr(pipe, command)(key, *args, **kwargs)
+                return pipe.execute()
+            return execute
+        results = self._scatter([command[1] for command in commands],
+            pipeline, "pipeline")
+        if self.profiler is not None:
+            for (command, key, args, kwargs), result in zip(commands,
+                                                            results):
+                if self.profiler.sample():
+                    self._profile(self.get_node_for_key(key), key, args,
+                                  result)
+        if self.codec is not None:
+            results = [decode_result(self.codec, command[0], result)
+                       for command, result in zip(commands, results)]
+        return results
+
+    def execute_command(self, *args, **options):
+        """
+        Execute a raw command, sent to the node that owns its keys as found
+        in keyspec.COMMAND_KEYS. Commands that aren't in the table, such as
+        newer or module commands, raise a DataError until they are added to
+        it, as do commands that change the state of the connection (SELECT,
+        AUTH, MULTI, ...).
+
+        A command whose keys live on several nodes is split up by node if
+        its results can be merged (MGET, MSET, DEL, EXISTS, ...), and raises
+        a DataError otherwise. A command without keys goes to any one node,
+        and a command for the whole server (INFO, FLUSHDB, ...) is run on
+        every node, returning a NodeResults of the results by node name.
+
+        Values are sent and returned as they are, without the client's codec.
+        """
+        if is_connection_command(args[0]):
+            raise DataError("%s changes the state of a single connection, "
+                            "which can't be done through DisredisClient; use "
+                            "pipeline() for transactions" % args[0])
+        spec = get_key_spec(args[0])
+        if spec is None:
+            raise DataError("Don't know where the keys of %s are; add it to "
+                            "keyspec.COMMAND_KEYS" % args[0])
+
+        def call(args):
+            return lambda connection: connection.execute_command(*args,
+                **options)
+
+        if spec.all_nodes:
+            nodes = list(self.nodes)
+            results = self._execute_on_nodes(
+                [(node, call(args)) for node in nodes], command=args[0])
+            return NodeResults(
+                dict((node.name, result)
+                     for node, result in zip(nodes, results)),
+                merge_results(spec.merge, results))
+
+        positions = spec.get_key_positions(args)
+        if not positions:
+            return self._execute_with_failover(random.choice(self.nodes),
+                call(args), args[0])
+        keys = [args[i] for i in positions]
+        groups = self._group_by_node(keys)
+        if len(groups) == 1:
+            return self._execute_with_failover(groups[0][0], call(args),
+                args[0], keys[0])
+        if spec.merge is None:
+            raise DataError("Keys in request don't hash to the same node")
+
+        # Splittable commands are made up of nothing but their keys, each
+        # followed by ``step - 1`` arguments of its own.
+        def split(indexes):
+            node_args = [args[0]]
+            for index in indexes:
+                node_args.extend(
+                    args[positions[index]:positions[index] + spec.step])
+            return call(node_args)
+        if spec.merge == MERGE_LIST:
+            return self._scatter(keys, split, args[0])
+        results = self._execute_on_nodes(
+            [(node, split(indexes)) for node, indexes in groups],
+            command=args[0])
+        return merge_results(spec.merge, results)
+
+    def _fan_out(self, command, aggregate, *args, **kwargs):
+        """
+        Run ``command`` on every node in parallel. Returns a NodeResults of
+        the results by node name, with ``aggregate`` called on the list of
+        results as its aggregate.
+        """
+        nodes = list(self.nodes)
+        results = self._execute_on_nodes([
+            (node, lambda connection: getattr(connection, command)(*args,
+                **kwargs))
+            for node in nodes], command=command)
+        return NodeResults(
+            dict((node.name, result) for node, result in zip(nodes, results)),
+            aggregate(results))
+
+    def sharded_counter(self, name, shards=None, local=False, cache_ttl=0):
+        """
+        Return a structures.ShardedCounter named ``name``, a counter spread
+        over ``shards`` keys on different nodes (one per node by default),
+        for counters too hot for a single key. Increments go to a random
+        shard, or a shard per thread if ``local`` is True, and its value is
+        the sum of the shards, cached for ``cache_ttl`` seconds.
+        """
+        return ShardedCounter(self, name, shards=shards, local=local,
+                              cache_ttl=cache_ttl)
+
+    def partitioned_hash(self, name, buckets=16):
+        """
+        Return a structures.PartitionedHash named ``name``, a hash split by
+        field over ``buckets`` keys on different nodes, for hashes too big or
+        too hot for a single master.
+        """
+        return PartitionedHash(self, name, buckets=buckets)
+
+    def partitioned_sorted_set(self, name, shards=None):
+        """
+        Return a structures.PartitionedSortedSet named ``name``, a sorted set
+        split by member over ``shards`` keys on different nodes (one per node
+        by default), such as a leaderboard too hot for a single master.
+        """
+        return PartitionedSortedSet(self, name, shards=shards)
+
+    def write_buffer(self, max_items=10000, flush_interval=1.0):
+        """
+        Return a batching.WriteBuffer, which merges incr, hincrby, sadd and
+        zincrby calls in memory and writes them in one pipeline per node
+        when it holds ``max_items`` merged writes, every ``flush_interval``
+        seconds, and at exit. The client keeps one buffer for each set of
+        arguments, so every call with the same ones returns the same buffer.
+        """
+        key = (max_items, flush_interval)
+        with self._nodes_lock:
+            buffer = self._write_buffers.get(key)
+            if buffer is None:
+                buffer = self._write_buffers[key] = WriteBuffer(self,
+                    max_items=max_items, flush_interval=flush_interval)
+        return buffer
+
+    def get_with_ttl(self, name):
+        """
+        Return a ``(value, ttl)`` tuple for key ``name``, fetched from its
+        node in a single round trip.
+        """
+        return tuple(self.execute_batch([("get", name, (), {}),
+                                         ("ttl", name, (), {})]))
+
+    def get_or_compute(self, name, compute, timeout=None, lock_timeout=10,
+                       sleep=0.05):
+        """
+        Return the value at key ``name``. If the key doesn't exist, call
+        ``compute`` to produce the value, store it with an expiry of
+        ``timeout`` seconds and return it.
+
+        To avoid a stampede when a popular key expires, only the caller that
+        acquires a lock on ``name`` recomputes it. Other callers poll for
+        the new value every ``sleep`` seconds, and compute it themselves if
+        it hasn't appeared within ``lock_timeout`` seconds. Threads of this
+        process that miss on the same ``name`` share a single computation.
+        """
+        value = self.get(name)
+        if value is not None:
+            return value
+        return self._computations.do(name, self._compute, name, compute,
+            timeout, lock_timeout, sleep)
+
+    def _compute(self, name, compute, timeout, lock_timeout, sleep):
+        """
+        Compute and store the value for ``name`` under the stampede lock, or
+        wait for whoever holds the lock to store it.
+        """
+        def compute_and_store():
+            value = compute()
+            self.set(name, value, ex=timeout)
+            return value
+        lock = self.lock("%s:lock" % name, timeout=lock_timeout)
+        if lock.acquire(blocking=False):
+            try:
+                return compute_and_store()
+            finally:
+                try:
+                    lock.release()
+                except LockError:
+                    pass  # the lock expired while we were computing
+
+        deadline = time.time() + lock_timeout
+        while time.time() < deadline:
+            time.sleep(sleep)
+            value = self.get(name)
+            if value is not None:
+                return value
+        # Whoever holds the lock is taking too long, so store our own value.
+        return compute_and_store()
 
     # The remainder of this class is implementing the StrictRedis interface.
     def set_response_callback(self, command, callback):
@@ -155,16 +955,39 @@ class DisredisClient(object):
         should be executed atomically. Apart from making a group of operations
         atomic, pipelines are useful for reducing the back-and-forth overhead
         between the client and server.
+
+        A transaction runs on a single node, so all of its keys, and
+        ``shard_hint`` if it is given, must hash to the same node; see
+        pipeline.DisredisPipeline.
         """
-        raise NotImplementedError("Not supported for disredis.")
+        return DisredisPipeline(self, transaction, shard_hint)
 
     def transaction(self, func, *watches, **kwargs):
         """
         Convenience method for executing the callable `func` as a transaction
         while watching all keys specified in `watches`. The 'func' callable
         should expect a single arguement which is a Pipeline object.
-        """
-        raise NotImplementedError("Not supported for disredis.")
+
+        It is retried, after ``watch_delay`` seconds if that is given, until
+        the watched keys haven't changed before it is executed, and when the
+        connection to the node is lost and the node has a new master. If
+        the Sentinels still report the same master, the ConnectionError is
+        raised.
+        """
+        shard_hint = kwargs.pop('shard_hint', None)
+        value_from_callable = kwargs.pop('value_from_callable', False)
+        watch_delay = kwargs.pop('watch_delay', None)
+        with self.pipeline(True, shard_hint) as pipe:
+            while True:
+                try:
+                    if watches:
+                        pipe.watch(*watches)
+                    func_value = func(pipe)
+                    exec_value = pipe.execute()
+                    return func_value if value_from_callable else exec_value
+                except WatchError:
+                    if watch_delay is not None and watch_delay > 0:
+                        time.sleep(watch_delay)
 
     @executeOnNode
     def lock(self, name, timeout=None, sleep=0.1):
@@ -180,6 +1003,21 @@ class DisredisClient(object):
         holding the lock.
         """
 
+    def redlock(self, name, timeout=10, sleep=0.2, auto_extend=False):
+        """
+        Return a new redlock.Redlock using key ``name``, which is held on a
+        majority of the masters so that it survives the failover of one of
+        them, unlike lock().
+
+        ``timeout`` is the lock's time to live in seconds, and ``sleep`` the
+        longest time to wait between attempts to acquire it. If
+        ``auto_extend`` is True, it is extended in the background while it
+        is held. Acquisition counts and latencies of all the client's
+        redlocks are kept in ``redlock_metrics``.
+        """
+        return Redlock(self, name, timeout=timeout, sleep=sleep,
+                       auto_extend=auto_extend, metrics=self.redlock_metrics)
+
     @executeOnNode  # use the shard_hint for the key.
     def pubsub(self, shard_hint=None):
         """
@@ -205,8 +1043,13 @@ class DisredisClient(object):
         raise NotImplementedError("Not supported for disredis.")
 
     def client_list(self):
-        "Returns a list of currently connected clients"
-        raise NotImplementedError("Not supported for disredis.")
+        """
+        Returns the clients connected to each node. The aggregate is the list
+        of clients connected to any node.
+        """
+        return self._fan_out("client_list",
+            lambda results: [client for clients in results
+                             for client in clients])
 
     def client_getname(self):
         "Returns the current connection name"
@@ -217,23 +1060,31 @@ class DisredisClient(object):
         raise NotImplementedError("Not supported for disredis.")
 
     def config_get(self, pattern="*"):
-        "Return a dictionary of configuration based on the ``pattern``"
-        raise NotImplementedError("Not supported for disredis.")
+        """
+        Return a dictionary of configuration based on the ``pattern`` for
+        each node. The aggregate holds the items set the same way on every
+        node.
+        """
+        return self._fan_out("config_get", common_items, pattern)
 
     def config_set(self, name, value):
         "Set config item ``name`` with ``value``"
         raise NotImplementedError("Not supported for disredis.")
 
     def dbsize(self):
-        "Returns the number of keys in the current database"
-        raise NotImplementedError("Not supported for disredis.")
+        """
+        Returns the number of keys in the current database of each node. The
+        aggregate is the total number of keys.
+        """
+        return self._fan_out("dbsize", sum)
 
     def time(self):
         """
-        Returns the server time as a 2-item tuple of ints:
-        (seconds since epoch, microseconds into this second).
+        Returns the server time of each node as a 2-item tuple of ints:
+        (seconds since epoch, microseconds into this second). The aggregate
+        is the latest of them.
         """
-        raise NotImplementedError("Not supported for disredis.")
+        return self._fan_out("time", max)
 
     @executeOnNode
     def debug_object(self, key):
@@ -241,8 +1092,10 @@ class DisredisClient(object):
 
     def delete(self, *names):
         "Delete one or more keys specified by ``names``"
-        # TODO support this.
-        return self.execute_command('DEL', *names)
+        groups = self._group_by_node(names)
+        return sum(self._execute_on_nodes([
+            (node, self._keys_call("delete", [names[i] for i in indexes]))
+            for node, indexes in groups], command="delete"))
     __delitem__ = delete
 
     def echo(self, value):
@@ -254,8 +1107,11 @@ class DisredisClient(object):
         raise NotImplementedError("Not supported for disredis.")
 
     def flushdb(self):
-        "Delete all keys in the current database"
-        raise NotImplementedError("Not supported for disredis.")
+        """
+        Delete all keys in the current database of every node. The aggregate
+        is True if every node was flushed.
+        """
+        return self._fan_out("flushdb", all)
 
     def info(self, section=None):
         """
@@ -266,23 +1122,30 @@ class DisredisClient(object):
 
         The section option is not supported by older versions of Redis Server,
         and will generate ResponseError
+
+        Returns the information for each node. The aggregate combines them as
+        merge_info does.
         """
-        raise NotImplementedError("Not supported for disredis.")
+        args = () if section is None else (section,)
+        return self._fan_out("info", merge_info, *args)
 
     def lastsave(self):
         """
         Return a Python datetime object representing the last time the
-        Redis database was saved to disk
+        Redis database was saved to disk, for each node. The aggregate is the
+        most recent save.
         """
-        raise NotImplementedError("Not supported for disredis.")
+        return self._fan_out("lastsave", max)
 
     def object(self, infotype, key):
         "Return the encoding, idletime, or refcount about the key"
-        raise NotImplementedError("Not supported for disredis.")
+        return self.execute_command('OBJECT', infotype, key, infotype=infotype)
 
     def ping(self):
-        "Ping the Redis server"
-        raise NotImplementedError("Not supported for disredis.")
+        """
+        Ping every node. The aggregate is True if all of them answered.
+        """
+        return self._fan_out("ping", all)
 
     def save(self):
         """
@@ -418,11 +1281,24 @@ class DisredisClient(object):
         """
         Returns a list of values ordered identically to ``keys``
         """
-        raise NotImplementedError("Not supported for disredis.")
+        keys = list_or_args(keys, args)
+        values = self._scatter(keys, lambda indexes: self._keys_call("mget",
+            [[keys[i] for i in indexes]]), "mget")
+        if self.codec is not None:
+            values = decode_result(self.codec, "mget", values)
+        return values
 
     def mset(self, mapping):
         "Sets each key in the ``mapping`` dict to its corresponding value"
-        raise NotImplementedError("Not supported for disredis.")
+        keys = list(mapping)
+        if self.codec is not None:
+            mapping = dict((key, self.codec.encode(value))
+                           for key, value in mapping.items())
+        self._execute_on_nodes([
+            (node, self._keys_call("mset",
+                [dict((keys[i], mapping[keys[i]]) for i in indexes)]))
+            for node, indexes in self._group_by_node(keys)], command="mset")
+        return True
 
     def msetnx(self, mapping):
         """
@@ -468,8 +1344,18 @@ class DisredisClient(object):
         "Returns the number of milliseconds until the key ``name`` will expire"
 
     def randomkey(self):
-        "Returns the name of a random key"
-        raise NotImplementedError("Not supported for disredis.")
+        """
+        Returns the name of a random key from a random node, trying the other
+        nodes if that one is empty.
+        """
+        nodes = list(self.nodes)
+        random.shuffle(nodes)
+        for node in nodes:
+            key = self._execute_with_failover(node,
+                lambda connection: connection.randomkey(), "randomkey")
+            if key is not None:
+                return key
+        return None
 
     def rename(self, src, dst):
         """
@@ -982,6 +1868,13 @@ class DisredisClient(object):
     def hmget(self, name, keys, *args):
         "Returns a list of values ordered identically to ``keys``"
 
+    @executeOnNode
+    def hscan(self, name, cursor=0, match=None, count=None):
+        """
+        Incrementally return key/value slices in hash ``name``, as a
+        ``(cursor, dict)`` tuple. The scan is over when the cursor is 0.
+        """
+
     @executeOnNode
     def hvals(self, name):
         "Return the list of values within hash ``name``"
@@ -1001,8 +1894,13 @@ class DisredisClient(object):
 
         In practice, use the object returned by ``register_script``. This
         function exists purely for Redis API completion.
+
+        All keys the script touches must belong to the same node.
         """
-        raise NotImplementedError("Not supported for disredis.")
+        node = self._get_node_for_keys(keys_and_args[:numkeys])
+        return self._execute_with_failover(node, self._keys_call("eval",
+            (script, numkeys) + keys_and_args),
+            "eval", keys_and_args[0])
 
     def evalsha(self, sha, numkeys, *keys_and_args):
         """
@@ -1013,8 +1911,13 @@ class DisredisClient(object):
 
         In practice, use the object returned by ``register_script``. This
         function exists purely for Redis API completion.
+
+        All keys the script touches must belong to the same node.
         """
-        raise NotImplementedError("Not supported for disredis.")
+        node = self._get_node_for_keys(keys_and_args[:numkeys])
+        return self._execute_with_failover(node, self._keys_call("evalsha",
+            (sha, numkeys) + keys_and_args),
+            "evalsha", keys_and_args[0])
 
     def script_exists(self, *args):
         """
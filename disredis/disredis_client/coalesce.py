@@ -0,0 +1,100 @@
+"""
+Request coalescing for the disredis client.
+
+When many threads ask for the same thing at the same time, only one of them
+needs to make the round trip. The others wait for it to finish and share its
+result.
+
+"""
+
+import copy
+import os
+import threading
+import weakref
+
+
+# Every SingleFlight, so that they can be reset in a forked child.
+_instances = weakref.WeakKeyDictionary()
+
+
+def copy_result(result):
+    """
+    Returns a copy of ``result`` if it is a dict, list or set, so that a
+    caller changing its result doesn't change the others'.
+    """
+    if isinstance(result, (dict, list, set)):
+        return copy.copy(result)
+    return result
+
+
+def _after_fork():
+    for flight in list(_instances):
+        flight._reset()
+
+
+class _Call(object):
+    """
+    A call that is currently in flight.
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Collapses concurrent calls that share a key into a single call. The first
+    caller for a key runs the function; callers that arrive while it is still
+    running wait for it and receive the same result, or the same exception.
+    If ``share`` is given, the waiting callers receive ``share(result)``
+    instead, such as a copy made by copy_result.
+    """
+    def __init__(self, share=None):
+        self.share = share
+        self._reset()
+        _instances[self] = True
+
+    def _reset(self):
+        """
+        Forget the calls in flight. A child process only has the thread that
+        forked it, so the calls other threads were making never finish there,
+        and the lock may have been held by one of them.
+        """
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Call ``func`` with ``args`` and ``kwargs`` unless a call for ``key``
+        is already in flight, in which case wait for that call instead.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            if self.share is not None:
+                return self.share(call.result)
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+if hasattr(os, "register_at_fork"):  # Python 3.7 and later
+    os.register_at_fork(after_in_child=_after_fork)
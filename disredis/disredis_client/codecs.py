@@ -0,0 +1,162 @@
+"""
+Value codecs for the disredis client.
+
+A codec has an ``encode(value)`` method, applied to every value the client
+sends with a command that stores values (set, setex, lpush, hset, ...), and
+a ``decode(value)`` method, applied to every value read back (get, mget,
+lrange, hget, hgetall, ...). Pass one to DisredisClient as ``codec``.
+
+"""
+import threading
+import zlib
+
+try:
+    text_type = unicode
+except NameError:  # Python 3
+    text_type = str
+
+
+# Positions, after the key, of the value arguments of each command that
+# stores values. None means that every argument is a value.
+VALUE_ARGUMENTS = {
+    "getset": (0,),
+    "hset": (1,),
+    "hsetnx": (1,),
+    "linsert": (1, 2),
+    "lpush": None,
+    "lpushx": (0,),
+    "lrem": (1,),
+    "lset": (1,),
+    "psetex": (1,),
+    "rpush": None,
+    "rpushx": (0,),
+    "set": (0,),
+    "setex": (1,),
+    "setnx": (0,),
+}
+
+# Commands whose results are values, by the shape of the result.
+VALUE_RESULTS = frozenset([
+    "get", "getset", "hget", "lindex", "lpop", "rpop",
+])
+LIST_RESULTS = frozenset([
+    "hmget", "hvals", "lrange", "mget",
+])
+DICT_RESULTS = frozenset([
+    "hgetall",
+])
+
+
+def encode_arguments(codec, command, args, kwargs):
+    """
+    Returns ``args`` and ``kwargs`` for ``command`` with their values encoded
+    by ``codec``.
+    """
+    if command == "hmset":
+        mapping = args[0]
+        return ((dict((field, codec.encode(value))
+                      for field, value in mapping.items()),) + args[1:],
+                kwargs)
+    if command not in VALUE_ARGUMENTS:
+        return args, kwargs
+    positions = VALUE_ARGUMENTS[command]
+    if positions is None:
+        positions = range(len(args))
+    args = list(args)
+    for position in positions:
+        if position < len(args):
+            args[position] = codec.encode(args[position])
+    return tuple(args), kwargs
+
+
+def decode_result(codec, command, result):
+    """
+    Returns the ``result`` of ``command`` with its values decoded by
+    ``codec``.
+    """
+    if result is None:
+        return result
+    if command in VALUE_RESULTS:
+        return codec.decode(result)
+    if command in LIST_RESULTS:
+        return [codec.decode(value) for value in result]
+    if command in DICT_RESULTS:
+        return dict((field, codec.decode(value))
+                    for field, value in result.items())
+    if command == "hscan":
+        cursor, data = result
+        return cursor, decode_result(codec, "hgetall", data)
+    return result
+
+
+class ZlibCodec(object):
+    """
+    Compresses string values of at least ``min_length`` bytes with zlib,
+    marked by HEADER, a magic string followed by a format version. Values
+    without the header, such as everything written before the codec was
+    used, are read back unchanged. The rare value that starts with the
+    header itself is always stored compressed, so it reads back correctly.
+
+    stats() reports how much the values sent through the codec were
+    compressed.
+    """
+    HEADER = b"\x00DZC\x01"
+
+    def __init__(self, min_length=1024, level=6):
+        self.min_length = min_length
+        self.level = level
+        self._lock = threading.Lock()
+        self._values = 0
+        self._compressed = 0
+        self._raw_bytes = 0
+        self._stored_bytes = 0
+
+    def encode(self, value):
+        if isinstance(value, text_type):
+            data = value.encode("utf-8")
+        elif isinstance(value, bytes):
+            data = value
+        else:
+            return value  # numbers are sent as they are
+
+        stored = data
+        compressed = False
+        header = data.startswith(self.HEADER)
+        if len(data) >= self.min_length or header:
+            candidate = self.HEADER + zlib.compress(data, self.level)
+            if len(candidate) < len(data) or header:
+                stored = candidate
+                compressed = True
+        with self._lock:
+            self._values += 1
+            self._raw_bytes += len(data)
+            self._stored_bytes += len(stored)
+            if compressed:
+                self._compressed += 1
+        return value if stored is data else stored
+
+    def decode(self, value):
+        if isinstance(value, bytes) and value.startswith(self.HEADER):
+            try:
+                return zlib.decompress(value[len(self.HEADER):])
+            except zlib.error:
+                pass  # written before the codec was used
+        return value
+
+    def stats(self):
+        """
+        Returns a dict with the number of string values encoded, how many of
+        them were compressed, their total size before and after encoding,
+        and the ratio between the two.
+        """
+        with self._lock:
+            ratio = None
+            if self._raw_bytes:
+                ratio = float(self._stored_bytes) / self._raw_bytes
+            return {
+                "values": self._values,
+                "compressed": self._compressed,
+                "raw_bytes": self._raw_bytes,
+                "stored_bytes": self._stored_bytes,
+                "ratio": ratio,
+            }
@@ -0,0 +1,175 @@
+"""
+Background health checks for the disredis client.
+
+A HealthChecker thread PINGs every master and every sentinel of a
+DisredisClient at a fixed interval, waiting only a short time for each
+answer so a dead server can't hang it. Masters are PINGed over a probe
+connection made like the ones in the node's own pool, but with the
+checker's timeout for connecting and sending, and sentinels over
+connections of the checker's own. It keeps an exponentially weighted
+moving average of each round trip in ``Node.latency`` and flags failed
+masters with ``Node.is_down``, asking the sentinels for their new master
+straight away rather than waiting for a request to fail. While a checker
+runs, it is the only thing that asks: commands for a node that is down go
+to whichever master the checker last found for it. Sentinel latencies are
+kept in ``sentinel_latency`` and are used by the client to pick which
+sentinel to connect to.
+
+Pass ``health_check_interval`` to DisredisClient to run one.
+
+"""
+import logging
+import threading
+import time
+
+from redis.exceptions import TimeoutError
+
+
+class HealthChecker(threading.Thread):
+    """
+    Thread that checks the nodes and sentinels of ``client`` every
+    ``interval`` seconds. ``alpha`` is the weight of each new round trip in
+    the latency averages.
+    """
+    daemon = True
+
+    def __init__(self, client, interval=1.0, alpha=0.2, timeout=None):
+        super(HealthChecker, self).__init__(name="disredis-health-checker")
+        self.client = client
+        self.interval = interval
+        self.alpha = alpha
+        self.timeout = timeout or interval
+        self.sentinel_latency = {}
+        self.sentinels_down = set()
+        self._probes = {}
+        self._node_probes = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.check()
+            except Exception:
+                logger = logging.getLogger('custommade_logging')
+                logger.exception("Redis health check failed")
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        "Stop checking, once the current round of checks is done"
+        self._stopped.set()
+        for probe in list(self._probes.values()):
+            probe.connection_pool.disconnect()
+        for address, probe in list(self._node_probes.values()):
+            probe.disconnect()
+
+    def check(self):
+        """
+        PING every node and sentinel once, updating their latencies, and
+        refresh the master of every node that didn't answer.
+        """
+        for node in list(self.client.nodes):
+            rtt = self._ping_node(node)
+            if rtt is None:
+                if not node.is_down:
+                    logger = logging.getLogger('custommade_logging')
+                    logger.warning("Redis master %s - %s:%s is down" %
+                                   (node.name, node.host, node.port))
+                node.is_down = True
+                self._refresh_master(node)
+            else:
+                node.is_down = False
+                node.latency = self._average(node.latency, rtt)
+
+        addresses = list(self.client.sentinel_addresses)
+        for address in set(self._probes) - set(addresses):
+            self._probes.pop(address).connection_pool.disconnect()
+        for address in addresses:
+            rtt = self._ping_sentinel(address)
+            if rtt is None:
+                self.sentinels_down.add(address)
+            else:
+                self.sentinels_down.discard(address)
+                self.sentinel_latency[address] = self._average(
+                    self.sentinel_latency.get(address), rtt)
+
+    def sentinel_rank(self, address):
+        """
+        Sort key for sentinel addresses: sentinels that are up come first,
+        fastest first, then sentinels that haven't been checked yet, then
+        the ones that are down.
+        """
+        if address in self.sentinels_down:
+            return (2, 0)
+        if address not in self.sentinel_latency:
+            return (1, 0)
+        return (0, self.sentinel_latency[address])
+
+    def _ping_node(self, node):
+        """
+        Returns the round trip time of a PING to ``node`` in seconds, or
+        None if it failed or took longer than the timeout. The probe
+        connection is closed if the PING isn't answered.
+        """
+        probe = self._node_probe(node)
+        start = time.time()
+        try:
+            probe.send_command("PING")
+            if not probe.can_read(timeout=self.timeout):
+                raise TimeoutError("No answer from %s" % node.name)
+            probe.read_response()
+        except Exception:
+            # Don't leave an unread answer for the next check.
+            probe.disconnect()
+            return None
+        return time.time() - start
+
+    def _node_probe(self, node):
+        """
+        Returns the connection used to PING ``node``: one made with the
+        settings of the node's pool, but connecting and sending with the
+        checker's timeout, so a master that has dropped off the network
+        can't hold the checker up. A new one is made when the node's master
+        changes.
+        """
+        address = "%s:%s" % (node.host, node.port)
+        entry = self._node_probes.get(node.name)
+        if entry is None or entry[0] != address:
+            if entry is not None:
+                entry[1].disconnect()
+            pool = node.connection.connection_pool
+            kwargs = dict(pool.connection_kwargs)
+            kwargs["socket_timeout"] = self.timeout
+            kwargs["socket_connect_timeout"] = self.timeout
+            entry = self._node_probes[node.name] = (
+                address, pool.connection_class(**kwargs))
+        return entry[1]
+
+    def _ping_sentinel(self, address):
+        """
+        Returns the round trip time of a PING to the sentinel at ``address``
+        in seconds, or None if it failed.
+        """
+        probe = self._probes.get(address)
+        if probe is None:
+            host, port = address.split(":")
+            probe = self._probes[address] = self.client.redis_client_class(
+                host, int(port), socket_timeout=self.timeout)
+        start = time.time()
+        try:
+            probe.ping()
+        except Exception:
+            return None
+        return time.time() - start
+
+    def _refresh_master(self, node):
+        "Ask the sentinels whether ``node`` has a new master"
+        try:
+            self.client.get_master(node)
+        except Exception:
+            logger = logging.getLogger('custommade_logging')
+            logger.exception("Couldn't get the master for %s" % node.name)
+
+    def _average(self, average, rtt):
+        if average is None:
+            return rtt
+        return self.alpha * rtt + (1 - self.alpha) * average
@@ -0,0 +1,254 @@
+"""
+Hedged reads for the disredis client.
+
+A master that stalls, for example while it forks for a BGSAVE, holds up
+every read sent to it. With hedged reads, a read-only command that the
+master hasn't answered within the usual (by default 95th percentile)
+latency of its recent reads is also sent to one of its replicas, found
+through Sentinel, and whichever answers first is used. The share of reads
+that are hedged is capped, so a slow cluster isn't sent even more work.
+
+Replicas are updated asynchronously, so a hedged read may return a value
+that is slightly out of date. Reads that may be hedged wait for the master
+on a shared pool of worker threads, which adds some overhead to every
+read; when every worker is busy, the read is sent without a hedge. The
+replica of each master is looked up on the same workers, so a read never
+waits for Sentinel.
+
+"""
+import os
+import threading
+import time
+from collections import deque
+
+try:
+    from queue import Empty, Queue
+except ImportError:  # Python 2
+    from Queue import Empty, Queue
+
+
+class Workers(object):
+    """
+    Up to ``size`` daemon threads, started as they are needed, that run the
+    functions handed to them.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._tasks = Queue()
+        self._threads = 0
+        self._idle = 0
+
+    def submit(self, func):
+        """
+        Run ``func`` on a worker, returning True, or return False without
+        running it if every worker is busy.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()  # the workers didn't survive the fork
+            if self._idle:
+                self._idle -= 1
+            elif self._threads < self.size:
+                self._threads += 1
+                thread = threading.Thread(target=self._work,
+                                          args=(self._tasks,))
+                thread.daemon = True
+                thread.start()
+            else:
+                return False
+            self._tasks.put(func)
+        return True
+
+    def _work(self, tasks):
+        while True:
+            func = tasks.get()
+            try:
+                func()
+            except Exception:
+                pass  # the functions report their own errors
+            with self._lock:
+                self._idle += 1
+
+
+class HedgedReads(object):
+    """
+    Hedging policy and statistics, passed to DisredisClient as
+    ``hedged_reads``.
+
+    A read is hedged once it has taken longer than the ``percentile`` of
+    the latencies of the last ``window`` reads from its node, and at least
+    ``min_delay`` seconds; nodes with fewer than ``min_samples`` reads so
+    far are never hedged. At most ``budget`` of the reads are hedged. The
+    replica of each master is looked up again in the background every
+    ``refresh`` seconds, or after it fails. ``workers`` threads are shared
+    by all the reads, so at most that many reads at a time can be hedged.
+    """
+    def __init__(self, percentile=0.95, budget=0.05, window=1000,
+                 min_delay=0.001, min_samples=20, refresh=60, workers=32):
+        self.percentile = percentile
+        self.budget = budget
+        self.window = window
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.refresh = refresh
+        self.workers = Workers(workers)
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._delays = {}
+        self._stale = {}
+        self._replicas = {}
+        self._refreshing = set()
+        self.reads = 0
+        self.hedged = 0
+        self.replica_wins = 0
+
+    def _record(self, name, latency):
+        "Record the ``latency`` of a read from the master named ``name``"
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+            samples.append(latency)
+            self._stale[name] = self._stale.get(name, 0) + 1
+
+    def delay(self, name):
+        """
+        Returns how long to wait for the master named ``name`` before
+        hedging, or None if too few of its reads have been seen.
+        """
+        with self._lock:
+            samples = self._samples.get(name, ())
+            if len(samples) < self.min_samples:
+                return None
+            # Sorting the window on every read would be too slow.
+            if name not in self._delays or (
+                    self._stale[name] >= max(self.window // 20, 1)):
+                ordered = sorted(samples)
+                index = min(int(len(ordered) * self.percentile),
+                            len(ordered) - 1)
+                self._delays[name] = max(ordered[index], self.min_delay)
+                self._stale[name] = 0
+            return self._delays[name]
+
+    def _allow(self):
+        "Returns whether the budget allows one more hedge, and counts it"
+        with self._lock:
+            if self.hedged >= self.budget * self.reads:
+                return False
+            self.hedged += 1
+            return True
+
+    def _replica(self, client, node):
+        """
+        Returns the replica to hedge reads from ``node`` on, or None. If it
+        hasn't been looked up yet, or not for ``refresh`` seconds, it is
+        looked up in the background, for the reads that follow.
+        """
+        address = (node.name, node.host, node.port)
+        with self._lock:
+            entry = self._replicas.get(address)
+            if ((entry is not None and
+                    time.time() - entry[1] <= self.refresh) or
+                    address in self._refreshing):
+                return entry and entry[0]
+            self._refreshing.add(address)
+
+        def refresh():
+            try:
+                replica = client.get_replica(node)
+            except Exception:
+                replica = None
+            with self._lock:
+                self._replicas[address] = (replica, time.time())
+                self._refreshing.discard(address)
+        if not self.workers.submit(refresh):
+            with self._lock:
+                self._refreshing.discard(address)
+        return entry and entry[0]
+
+    def _forget_replica(self, node):
+        "Look the replica of ``node`` up again, after it failed"
+        with self._lock:
+            self._replicas.pop((node.name, node.host, node.port), None)
+
+    def read(self, client, node, func, command=None, key=None):
+        """
+        Call ``func`` with the connection to ``node``, as
+        DisredisClient._execute_with_failover does, hedging the call on a
+        replica of the node if it is slow.
+        """
+        with self._lock:
+            self.reads += 1
+            # Halve the counts now and then, so the budget follows the
+            # recent rate of hedges.
+            if self.reads >= self.window * 100:
+                self.reads //= 2
+                self.hedged //= 2
+        delay = self.delay(node.name)
+        results = Queue()
+
+        def primary():
+            start = time.time()
+            try:
+                results.put((True, True, client._execute_with_failover(
+                    node, func, command, key)))
+            except Exception as e:
+                results.put((True, False, e))
+            self._record(node.name, time.time() - start)
+
+        if delay is None or not self.workers.submit(primary):
+            start = time.time()
+            result = client._execute_with_failover(node, func, command, key)
+            self._record(node.name, time.time() - start)
+            return result
+
+        def hedge(replica):
+            try:
+                results.put((False, True, func(replica.connection)))
+            except Exception as e:
+                self._forget_replica(node)
+                results.put((False, False, e))
+
+        replica = self._replica(client, node)
+        try:
+            from_master, ok, value = results.get(timeout=delay)
+        except Empty:
+            hedging = replica is not None and self._allow()
+            if hedging and not self.workers.submit(lambda: hedge(replica)):
+                with self._lock:
+                    self.hedged -= 1
+                hedging = False
+            from_master, ok, value = results.get()
+            if hedging:
+                if not ok:
+                    other = results.get()
+                    if other[1]:
+                        from_master, ok, value = other
+                    elif other[0]:
+                        value = other[2]  # raise the master's error
+                if ok and not from_master:
+                    with self._lock:
+                        self.replica_wins += 1
+        if not ok:
+            raise value
+        return value
+
+    def stats(self):
+        """
+        Returns a dict with the number of ``reads``, how many were
+        ``hedged``, how many of those the replica answered first
+        (``replica_wins``), and the current hedging ``delays`` by master.
+        The read and hedge counts are halved every ``window * 100`` reads.
+        """
+        with self._lock:
+            return {
+                "reads": self.reads,
+                "hedged": self.hedged,
+                "replica_wins": self.replica_wins,
+                "delays": dict(self._delays),
+            }
@@ -0,0 +1,262 @@
+"""
+Where the keys are in the arguments of each Redis command.
+
+DisredisClient.execute_command uses COMMAND_KEYS to decide which node a raw
+command goes to, and refuses commands that aren't in the table rather than
+guess where their keys are. Entries can be added for newer or module
+commands, usually as SINGLE_KEY.
+
+CONNECTION_COMMANDS change the state of the connection they are sent on,
+which means nothing on a pooled connection to one of several nodes, so they
+are refused too. Transactions are done with DisredisClient.pipeline().
+
+"""
+
+# How the results are combined when a command whose keys live on several
+# nodes is split up and sent to each of them.
+MERGE_LIST = "list"  # one result per key, returned in key order (MGET),
+                     # or the lists from every node joined up (KEYS)
+MERGE_SUM = "sum"    # the results are counts that are added up (DEL)
+MERGE_ALL = "all"    # True if it succeeded on every node (MSET)
+
+
+class KeySpec(object):
+    """
+    Where to find the keys in a command's arguments, counting the command
+    name as argument 0, like the key specs returned by Redis's COMMAND.
+
+    ``first`` is the position of the first key (0 if there are no fixed key
+    positions), ``last`` the position of the last one, where negative
+    numbers count back from the end of the arguments, and ``step`` the
+    distance from one key to the next.
+
+    ``numkeys`` is the position of an argument giving the number of keys
+    that follow it, as in EVAL. ``keyword`` is an argument after which the
+    first half of the remaining arguments are keys, as with STREAMS in
+    XREAD.
+
+    ``merge`` is one of the MERGE constants if the command can be split up
+    by node, and None if all of its keys must live on one node.
+    ``all_nodes`` means the command is run on every node, when ``merge``
+    says how the results of the nodes are combined, if they can be, and
+    ``no_keys`` that it can be run on any one of them.
+    """
+    def __init__(self, first=1, last=1, step=1, numkeys=None, keyword=None,
+                 merge=None, all_nodes=False, no_keys=False):
+        self.first = first
+        self.last = last
+        self.step = step
+        self.numkeys = numkeys
+        self.keyword = keyword
+        self.merge = merge
+        self.all_nodes = all_nodes
+        self.no_keys = no_keys
+
+    def get_key_positions(self, args):
+        """
+        Returns the positions of the keys in ``args``.
+        """
+        if self.all_nodes or self.no_keys:
+            return []
+        positions = []
+        if self.first:
+            last = self.last
+            if last < 0:
+                last += len(args)
+            positions.extend(range(self.first, min(last, len(args) - 1) + 1,
+                                   self.step))
+        if self.numkeys is not None and self.numkeys < len(args):
+            start = self.numkeys + 1
+            stop = min(start + int(args[self.numkeys]), len(args))
+            positions.extend(range(start, stop))
+        if self.keyword is not None:
+            words = [_upper(arg) for arg in args]
+            if self.keyword in words:
+                start = words.index(self.keyword) + 1
+                positions.extend(range(start,
+                                       start + (len(args) - start) // 2))
+        return positions
+
+
+def _upper(arg):
+    if isinstance(arg, bytes):
+        arg = arg.decode("utf-8", "replace")
+    return arg.upper() if hasattr(arg, "upper") else arg
+
+
+def get_key_spec(command):
+    """
+    Returns the KeySpec for ``command``, which may also include a
+    subcommand, as in "CONFIG GET", or None if it isn't in COMMAND_KEYS.
+    """
+    command = _upper(command)
+    if command in COMMAND_KEYS:
+        return COMMAND_KEYS[command]
+    return COMMAND_KEYS.get(command.split(" ")[0])
+
+
+def merge_results(merge, results):
+    """
+    Combines the ``results`` of a command from several nodes as ``merge``,
+    one of the MERGE constants, says. Returns None if ``merge`` is None.
+    """
+    if merge == MERGE_LIST:
+        merged = []
+        for result in results:
+            merged.extend(result)
+        return merged
+    if merge == MERGE_SUM:
+        return sum(results)
+    if merge == MERGE_ALL:
+        return all(results)
+    return None
+
+
+def is_connection_command(command):
+    """
+    Returns True if ``command`` is one of CONNECTION_COMMANDS.
+    """
+    return _upper(command).split(" ")[0] in CONNECTION_COMMANDS
+
+
+SINGLE_KEY = KeySpec()
+NO_KEYS = KeySpec(no_keys=True)
+ALL_NODES = KeySpec(all_nodes=True)
+
+CONNECTION_COMMANDS = frozenset([
+    "AUTH", "DISCARD", "EXEC", "HELLO", "MONITOR", "MULTI", "PSUBSCRIBE",
+    "PUNSUBSCRIBE", "QUIT", "READONLY", "READWRITE", "RESET", "SELECT",
+    "SSUBSCRIBE", "SUBSCRIBE", "SUNSUBSCRIBE", "UNSUBSCRIBE", "UNWATCH",
+    "WATCH",
+])
+
+COMMAND_KEYS = {
+    # Keys that can be split up by node.
+    "DEL": KeySpec(1, -1, merge=MERGE_SUM),
+    "EXISTS": KeySpec(1, -1, merge=MERGE_SUM),
+    "MGET": KeySpec(1, -1, merge=MERGE_LIST),
+    "MSET": KeySpec(1, -1, 2, merge=MERGE_ALL),
+    "TOUCH": KeySpec(1, -1, merge=MERGE_SUM),
+    "UNLINK": KeySpec(1, -1, merge=MERGE_SUM),
+
+    # Several keys, which must be on the same node.
+    "BITOP": KeySpec(2, -1),
+    "BLMOVE": KeySpec(1, 2),
+    "BLMPOP": KeySpec(0, numkeys=2),
+    "BLPOP": KeySpec(1, -2),
+    "BRPOP": KeySpec(1, -2),
+    "BRPOPLPUSH": KeySpec(1, 2),
+    "BZMPOP": KeySpec(0, numkeys=2),
+    "BZPOPMAX": KeySpec(1, -2),
+    "BZPOPMIN": KeySpec(1, -2),
+    "COPY": KeySpec(1, 2),
+    "GEOSEARCHSTORE": KeySpec(1, 2),
+    "LCS": KeySpec(1, 2),
+    "EVAL": KeySpec(0, numkeys=2),
+    "EVAL_RO": KeySpec(0, numkeys=2),
+    "EVALSHA": KeySpec(0, numkeys=2),
+    "EVALSHA_RO": KeySpec(0, numkeys=2),
+    "FCALL": KeySpec(0, numkeys=2),
+    "FCALL_RO": KeySpec(0, numkeys=2),
+    "LMOVE": KeySpec(1, 2),
+    "LMPOP": KeySpec(0, numkeys=1),
+    "MSETNX": KeySpec(1, -1, 2),
+    "PFCOUNT": KeySpec(1, -1),
+    "PFMERGE": KeySpec(1, -1),
+    "RENAME": KeySpec(1, 2),
+    "RENAMENX": KeySpec(1, 2),
+    "RPOPLPUSH": KeySpec(1, 2),
+    "SDIFF": KeySpec(1, -1),
+    "SDIFFSTORE": KeySpec(1, -1),
+    "SINTER": KeySpec(1, -1),
+    "SINTERCARD": KeySpec(0, numkeys=1),
+    "SINTERSTORE": KeySpec(1, -1),
+    "SMOVE": KeySpec(1, 2),
+    "SUNION": KeySpec(1, -1),
+    "SUNIONSTORE": KeySpec(1, -1),
+    "XREAD": KeySpec(0, keyword="STREAMS"),
+    "XREADGROUP": KeySpec(0, keyword="STREAMS"),
+    "ZDIFF": KeySpec(0, numkeys=1),
+    "ZDIFFSTORE": KeySpec(1, 1, numkeys=2),
+    "ZINTER": KeySpec(0, numkeys=1),
+    "ZINTERCARD": KeySpec(0, numkeys=1),
+    "ZINTERSTORE": KeySpec(1, 1, numkeys=2),
+    "ZMPOP": KeySpec(0, numkeys=1),
+    "ZRANGESTORE": KeySpec(1, 2),
+    "ZUNION": KeySpec(0, numkeys=1),
+    "ZUNIONSTORE": KeySpec(1, 1, numkeys=2),
+
+    # A key after a subcommand.
+    "DEBUG OBJECT": KeySpec(1),
+    "MEMORY": KeySpec(2),
+    "MEMORY USAGE": KeySpec(1),
+    "OBJECT": KeySpec(2),
+    "XGROUP": KeySpec(2),
+    "XINFO": KeySpec(2),
+
+    # No keys; any node will do.
+    "COMMAND": NO_KEYS,
+    "ECHO": NO_KEYS,
+    "LOLWUT": NO_KEYS,
+    "PING": NO_KEYS,
+    "RANDOMKEY": NO_KEYS,
+    "TIME": NO_KEYS,
+
+    # About or for the whole server, so run on every node.
+    "ACL": ALL_NODES,
+    "BGREWRITEAOF": KeySpec(all_nodes=True, merge=MERGE_ALL),
+    "BGSAVE": KeySpec(all_nodes=True, merge=MERGE_ALL),
+    "CLIENT": ALL_NODES,
+    "CONFIG": ALL_NODES,
+    "DBSIZE": KeySpec(all_nodes=True, merge=MERGE_SUM),
+    "FLUSHALL": KeySpec(all_nodes=True, merge=MERGE_ALL),
+    "FLUSHDB": KeySpec(all_nodes=True, merge=MERGE_ALL),
+    "FUNCTION": ALL_NODES,
+    "INFO": ALL_NODES,
+    "KEYS": KeySpec(all_nodes=True, merge=MERGE_LIST),
+    "LASTSAVE": ALL_NODES,
+    "LATENCY": ALL_NODES,
+    "MEMORY DOCTOR": ALL_NODES,
+    "MEMORY STATS": ALL_NODES,
+    "ROLE": ALL_NODES,
+    "SAVE": KeySpec(all_nodes=True, merge=MERGE_ALL),
+    "SCAN": ALL_NODES,
+    "SCRIPT": ALL_NODES,
+    "SLOWLOG": ALL_NODES,
+    "SWAPDB": KeySpec(all_nodes=True, merge=MERGE_ALL),
+    "WAIT": ALL_NODES,
+}
+
+# A single key as the first argument.
+COMMAND_KEYS.update(dict.fromkeys([
+    # Keys and strings.
+    "APPEND", "BITCOUNT", "BITFIELD", "BITFIELD_RO", "BITPOS", "DECR",
+    "DECRBY", "DUMP", "EXPIRE", "EXPIREAT", "EXPIRETIME", "GET", "GETBIT",
+    "GETDEL", "GETEX", "GETRANGE", "GETSET", "INCR", "INCRBY",
+    "INCRBYFLOAT", "PERSIST", "PEXPIRE", "PEXPIREAT", "PEXPIRETIME",
+    "PFADD", "PSETEX", "PTTL", "RESTORE", "SET", "SETBIT", "SETEX",
+    "SETNX", "SETRANGE", "SORT", "SORT_RO", "STRLEN", "SUBSTR", "TTL",
+    "TYPE",
+    # Hashes.
+    "HDEL", "HEXISTS", "HEXPIRE", "HEXPIREAT", "HEXPIRETIME", "HGET",
+    "HGETALL", "HGETDEL", "HGETEX", "HINCRBY", "HINCRBYFLOAT", "HKEYS",
+    "HLEN", "HMGET", "HMSET", "HPERSIST", "HPEXPIRE", "HPEXPIREAT",
+    "HPEXPIRETIME", "HPTTL", "HRANDFIELD", "HSCAN", "HSET", "HSETEX",
+    "HSETNX", "HSTRLEN", "HTTL", "HVALS",
+    # Lists and sets.
+    "LINDEX", "LINSERT", "LLEN", "LPOP", "LPOS", "LPUSH", "LPUSHX",
+    "LRANGE", "LREM", "LSET", "LTRIM", "RPOP", "RPUSH", "RPUSHX", "SADD",
+    "SCARD", "SISMEMBER", "SMEMBERS", "SMISMEMBER", "SPOP", "SRANDMEMBER",
+    "SREM", "SSCAN",
+    # Sorted sets and geo.
+    "GEOADD", "GEODIST", "GEOHASH", "GEOPOS", "GEORADIUS",
+    "GEORADIUSBYMEMBER", "GEORADIUSBYMEMBER_RO", "GEORADIUS_RO",
+    "GEOSEARCH", "ZADD", "ZCARD", "ZCOUNT", "ZINCRBY", "ZLEXCOUNT",
+    "ZMSCORE", "ZPOPMAX", "ZPOPMIN", "ZRANDMEMBER", "ZRANGE", "ZRANGEBYLEX",
+    "ZRANGEBYSCORE", "ZRANK", "ZREM", "ZREMRANGEBYLEX", "ZREMRANGEBYRANK",
+    "ZREMRANGEBYSCORE", "ZREVRANGE", "ZREVRANGEBYLEX", "ZREVRANGEBYSCORE",
+    "ZREVRANK", "ZSCAN", "ZSCORE",
+    # Streams.
+    "XACK", "XADD", "XAUTOCLAIM", "XCLAIM", "XDEL", "XLEN", "XPENDING",
+    "XRANGE", "XREVRANGE", "XSETID", "XTRIM",
+], SINGLE_KEY))
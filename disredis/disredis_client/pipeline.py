@@ -0,0 +1,243 @@
+"""
+Pipelines and transactions for the disredis client.
+
+A transaction runs on a single master, so every key it watches or uses has
+to live on the same node; give related keys a common {} hashtag to make
+sure they do. A pipeline that isn't a transaction can use keys on any node:
+it is split into one pipeline per node, and these are sent in parallel.
+
+"""
+from redis.client import list_or_args
+from redis.exceptions import ConnectionError, DataError, WatchError
+
+from disredis.disredis_client.codecs import decode_result, encode_arguments
+
+
+# StrictRedis methods whose arguments are all keys, or start with a list of
+# keys that may be followed by more keys.
+ALL_KEYS_METHODS = frozenset([
+    "delete", "exists", "pfcount", "pfmerge", "sdiff", "sdiffstore",
+    "sinter", "sinterstore", "sunion", "sunionstore", "touch", "unlink",
+    "watch",
+])
+# StrictRedis methods whose first two arguments are keys.
+TWO_KEYS_METHODS = frozenset([
+    "brpoplpush", "copy", "lmove", "blmove", "rename", "renamenx",
+    "rpoplpush", "smove",
+])
+
+
+def command_keys(name, args, kwargs):
+    """
+    Returns the keys used by a call to the StrictRedis method ``name`` with
+    ``args`` and ``kwargs``.
+    """
+    if name in ("mset", "msetnx"):
+        mapping = args[0] if args and isinstance(args[0], dict) else kwargs
+        return list(mapping)
+    if not args:
+        return []
+    if name in ("blpop", "brpop"):
+        return list_or_args(args[0], [])
+    if name in ALL_KEYS_METHODS or name == "mget":
+        return list_or_args(args[0], args[1:])
+    if name in TWO_KEYS_METHODS:
+        return list(args[:2])
+    if name in ("zinterstore", "zunionstore"):
+        return [args[0]] + list(args[1])
+    if name in ("eval", "evalsha"):
+        return list(args[2:2 + int(args[1])])
+    return [args[0]]
+
+
+class DisredisPipeline(object):
+    """
+    Pipeline for a DisredisClient, made with DisredisClient.pipeline().
+
+    It is used like a redis-py pipeline. If ``transaction`` is True, the
+    commands are run in MULTI/EXEC on the node that owns all of their keys,
+    the keys given to watch() and ``shard_hint``, and a DataError is raised
+    if they are on more than one node. After watch(), commands run straight
+    away until multi() is called, as with redis-py.
+
+    A ConnectionError while keys are watched makes the client look up the
+    node's master. If it has changed, the error is raised as a WatchError,
+    since the watches were lost with the connection, and
+    DisredisClient.transaction() then retries on the new master; if it
+    hasn't, the ConnectionError is raised.
+    """
+    def __init__(self, client, transaction=True, shard_hint=None):
+        self.client = client
+        self.transaction = transaction
+        self.shard_hint = shard_hint
+        self.reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.reset()
+
+    def __len__(self):
+        return len(self.command_stack)
+
+    def reset(self):
+        "Forget the queued commands and unwatch any watched keys"
+        if getattr(self, "_pipe", None) is not None:
+            try:
+                self._pipe.reset()
+            except ConnectionError:
+                pass
+        self.command_stack = []
+        self._pipe = None
+        self._node = None
+        self.watching = False
+        self.explicit_transaction = False
+
+    def _check_node(self, keys):
+        """
+        Returns the node owning ``keys``, which has to be the node the
+        transaction is already tied to, if it is.
+        """
+        node = self.client._get_node_for_keys(keys)
+        if self._node is not None and node.name != self._node.name:
+            raise DataError("Keys in transaction don't hash to the same node")
+        return node
+
+    def watch(self, *names):
+        "Watches the values at keys ``names``, which must share a node"
+        if self.explicit_transaction:
+            raise DataError("Cannot issue a WATCH after a MULTI")
+        if not self.transaction:
+            raise DataError("WATCH needs a transactional pipeline")
+        keys = list(names)
+        if self.shard_hint is not None:
+            keys.append(self.shard_hint)
+        self._node = self._check_node(keys)
+        if self._pipe is None:
+            self._pipe = self._node.connection.pipeline(True)
+        self._immediate("watch", names, {})
+        self.watching = True
+        return True
+
+    def unwatch(self):
+        "Unwatches all previously watched keys"
+        if self._pipe is not None:
+            self._immediate("unwatch", (), {})
+        self.watching = False
+        return True
+
+    def multi(self):
+        """
+        Start queueing commands for the transaction, after watching keys
+        with watch().
+        """
+        if self.explicit_transaction:
+            raise DataError("Cannot issue nested calls to MULTI")
+        if self.command_stack:
+            raise DataError("Commands without an initial WATCH have already "
+                            "been issued")
+        self.explicit_transaction = True
+
+    def _immediate(self, name, args, kwargs):
+        """
+        Run a command straight away on the watching connection.
+        """
+        try:
+            return getattr(self._pipe, name)(*args, **kwargs)
+        except ConnectionError as e:
+            node = self._node
+            self.reset()
+            self._lost_connection(node, e)
+
+    def _lost_connection(self, node, error):
+        """
+        Raise a WatchError for the connection to ``node`` lost while keys
+        were watched if the node has a new master to retry on, or else
+        ``error``, the ConnectionError.
+        """
+        if self.client._new_master(node) is node:
+            raise error
+        raise WatchError("Lost the connection while watching keys")
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def command(*args, **kwargs):
+            if self.watching and not self.explicit_transaction:
+                self._check_node(command_keys(name, args, kwargs))
+                codec = self.client.codec
+                if codec is not None:
+                    args, kwargs = encode_arguments(codec, name, args, kwargs)
+                    return decode_result(codec, name,
+                        self._immediate(name, args, kwargs))
+                return self._immediate(name, args, kwargs)
+            self.command_stack.append((name, args, kwargs))
+            return self
+        return command
+
+    def execute(self, raise_on_error=True):
+        "Execute all the queued commands, returning a list of their results"
+        commands = self.command_stack
+        codec = self.client.codec
+        if codec is not None:
+            commands = [(name,) + encode_arguments(codec, name, args, kwargs)
+                        for name, args, kwargs in commands]
+        try:
+            if self.transaction:
+                results = self._execute_transaction(commands, raise_on_error)
+            else:
+                results = self._execute_pipelines(commands, raise_on_error)
+        finally:
+            self.reset()
+        if codec is not None:
+            results = [decode_result(codec, name, result)
+                       for (name, args, kwargs), result in zip(commands,
+                                                               results)]
+        return results
+
+    def _execute_transaction(self, commands, raise_on_error):
+        keys = [key for name, args, kwargs in commands
+                for key in command_keys(name, args, kwargs)]
+        if self.shard_hint is not None:
+            keys.append(self.shard_hint)
+
+        def queue(pipe):
+            pipe.multi()
+            for name, args, kwargs in commands:
+                getattr(pipe, name)(*args, **kwargs)
+            return pipe.execute(raise_on_error)
+
+        if self.watching:
+            if keys:
+                self._check_node(keys)
+            try:
+                return queue(self._pipe)
+            except ConnectionError as e:
+                self._lost_connection(self._node, e)
+        if not commands:
+            return []
+        node = self._check_node(keys)
+        return self.client._execute_with_failover(node,
+            lambda connection: queue(connection.pipeline(True)),
+            "transaction", keys[0])
+
+    def _execute_pipelines(self, commands, raise_on_error):
+        # Each command is routed on its first key, once it is checked that
+        # all of its keys are on the same node.
+        route = []
+        for name, args, kwargs in commands:
+            keys = command_keys(name, args, kwargs)
+            self.client._get_node_for_keys(keys)
+            route.append(keys[0])
+
+        def pipeline(indexes):
+            def execute(connection):
+                pipe = connection.pipeline(transaction=False)
+                for index in indexes:
+                    name, args, kwargs = commands[index]
+                    getattr(pipe, name)(*args, **kwargs)
+                return pipe.execute(raise_on_error)
+            return execute
+        return self.client._scatter(route, pipeline, "pipeline")
@@ -0,0 +1,119 @@
+"""
+Sampling profiler for the keys a disredis client uses.
+
+Keys with the same {} hashtag all live on one master, so a popular hashtag
+can overload that master while the others are idle. A KeyProfiler passed to
+DisredisClient as ``profiler`` samples the commands the client sends and
+counts requests and bytes by node and by hashtag (or whole key, for keys
+without one). Hashtags are counted with the space-saving algorithm, so
+memory stays bounded however many distinct keys there are, and the busiest
+ones are reported with an upper bound on how much their counts are over.
+
+"""
+import random
+import threading
+
+
+class SpaceSaving(object):
+    """
+    Approximate top-``capacity`` counter (Metwally et al.'s space-saving
+    algorithm). Items that are counted often enough are never evicted, and
+    each count is at most ``error`` higher than the true count.
+    """
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+
+    def add(self, item, count=1):
+        if item in self.counts:
+            self.counts[item] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+        else:
+            # Replace the smallest item; its count becomes the new item's
+            # possible overcount.
+            smallest = min(self.counts, key=self.counts.get)
+            minimum = self.counts.pop(smallest)
+            del self.errors[smallest]
+            self.counts[item] = minimum + count
+            self.errors[item] = minimum
+
+    def top(self, n=None):
+        """
+        Returns up to ``n`` ``(item, count, error)`` tuples, largest count
+        first.
+        """
+        items = sorted(self.counts, key=self.counts.get, reverse=True)
+        return [(item, self.counts[item], self.errors[item])
+                for item in items[:n]]
+
+
+def value_size(value):
+    "Returns the number of bytes in a string value, or a list of them"
+    if isinstance(value, (list, tuple)):
+        return sum(value_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(value_size(item) for item in value.items())
+    if isinstance(value, bytes):
+        return len(value)
+    if hasattr(value, "encode"):
+        return len(value.encode("utf-8"))
+    return 0
+
+
+class KeyProfiler(object):
+    """
+    Samples ``sample_rate`` of the commands it is given and keeps request
+    and byte counts by node, and the ``capacity`` hashtags with the most
+    requests and with the most bytes. Counts are scaled up by the sample
+    rate, so they estimate the totals.
+    """
+    def __init__(self, sample_rate=0.01, capacity=100):
+        self.sample_rate = sample_rate
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        "Forget everything counted so far"
+        with self._lock:
+            self.node_requests = {}
+            self.node_bytes = {}
+            self.tag_requests = SpaceSaving(self.capacity)
+            self.tag_bytes = SpaceSaving(self.capacity)
+
+    def sample(self):
+        "Returns True if the next command should be recorded"
+        return random.random() < self.sample_rate
+
+    def record(self, node_name, tag, nbytes):
+        """
+        Count a sampled command sent to ``node_name`` for a key with the
+        hashtag ``tag``, which sent and received ``nbytes`` bytes of keys
+        and values.
+        """
+        weight = 1.0 / self.sample_rate
+        with self._lock:
+            self.node_requests[node_name] = (
+                self.node_requests.get(node_name, 0) + weight)
+            self.node_bytes[node_name] = (
+                self.node_bytes.get(node_name, 0) + weight * nbytes)
+            self.tag_requests.add(tag, weight)
+            self.tag_bytes.add(tag, weight * nbytes)
+
+    def report(self, n=10):
+        """
+        Returns a dict with the estimated ``node_requests`` and
+        ``node_bytes`` by node name, and the ``n`` busiest hashtags by
+        requests (``top_requests``) and by bytes (``top_bytes``) as
+        ``(tag, count, error)`` tuples.
+        """
+        with self._lock:
+            return {
+                "node_requests": dict(self.node_requests),
+                "node_bytes": dict(self.node_bytes),
+                "top_requests": self.tag_requests.top(n),
+                "top_bytes": self.tag_bytes.top(n),
+            }
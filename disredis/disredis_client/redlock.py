@@ -0,0 +1,232 @@
+"""
+Distributed lock held on a majority of the masters (the Redlock algorithm).
+
+DisredisClient.lock() keeps a lock on the one master that owns its key, so
+if that master fails before the lock is copied to its replica, the
+promoted replica can hand the same lock to someone else. A Redlock is set
+on every master at once with SET NX PX, and is only held if a majority of
+them granted it within its time to live, so losing one master doesn't lose
+the lock.
+
+"""
+import logging
+import random
+import threading
+import time
+import uuid
+
+from redis.exceptions import LockError
+
+
+# Delete or extend the lock only if it still holds our token.
+UNLOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+else
+    return 0
+end
+"""
+EXTEND_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+else
+    return 0
+end
+"""
+
+
+class LockMetrics(object):
+    """
+    Counts of Redlock acquisitions and how long they took, shared by the
+    locks of a client.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.acquired = 0
+        self.failed = 0
+        self.lost = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record_attempt(self, acquired, latency):
+        with self._lock:
+            self.attempts += 1
+            if acquired:
+                self.acquired += 1
+            else:
+                self.failed += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def record_lost(self):
+        with self._lock:
+            self.lost += 1
+
+    def stats(self):
+        """
+        Returns a dict with the number of acquisition ``attempts`` (every
+        round of SET NX on the masters), how many ``acquired`` the lock or
+        ``failed``, how many held locks were ``lost`` because they couldn't
+        be extended, and the ``mean_latency`` and ``max_latency`` of an
+        attempt in seconds.
+        """
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "acquired": self.acquired,
+                "failed": self.failed,
+                "lost": self.lost,
+                "mean_latency": (self.total_latency / self.attempts
+                                 if self.attempts else None),
+                "max_latency": self.max_latency,
+            }
+
+
+class Redlock(object):
+    """
+    A lock named ``name`` held on a majority of the masters of ``client``
+    for up to ``timeout`` seconds. Made with DisredisClient.redlock().
+
+    ``sleep`` is the longest time to wait between attempts to acquire it
+    when blocking; the actual wait is random, so that clients contending
+    for the lock don't keep colliding. ``drift_factor`` is the share of the
+    timeout allowed for the masters' clocks running at different speeds.
+
+    With ``auto_extend``, a background thread extends the lock every third
+    of its timeout for as long as it is held. If that fails, ``lost`` is
+    set and the lock should be assumed to be held by someone else.
+    """
+    def __init__(self, client, name, timeout=10, sleep=0.2,
+                 drift_factor=0.01, auto_extend=False, metrics=None):
+        self.client = client
+        self.name = name
+        self.timeout = timeout
+        self.sleep = sleep
+        self.drift_factor = drift_factor
+        self.auto_extend = auto_extend
+        self.metrics = metrics or LockMetrics()
+        self.token = None
+        self.validity = None
+        self.lost = False
+        self._extender = None
+        self._released = threading.Event()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    @property
+    def quorum(self):
+        return len(self.client.nodes) // 2 + 1
+
+    def _on_all_nodes(self, make_call):
+        """
+        Run ``make_call(connection)`` on every node in parallel. Returns the
+        number of nodes on which it returned a true value; errors count as
+        false.
+        """
+        results = self.client._execute_on_nodes(
+            [(node, make_call) for node in list(self.client.nodes)],
+            raise_errors=False)
+        return len([result for result in results
+                    if result and not isinstance(result, Exception)])
+
+    def _unlock(self, token):
+        return self._on_all_nodes(lambda connection: connection.eval(
+            UNLOCK_SCRIPT, 1, self.name, token))
+
+    def _validity(self, start, ttl):
+        "Returns how many of ``ttl`` seconds from ``start`` can be relied on"
+        drift = ttl * self.drift_factor + 0.002
+        return ttl - (time.time() - start) - drift
+
+    def acquire(self, blocking=True, blocking_timeout=None):
+        """
+        Acquire the lock, waiting for it for up to ``blocking_timeout``
+        seconds (forever if it is None) when ``blocking`` is True. Returns
+        True if it was acquired.
+        """
+        if self.token is not None:
+            raise LockError("Cannot acquire an already acquired lock")
+        token = uuid.uuid4().hex
+        ttl_ms = int(self.timeout * 1000)
+        deadline = None
+        if blocking_timeout is not None:
+            deadline = time.time() + blocking_timeout
+        while True:
+            start = time.time()
+            granted = self._on_all_nodes(lambda connection: connection.set(
+                self.name, token, nx=True, px=ttl_ms))
+            validity = self._validity(start, self.timeout)
+            acquired = granted >= self.quorum and validity > 0
+            self.metrics.record_attempt(acquired, time.time() - start)
+            if acquired:
+                self.token = token
+                self.validity = validity
+                self.lost = False
+                if self.auto_extend:
+                    self._start_extender()
+                return True
+            # Don't leave a partial lock behind to block other clients.
+            self._unlock(token)
+            if not blocking:
+                return False
+            delay = random.uniform(0, self.sleep)
+            if deadline is not None and time.time() + delay > deadline:
+                return False
+            time.sleep(delay)
+
+    def release(self):
+        "Release the lock on every master"
+        token, self.token = self.token, None
+        if token is None:
+            raise LockError("Cannot release an unlocked lock")
+        self._released.set()
+        if self._unlock(token) < self.quorum:
+            raise LockError("Cannot release a lock that's no longer owned")
+
+    def extend(self, timeout=None):
+        """
+        Reset the time to live of the held lock to ``timeout`` seconds, or
+        the lock's own timeout. Raises a LockError if it is no longer held
+        on a majority of the masters.
+        """
+        if self.token is None:
+            raise LockError("Cannot extend an unlocked lock")
+        ttl = timeout if timeout is not None else self.timeout
+        token = self.token
+        start = time.time()
+        extended = self._on_all_nodes(lambda connection: connection.eval(
+            EXTEND_SCRIPT, 1, self.name, token, int(ttl * 1000)))
+        validity = self._validity(start, ttl)
+        if extended < self.quorum or validity <= 0:
+            raise LockError("Cannot extend a lock that's no longer owned")
+        self.validity = validity
+        return True
+
+    def _start_extender(self):
+        self._released = threading.Event()
+        self._extender = threading.Thread(target=self._extend_until_released,
+                                          args=(self._released,))
+        self._extender.daemon = True
+        self._extender.start()
+
+    def _extend_until_released(self, released):
+        while True:
+            released.wait(self.timeout / 3.0)
+            if released.is_set():
+                return
+            try:
+                self.extend()
+            except Exception:
+                if released.is_set():
+                    return  # released while it was being extended
+                self.lost = True
+                self.metrics.record_lost()
+                logger = logging.getLogger('custommade_logging')
+                logger.warning("Lost the lock %s" % self.name)
+                return
@@ -0,0 +1,230 @@
+"""
+Snapshots of the whole keyspace of a disredis cluster in a local file.
+
+export_snapshot() SCANs every master at the same time, reading each key
+with DUMP and PTTL, and streams the keys into one file. import_snapshot()
+reads the file back and RESTOREs each key on the node that owns it for the
+client it is given, so a snapshot can be loaded into a cluster with other
+masters or weights than the one it came from, re-sharding the keys. Run
+this module to export or import a snapshot:
+
+    python -m disredis.disredis_client.snapshot \\
+        export PATH SENTINEL_HOST:PORT ...
+
+The file starts with MAGIC, followed by a record for each key: the lengths
+of the key and of its DUMP, and its time to live in milliseconds (-1 for
+none), packed as RECORD_HEADER, then the key and the DUMP. The DUMP format
+is tied to the Redis version, so a snapshot can only be imported into
+masters running the same version as, or a newer version than, the ones it
+was exported from.
+
+"""
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from optparse import OptionParser
+
+from disredis.disredis_client.client import DisredisClient
+
+
+MAGIC = b"DISREDIS-SNAPSHOT-1\n"
+RECORD_HEADER = struct.Struct(">IIq")
+
+
+def _bytes(value):
+    if not isinstance(value, bytes):
+        value = value.encode("utf-8")
+    return value
+
+
+def _export_node(connection, write, scan_count, batch_size):
+    "Write every key of one node with ``write``, returning how many there were"
+    keys = 0
+
+    def dump(batch):
+        pipe = connection.pipeline(transaction=False)
+        for key in batch:
+            pipe.dump(key)
+            pipe.pttl(key)
+        results = pipe.execute()
+        records = []
+        for key, data, ttl in zip(batch, results[::2], results[1::2]):
+            # Skip keys that were deleted or expired since the SCAN, which
+            # DUMP returns nil and PTTL -2 for, and keys with 0ms left,
+            # which RESTORE would keep for good.
+            if data is None or ttl == -2 or ttl == 0:
+                continue
+            key = _bytes(key)
+            records.append(RECORD_HEADER.pack(len(key), len(data), ttl))
+            records.append(key)
+            records.append(data)
+        write(b"".join(records))
+        return len(records) // 3
+
+    batch = []
+    for key in connection.scan_iter(count=scan_count):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            keys += dump(batch)
+            batch = []
+    if batch:
+        keys += dump(batch)
+    return keys
+
+
+def export_snapshot(client, path, scan_count=1000, batch_size=1000):
+    """
+    Write every key of every master of ``client`` to ``path``, reading the
+    masters in parallel with DUMP and PTTL in pipelines of ``batch_size``
+    keys. The snapshot is written to a temporary file that is renamed to
+    ``path`` once it is complete.
+
+    Keys written while the export runs may or may not be included, as with
+    SCAN. If a master fails over during the export, its keys are read again
+    from the new master, and those already read appear twice, which is
+    harmless when importing.
+
+    Returns a dict with the number of ``keys`` exported in total and by
+    node (``nodes``), the ``bytes`` written and the ``seconds`` taken.
+    """
+    start = time.time()
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=".disredis-snapshot",
+                                     dir=directory)
+    lock = threading.Lock()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+
+            def write(data):
+                with lock:
+                    f.write(data)
+            nodes = list(client.nodes)
+            results = client._execute_on_nodes([
+                (node, lambda connection: _export_node(connection, write,
+                    scan_count, batch_size))
+                for node in nodes])
+            size = f.tell()
+        os.rename(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+    return {
+        "keys": sum(results),
+        "nodes": dict((node.name, keys) for node, keys in zip(nodes, results)),
+        "bytes": size,
+        "seconds": time.time() - start,
+    }
+
+
+def read_snapshot(path):
+    """
+    Generate the ``(key, dump, ttl)`` records of the snapshot in ``path``,
+    reading it through a memory map.
+    """
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError("%s is not a disredis snapshot" % path)
+            offset = len(MAGIC)
+            end = len(data)
+            while offset < end:
+                key_length, dump_length, ttl = RECORD_HEADER.unpack_from(
+                    data, offset)
+                offset += RECORD_HEADER.size
+                key = data[offset:offset + key_length]
+                offset += key_length
+                dump = data[offset:offset + dump_length]
+                offset += dump_length
+                yield key, dump, ttl
+        finally:
+            data.close()
+
+
+def import_snapshot(client, path, batch_size=1000, replace=True):
+    """
+    RESTORE every key in the snapshot at ``path`` on the node of ``client``
+    that owns it, with the time to live it had when it was exported.
+    ``batch_size`` keys at a time are split up by node and sent in one
+    pipeline per node, in parallel. Keys that already exist are replaced,
+    or if ``replace`` is False, make the import fail.
+
+    Returns a dict with the number of ``keys`` imported in total and by
+    node (``nodes``) and the ``seconds`` taken.
+    """
+    start = time.time()
+    counts = {}
+    options = ("REPLACE",) if replace else ()
+
+    def restore(batch):
+        def pipeline(indexes):
+            def execute(connection):
+                pipe = connection.pipeline(transaction=False)
+                for index in indexes:
+                    key, dump, ttl = batch[index]
+                    pipe.execute_command("RESTORE", key, max(ttl, 0), dump,
+                                         *options)
+                return pipe.execute()
+            return execute
+        keys = [record[0] for record in batch]
+        client._scatter(keys, pipeline)
+        for key in keys:
+            name = client.get_node_for_key(key).name
+            counts[name] = counts.get(name, 0) + 1
+
+    batch = []
+    for record in read_snapshot(path):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            restore(batch)
+            batch = []
+    if batch:
+        restore(batch)
+    return {
+        "keys": sum(counts.values()),
+        "nodes": counts,
+        "seconds": time.time() - start,
+    }
+
+
+def main(argv=None):
+    parser = OptionParser(
+        usage="%prog export|import PATH SENTINEL_HOST:PORT ...",
+        description="Export every key of a disredis cluster to a snapshot "
+                    "file, or import a snapshot into a cluster, placing "
+                    "each key on the master that owns it.")
+    parser.add_option("--weight", action="append", default=[],
+                      metavar="NAME=WEIGHT",
+                      help="weight of a master, as given to the client")
+    parser.add_option("--batch-size", type="int", default=1000, metavar="N",
+                      help="keys read or written in each pipeline")
+    parser.add_option("--no-replace", action="store_false", dest="replace",
+                      default=True,
+                      help="fail the import if a key already exists")
+    options, args = parser.parse_args(argv)
+    if len(args) < 3 or args[0] not in ("export", "import"):
+        parser.error("a command, a path and at least one Sentinel address "
+                     "are needed")
+    command, path, addresses = args[0], args[1], args[2:]
+    weights = {}
+    for weight in options.weight:
+        name, value = weight.rsplit("=", 1)
+        weights[name] = int(value)
+    client = DisredisClient(addresses, weights=weights)
+    if command == "export":
+        stats = export_snapshot(client, path, batch_size=options.batch_size)
+    else:
+        stats = import_snapshot(client, path, batch_size=options.batch_size,
+                                replace=options.replace)
+    for name in sorted(stats["nodes"]):
+        print("%-20s %12d" % (name, stats["nodes"][name]))
+    print("%sed %d keys in %.1f seconds" % (command.capitalize(),
+                                           stats["keys"], stats["seconds"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+"""
+Data structures spread over several masters of a disredis cluster.
+
+A single key always lives on one master, so a very hot key, such as a
+global counter, loads that one master however many there are. These
+structures split one logical value over sub-keys with different hashtags,
+so that the load is spread over the masters, as is the memory of a value
+too big for one master.
+
+"""
+import os
+import random
+import threading
+import time
+from hashlib import sha1
+from heapq import nlargest, nsmallest
+
+import redis
+from redis.client import list_or_args
+from redis.exceptions import DataError
+
+# redis-py 3 changed zadd() to take a mapping of members to scores, and
+# zincrby() to take the amount before the member.
+REDIS_3 = redis.VERSION >= (3, 0)
+
+
+def shard_keys(client, name, shards):
+    """
+    Returns ``shards`` sub-keys for ``name``, each with a hashtag of its
+    own, chosen so that they are spread over as many different nodes of
+    ``client`` as possible. The choice only depends on the name and the
+    nodes, so every client of the cluster picks the same sub-keys.
+    """
+    keys = []
+    used = set()
+    salt = 0
+    # Nodes with a weight of 0 never own a key.
+    nodes = len(set(client._slots))
+    while len(keys) < shards:
+        key = "{%d#%s}" % (salt, name)
+        node = client.get_node_for_key(key).name
+        # Once every node has a shard, start over with all of them free.
+        if len(used) == nodes:
+            used = set()
+        if node not in used:
+            used.add(node)
+            keys.append(key)
+        salt += 1
+    return keys
+
+
+def bucket_index(value, buckets):
+    "Returns which of ``buckets`` buckets the field or member ``value`` is in"
+    if not isinstance(value, bytes):
+        value = ("%s" % value).encode("utf-8")
+    return int(sha1(value).hexdigest(), 16) % buckets
+
+
+class ShardedCounter(object):
+    """
+    A counter named ``name`` split over ``shards`` sub-keys on different
+    nodes of ``client`` (one per node by default). Made with
+    DisredisClient.sharded_counter().
+
+    Increments go to a random shard, or with ``local`` True, to the same
+    shard for every increment made by a thread. Reading the value sums all
+    the shards in one parallel round; with ``cache_ttl`` set, the sum is
+    reused for that many seconds, so it may be that much out of date.
+    """
+    def __init__(self, client, name, shards=None, local=False, cache_ttl=0):
+        self.client = client
+        self.name = name
+        self.keys = shard_keys(client, name, shards or len(client.nodes))
+        self.local = local
+        self.cache_ttl = cache_ttl
+        self._cached = None
+        self._cached_at = 0
+
+    def _shard(self):
+        if self.local:
+            index = hash((os.getpid(), threading.current_thread().ident))
+            return self.keys[index % len(self.keys)]
+        return random.choice(self.keys)
+
+    def incr(self, amount=1):
+        """
+        Increments the counter by ``amount``. Returns the new value of the
+        shard that was incremented, not of the whole counter.
+        """
+        return self.client.incr(self._shard(), amount)
+
+    def decr(self, amount=1):
+        "Decrements the counter by ``amount``"
+        return self.incr(-amount)
+
+    def value(self):
+        "Returns the value of the counter, the sum of all of its shards"
+        if self.cache_ttl and self._cached is not None and (
+                time.time() - self._cached_at < self.cache_ttl):
+            return self._cached
+        total = sum(int(value) for value in self.client.mget(self.keys)
+                    if value is not None)
+        self._cached, self._cached_at = total, time.time()
+        return total
+
+    def expire(self, time):
+        "Set an expire flag on every shard for ``time`` seconds"
+        self.client.execute_batch([("expire", key, (time,), {})
+                                   for key in self.keys])
+
+    def delete(self):
+        "Delete the counter, setting it back to 0"
+        self._cached = None
+        return self.client.delete(*self.keys)
+
+
+class PartitionedHash(object):
+    """
+    A hash named ``name`` split by field over ``buckets`` sub-keys on
+    different nodes of ``client``. Made with DisredisClient.partitioned_hash().
+
+    Every client of the hash must use the same number of buckets, since the
+    bucket of a field depends on it. Commands on one field go to its bucket;
+    commands on several fields are sent in one pipeline per node, and hlen()
+    reads every bucket in one parallel round. hscan_iter() streams the
+    fields a bucket at a time, without holding the whole hash in memory.
+    """
+    def __init__(self, client, name, buckets=16):
+        self.client = client
+        self.name = name
+        self.keys = shard_keys(client, name, buckets)
+
+    def _bucket(self, key):
+        return self.keys[bucket_index(key, len(self.keys))]
+
+    def _group(self, keys):
+        "Returns a dict of the bucket keys by bucket for ``keys``"
+        groups = {}
+        for key in keys:
+            groups.setdefault(self._bucket(key), []).append(key)
+        return groups
+
+    def hget(self, key):
+        "Return the value of ``key``"
+        return self.client.hget(self._bucket(key), key)
+
+    def hset(self, key, value):
+        """
+        Set ``key`` to ``value``
+        Returns 1 if HSET created a new field, otherwise 0
+        """
+        return self.client.hset(self._bucket(key), key, value)
+
+    def hsetnx(self, key, value):
+        """
+        Set ``key`` to ``value`` if ``key`` does not exist.
+        Returns 1 if HSETNX created a field, otherwise 0.
+        """
+        return self.client.hsetnx(self._bucket(key), key, value)
+
+    def hexists(self, key):
+        "Returns a boolean indicating if ``key`` exists"
+        return self.client.hexists(self._bucket(key), key)
+
+    def hincrby(self, key, amount=1):
+        "Increment the value of ``key`` by ``amount``"
+        return self.client.hincrby(self._bucket(key), key, amount)
+
+    def hmget(self, keys, *args):
+        "Returns a list of values ordered identically to ``keys``"
+        keys = list_or_args(keys, args)
+        return self.client.execute_batch([("hget", self._bucket(key), (key,),
+                                           {}) for key in keys])
+
+    def hmset(self, mapping):
+        "Sets each key in the ``mapping`` dict to its corresponding value"
+        groups = self._group(mapping)
+        self.client.execute_batch([
+            ("hmset", bucket, (dict((key, mapping[key]) for key in keys),), {})
+            for bucket, keys in groups.items()])
+        return True
+
+    def hdel(self, *keys):
+        "Delete ``keys``, returning how many of them existed"
+        groups = self._group(keys)
+        return sum(self.client.execute_batch([
+            ("hdel", bucket, tuple(keys), {})
+            for bucket, keys in groups.items()]))
+
+    def hlen(self):
+        "Return the number of fields, counted on every bucket in parallel"
+        return sum(self.client.execute_batch([("hlen", bucket, (), {})
+                                              for bucket in self.keys]))
+
+    def hscan_iter(self, match=None, count=None):
+        """
+        Generate ``(key, value)`` pairs for every field, or those matching
+        ``match``, using HSCAN on each bucket in turn, with ``count`` as a
+        hint of how many to fetch at a time. As with HSCAN, fields changed
+        during the scan may or may not be returned.
+        """
+        for bucket in self.keys:
+            cursor = None
+            while cursor != 0:
+                cursor, data = self.client.hscan(bucket, cursor or 0,
+                                                 match=match, count=count)
+                for item in data.items():
+                    yield item
+
+    def hgetall(self):
+        """
+        Return a dict of every field and its value. This holds the whole hash
+        in memory; use hscan_iter() for a hash that is too big for that.
+        """
+        return dict(self.hscan_iter())
+
+    def expire(self, time):
+        "Set an expire flag on every bucket for ``time`` seconds"
+        self.client.execute_batch([("expire", key, (time,), {})
+                                   for key in self.keys])
+
+    def delete(self):
+        "Delete the hash"
+        return self.client.delete(*self.keys)
+
+
+class PartitionedSortedSet(object):
+    """
+    A sorted set named ``name`` split by member over ``shards`` sub-keys on
+    different nodes of ``client`` (one per node by default), such as a
+    leaderboard too hot or too big for one master. Made with
+    DisredisClient.partitioned_sorted_set().
+
+    Every client of the set must use the same number of shards. Commands on
+    one member go to its shard. A range is read from every shard in one
+    parallel round, each shard returning its own first ``end + 1`` members,
+    which are then merged, so ranges near the top (or with zrange, the
+    bottom) are cheap. Ranks are counted with ZCOUNT on every shard, so
+    members with equal scores share a rank.
+    """
+    def __init__(self, client, name, shards=None):
+        self.client = client
+        self.name = name
+        self.keys = shard_keys(client, name, shards or len(client.nodes))
+
+    def _shard(self, value):
+        return self.keys[bucket_index(value, len(self.keys))]
+
+    def _on_shards(self, command, *args, **kwargs):
+        "Run ``command`` on every shard, returning the results in order"
+        return self.client.execute_batch([(command, key, args, kwargs)
+                                          for key in self.keys])
+
+    def zadd(self, *args, **kwargs):
+        """
+        Set any number of score, element-name pairs. Pairs can be specified
+        in three ways:
+
+        As a dict mapping element names to scores, as with redis-py 3,
+        as *args, in the form of: score1, name1, score2, name2, ...
+        or as **kwargs, in the form of: name1=score1, name2=score2, ...
+        """
+        if len(args) == 1 and isinstance(args[0], dict):
+            pairs = list(args[0].items())
+        elif len(args) % 2 != 0:
+            raise DataError("ZADD requires an equal number of "
+                            "values and scores")
+        else:
+            pairs = list(zip(args[1::2], args[::2]))
+        pairs.extend(kwargs.items())
+        groups = {}
+        for value, score in pairs:
+            groups.setdefault(self._shard(value), {})[value] = score
+        if REDIS_3:
+            calls = [("zadd", key, (mapping,), {})
+                     for key, mapping in groups.items()]
+        else:
+            calls = [("zadd", key, tuple(piece for value, score in
+                                         mapping.items()
+                                         for piece in (score, value)), {})
+                     for key, mapping in groups.items()]
+        return sum(self.client.execute_batch(calls))
+
+    def zincrby(self, value, amount=1):
+        "Increment the score of ``value`` by ``amount``"
+        if REDIS_3:
+            return self.client.zincrby(self._shard(value), amount, value)
+        return self.client.zincrby(self._shard(value), value, amount)
+
+    def zscore(self, value):
+        "Return the score of element ``value``"
+        return self.client.zscore(self._shard(value), value)
+
+    def zrem(self, *values):
+        "Remove member ``values``, returning how many of them were removed"
+        groups = {}
+        for value in values:
+            groups.setdefault(self._shard(value), []).append(value)
+        return sum(self.client.execute_batch([
+            ("zrem", key, tuple(values), {})
+            for key, values in groups.items()]))
+
+    def zcard(self):
+        "Return the number of elements, counted on every shard in parallel"
+        return sum(self._on_shards("zcard"))
+
+    def zcount(self, min, max):
+        "Return the number of elements with scores between ``min`` and ``max``"
+        return sum(self._on_shards("zcount", min, max))
+
+    def _range(self, start, end, desc, withscores, score_cast_func):
+        if start < 0 or end < 0:
+            # Counting from the end needs every member of every shard.
+            fetch = -1
+        else:
+            fetch = end
+        command = "zrevrange" if desc else "zrange"
+        pairs = [pair for result in self._on_shards(command, 0, fetch,
+                     withscores=True, score_cast_func=score_cast_func)
+                 for pair in result]
+        # Equal scores are ordered by member, as Redis does.
+        key = lambda pair: (pair[1], pair[0])
+        if fetch < 0:
+            pairs = sorted(pairs, key=key, reverse=desc)
+            end = end + 1 or len(pairs)
+            pairs = pairs[start:end]
+        else:
+            select = nlargest if desc else nsmallest
+            pairs = select(end + 1, pairs, key=key)[start:]
+        if withscores:
+            return pairs
+        return [value for value, score in pairs]
+
+    def zrevrange(self, start, end, withscores=False, score_cast_func=float):
+        """
+        Return a range of values between ``start`` and ``end`` sorted in
+        descending order.
+
+        ``start`` and ``end`` can be negative, indicating the end of the range,
+        in which case every member of every shard is read.
+
+        ``withscores`` indicates to return the scores along with the values.
+        The return type is a list of (value, score) pairs
+
+        ``score_cast_func`` a callable used to cast the score return value
+        """
+        return self._range(start, end, True, withscores, score_cast_func)
+
+    def zrange(self, start, end, desc=False, withscores=False,
+               score_cast_func=float):
+        """
+        Return a range of values between ``start`` and ``end`` sorted in
+        ascending order, or descending if ``desc`` is True.
+
+        ``start`` and ``end`` can be negative, indicating the end of the range,
+        in which case every member of every shard is read.
+
+        ``withscores`` indicates to return the scores along with the values.
+        The return type is a list of (value, score) pairs
+
+        ``score_cast_func`` a callable used to cast the score return value
+        """
+        return self._range(start, end, desc, withscores, score_cast_func)
+
+    def zrank(self, value):
+        """
+        Returns a 0-based value indicating the rank of ``value``, the number
+        of members with a lower score, or None if it isn't a member
+        """
+        score = self.zscore(value)
+        if score is None:
+            return None
+        return self.zcount("-inf", "(%r" % score)
+
+    def zrevrank(self, value):
+        """
+        Returns a 0-based value indicating the descending rank of ``value``,
+        the number of members with a higher score, or None if it isn't a
+        member
+        """
+        score = self.zscore(value)
+        if score is None:
+            return None
+        return self.zcount("(%r" % score, "+inf")
+
+    def expire(self, time):
+        "Set an expire flag on every shard for ``time`` seconds"
+        self._on_shards("expire", time)
+
+    def delete(self):
+        "Delete the sorted set"
+        return self.client.delete(*self.keys)
@@ -2,11 +2,40 @@
 Tests for disredis, a clustered Redis client.
 
 """
-from unittest import TestCase
+import gc
+import os
+import tempfile
+import threading
+import time
+import weakref
+import zlib
+from unittest import TestCase, skipIf
 
-from redis.exceptions import ConnectionError
+import redis
+from redis.exceptions import (ConnectionError, DataError, LockError,
+    ResponseError, WatchError)
 
-from disredis.disredis_client.client import DisredisClient, Node
+from disredis.disredis_client import client as client_module
+from disredis.disredis_client import coalesce
+from disredis.disredis_client.client import (DisredisClient, Node,
+    NodeResults, get_shared_client, merge_info)
+from disredis.disredis_client.analysis import (distribution_report,
+    keyspace_report)
+from disredis.disredis_client.batching import WriteBuffer
+from disredis.disredis_client.bulkload import bulk_load, read_records
+from disredis.disredis_client.codecs import ZlibCodec
+from disredis.disredis_client.health import HealthChecker
+from disredis.disredis_client.hedge import HedgedReads, Workers
+from disredis.disredis_client.profiler import KeyProfiler, SpaceSaving
+from disredis.disredis_client.snapshot import export_snapshot, import_snapshot
+from disredis.disredis_client.topology import load_topology, save_topology
+from disredis.disredis_client.tracing import SlowLog
+
+try:
+    import asyncio
+    from disredis.disredis_client import asyncio_client
+except (ImportError, SyntaxError):  # Python 2, or redis-py older than 4.2
+    asyncio_client = None
 
 class MockStrictRedis(object):
     """
@@ -14,30 +43,233 @@ class MockStrictRedis(object):
     and Sentinel servers.
     """
     fail = False
+    stall = 0
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, **kwargs):
         self.host = host
         self.port = port
         self.data = {}
+        self.ttls = {}
+        self.connection_pool = MockConnectionPool(self)
         self.masters = [["name", "node1", "ip", "1.2.3.4", "port", "1"],
                 ["name", "node2", "ip", "1.2.3.4", "port", "2"]]
 
     def get(self, key):
         if self.fail:
             raise ConnectionError("FAIL!")
-        return self.data[key]
+        if self.stall:
+            time.sleep(self.stall)
+        return self.data.get(key)
 
-    def set(self, key, value):
+    def set(self, key, value, ex=None, px=None, nx=False, xx=False):
         if self.fail:
             raise ConnectionError("FAIL!")
+        if nx and key in self.data:
+            return None
         self.data[key] = value
+        self.ttls[key] = ex
+        return True
+
+    def incr(self, key, amount=1):
+        if isinstance(self.data.get(key), (dict, set)):
+            raise ResponseError("WRONGTYPE Operation against a key holding "
+                                "the wrong kind of value")
+        self.data[key] = int(self.data.get(key, 0)) + amount
+        return self.data[key]
+
+    def expire(self, key, time):
+        self.ttls[key] = time
+        return key in self.data
+
+    def hset(self, name, key, value):
+        self.data.setdefault(name, {})[key] = value
+        return 1
+
+    def hgetall(self, name):
+        return dict(self.data.get(name, {}))
+
+    def hget(self, name, key):
+        return self.data.get(name, {}).get(key)
+
+    def hmset(self, name, mapping):
+        self.data.setdefault(name, {}).update(mapping)
+        return True
+
+    def hdel(self, name, *keys):
+        values = self.data.get(name, {})
+        return len([values.pop(key) for key in keys if key in values])
+
+    def hlen(self, name):
+        return len(self.data.get(name, {}))
+
+    if redis.VERSION >= (3, 0):
+        def zadd(self, name, mapping, nx=False, xx=False, ch=False,
+                 incr=False):
+            values = self.data.setdefault(name, {})
+            added = len([value for value in mapping if value not in values])
+            values.update((value, float(score))
+                          for value, score in mapping.items())
+            return added
+
+        def zincrby(self, name, amount, value):
+            return self.execute_command("ZINCRBY", name, amount, value)
+    else:
+        def zadd(self, name, *args):
+            values = self.data.setdefault(name, {})
+            added = len([value for value in args[1::2]
+                         if value not in values])
+            values.update(zip(args[1::2],
+                              [float(score) for score in args[::2]]))
+            return added
+
+        def zincrby(self, name, value, amount=1):
+            return self.execute_command("ZINCRBY", name, amount, value)
+
+    def zscore(self, name, value):
+        return self.data.get(name, {}).get(value)
+
+    def zrem(self, name, *values):
+        return self.hdel(name, *values)
+
+    def zcard(self, name):
+        return len(self.data.get(name, {}))
+
+    def zcount(self, name, min, max):
+        def bound(limit):
+            limit = str(limit)
+            if limit.startswith("("):
+                return float(limit[1:]), True
+            return float(limit), False
+        (low, low_open), (high, high_open) = bound(min), bound(max)
+        return len([score for score in self.data.get(name, {}).values()
+                    if (score > low if low_open else score >= low) and
+                    (score < high if high_open else score <= high)])
+
+    def zrange(self, name, start, end, desc=False, withscores=False,
+               score_cast_func=float):
+        pairs = sorted(((value, score_cast_func(score)) for value, score
+                        in self.data.get(name, {}).items()),
+                       key=lambda pair: (pair[1], pair[0]), reverse=desc)
+        pairs = pairs[start:end + 1 or len(pairs)]
+        return pairs if withscores else [value for value, score in pairs]
+
+    def zrevrange(self, name, start, end, withscores=False,
+                  score_cast_func=float):
+        return self.zrange(name, start, end, True, withscores,
+                           score_cast_func)
+
+    def hscan(self, name, cursor=0, match=None, count=None):
+        # Two fields at a time, the cursor being the position of the next.
+        fields = sorted(self.data.get(name, {}))
+        page = fields[cursor:cursor + 2]
+        cursor = cursor + 2 if cursor + 2 < len(fields) else 0
+        return cursor, dict((field, self.data[name][field])
+                            for field in page)
+
+    def mget(self, keys):
+        return [self.get(key) for key in keys]
+
+    def mset(self, mapping):
+        for key, value in mapping.items():
+            self.set(key, value)
+        return True
+
+    def delete(self, *keys):
+        if self.fail:
+            raise ConnectionError("FAIL!")
+        return len([self.data.pop(key) for key in keys if key in self.data])
+
+    def ttl(self, key):
+        if self.fail:
+            raise ConnectionError("FAIL!")
+        return self.ttls.get(key)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return MockPipeline(self)
+
+    def eval(self, script, numkeys, key, token, ttl=None):
+        # The unlock and extend scripts of a Redlock.
+        if self.data.get(key) != token:
+            return 0
+        if ttl is None:
+            del self.data[key]
+        return 1
+
+    def lock(self, name, timeout=None, sleep=0.1):
+        return MockLock(self, name)
+
+    def getex(self, key, *args):
+        return self.get(key)
+
+    def flushdb(self):
+        self.data.clear()
+        return True
+
+    def scan_iter(self, match=None, count=None):
+        return iter(sorted(self.data))
+
+    def dbsize(self):
+        return len(self.data)
 
-    def execute_command(self, command, sub_command, *args):
+    def info(self, section=None):
+        return {"used_memory": 100 * len(self.data),
+                "redis_version": "2.8.4", "tcp_port": int(self.port),
+                "db0": {"keys": len(self.data)}}
+
+    def dump(self, key):
+        if key not in self.data:
+            return None
+        return b"dump:" + self.data[key].encode("utf-8")
+
+    def pttl(self, key):
+        ttl = self.ttls.get(key)
+        return -1 if ttl is None else ttl * 1000
+
+    def restore(self, key, ttl, value, *options):
+        if key in self.data and "REPLACE" not in options:
+            raise ResponseError("BUSYKEY Target key name already exists.")
+        self.data[key] = value[len(b"dump:"):].decode("utf-8")
+        self.ttls[key] = ttl // 1000 or None
+        return True
+
+    def ping(self):
         if self.fail:
             raise ConnectionError("FAIL!")
-        assert command == "SENTINEL"
+        return True
+
+    def execute_command(self, command, *args, **options):
+        if self.fail:
+            raise ConnectionError("FAIL!")
+        if command != "SENTINEL":
+            if command == "MGET":
+                return self.mget(args)
+            if command == "MSET":
+                return self.mset(dict(zip(args[::2], args[1::2])))
+            if command == "DEL":
+                return self.delete(*args)
+            if command == "INCRBY":
+                return self.incr(*args)
+            if command == "SADD":
+                self.data.setdefault(args[0], set()).update(args[1:])
+                return len(args) - 1
+            if command in ("HINCRBY", "ZINCRBY"):
+                # Both are stored as a dict of field or member to number.
+                name, field, amount = args
+                if command == "ZINCRBY":
+                    amount, field = field, amount
+                values = self.data.setdefault(name, {})
+                values[field] = values.get(field, 0) + amount
+                return values[field]
+            if command == "MEMORY USAGE":
+                return 10 * len(self.data[args[0]])
+            return getattr(self, command.lower())(*args)
+        sub_command, args = args[0], args[1:]
         if sub_command == "MASTERS":
             return self.masters
+        if sub_command == "SLAVES":
+            port = int(self.masters[-1 if args[0] == "node2" else 0][5])
+            return [["name", "1.2.3.4:%d" % (port + 100), "ip", "1.2.3.4",
+                     "port", str(port + 100), "flags", "slave"]]
         if sub_command == "get-master-addr-by-name":
             for master in self.masters:
                 if master[1] == args[0]:
@@ -46,6 +278,225 @@ class MockStrictRedis(object):
         raise KeyError("Sentinel got command %s" % sub_command)
 
 
+class SlowSentinel(MockStrictRedis):
+    """
+    A mock sentinel that doesn't answer until ``answer`` is set.
+    """
+    answer = threading.Event()
+
+    def execute_command(self, *args, **options):
+        self.answer.wait(5)
+        return super(SlowSentinel, self).execute_command(*args, **options)
+
+
+class MockConnectionPool(object):
+    """
+    A mock version of a redis connection pool, handing out MockConnections
+    to ``server``, a MockStrictRedis.
+    """
+    connection_class = None  # MockConnection, set below
+
+    def __init__(self, server=None):
+        self.server = server
+        self.connection_kwargs = {"server": server}
+        self.available = []
+        self.created = []
+        self.command_names = []
+
+    def get_connection(self, command_name=None, *keys, **options):
+        self.command_names.append(command_name)
+        if self.available:
+            return self.available.pop()
+        connection = MockConnection(self.server)
+        self.created.append(connection)
+        return connection
+
+    def release(self, connection):
+        self.available.append(connection)
+
+    def disconnect(self):
+        for connection in self.created:
+            connection.disconnect()
+
+
+class MockConnection(object):
+    "A mock version of a redis connection, which only answers PING"
+    connected = False
+
+    def __init__(self, server=None, **kwargs):
+        self.server = server
+        self.kwargs = kwargs
+        self.pending = []
+
+    def send_command(self, *args):
+        if self.server.fail:
+            raise ConnectionError("FAIL!")
+        self.connected = True
+        self.pending.append(args)
+
+    def can_read(self, timeout=0):
+        if self.server.stall > timeout:
+            time.sleep(timeout)
+            return False
+        return bool(self.pending)
+
+    def read_response(self):
+        self.pending.pop(0)
+        return b"PONG"
+
+    def disconnect(self):
+        self.connected = False
+        self.pending = []
+
+    def connect(self):
+        time.sleep(0.01)
+        self.connected = True
+
+
+MockConnectionPool.connection_class = MockConnection
+
+
+class MockPipeline(object):
+    """
+    A mock version of a redis pipeline. Commands are queued and then run
+    against the connection when the pipeline is executed. After watch(),
+    commands are run straight away until multi() is called, and execute()
+    raises a WatchError if a watched key was changed.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.commands = []
+        self.watched = None
+        self.in_multi = False
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            if self.watched is not None and not self.in_multi:
+                return getattr(self.connection, name)(*args, **kwargs)
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    def watch(self, *names):
+        if self.connection.fail:
+            raise ConnectionError("FAIL!")
+        self.watched = dict((name, self.connection.data.get(name))
+                            for name in names)
+
+    def multi(self):
+        self.in_multi = True
+
+    def reset(self):
+        self.commands = []
+        self.watched = None
+        self.in_multi = False
+
+    def execute(self, raise_on_error=True):
+        commands, self.commands = self.commands, []
+        watched = self.watched
+        self.reset()
+        if watched and any(self.connection.data.get(name) != value
+                           for name, value in watched.items()):
+            raise WatchError("Watched variable changed.")
+        results = []
+        for name, args, kwargs in commands:
+            try:
+                results.append(getattr(self.connection, name)(*args,
+                                                             **kwargs))
+            except ResponseError as e:
+                if raise_on_error:
+                    raise
+                results.append(e)
+        return results
+
+
+class MockLock(object):
+    """
+    A mock version of a redis Lock, held by setting its key on the node.
+    """
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+
+    def acquire(self, blocking=None):
+        return bool(self.connection.set(self.name, "locked", nx=True))
+
+    def release(self):
+        del self.connection.data[self.name]
+
+
+class Awaitable(object):
+    """
+    The result of a mock asyncio command: awaiting it returns ``value``, or
+    raises ``error``.
+    """
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.error is not None:
+            raise self.error
+        raise StopIteration(self.value)
+    next = __next__
+
+
+class MockServer(MockStrictRedis):
+    """
+    The MockStrictRedis behind a MockAsyncRedis, answering TTL as Redis does.
+    """
+    def ttl(self, key):
+        if self.fail:
+            raise ConnectionError("FAIL!")
+        if key not in self.data:
+            return -2
+        ttl = self.ttls.get(key)
+        return -1 if ttl is None else ttl
+
+
+class MockAsyncPipeline(MockPipeline):
+    """
+    A mock version of a redis asyncio pipeline.
+    """
+    def execute(self, raise_on_error=True):
+        try:
+            return Awaitable(super(MockAsyncPipeline, self).execute(
+                raise_on_error))
+        except Exception as e:
+            return Awaitable(error=e)
+
+
+class MockAsyncRedis(object):
+    """
+    A mock version of a redis asyncio connection, for both normal Redis and
+    Sentinel servers. Its commands are run by ``server``, a MockServer.
+    """
+    def __init__(self, host, port, **kwargs):
+        self.server = MockServer(host, port, **kwargs)
+
+    def __getattr__(self, name):
+        method = getattr(self.server, name)
+
+        def command(*args, **kwargs):
+            try:
+                return Awaitable(method(*args, **kwargs))
+            except Exception as e:
+                return Awaitable(error=e)
+        return command
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return MockAsyncPipeline(self.server)
+
+    def aclose(self):
+        return Awaitable()
+
+
 class TestDisredisClient(TestCase):
     """
     Unit tests for the DisredisClient class. These tests use two mock sentinels
@@ -96,6 +547,30 @@ class TestDisredisClient(TestCase):
         self.assertEqual(self.client.nodes[0].connection.data, {})
         self.assertEqual(self.client.nodes[1].connection.data, {"test":"foo"})
 
+    def test_master_lookups_limited(self):
+        """
+        Commands to a dead master only ask the Sentinel for its new master
+        once a second, and not at all if a health checker is doing it.
+        """
+        lookups = []
+        execute = self.client._execute_sentinel_command
+
+        def count(*args, **kwargs):
+            lookups.append(args)
+            return execute(*args, **kwargs)
+        self.client._execute_sentinel_command = count
+        self.client.nodes[1].connection.fail = True
+        for i in range(5):
+            self.assertRaises(ConnectionError, self.client.get, "1")
+        self.assertEqual(lookups, [("get-master-addr-by-name", "node2")])
+
+        self.client._master_lookups.clear()
+        self.client.health_checker = HealthChecker(self.client)
+        self.client.nodes[1].is_down = True
+        for i in range(5):
+            self.assertRaises(ConnectionError, self.client.get, "1")
+        self.assertEqual(len(lookups), 1)
+
     def test_set_with_specified_key(self):
         """
         Enclosing a part of the key in {} will cause it to be used as the
@@ -116,6 +591,642 @@ class TestDisredisClient(TestCase):
         self.assertEqual(self.client.nodes[1].connection.data, {"test{1}":"foo",
             "other{1}":"bar"})
 
+    def test_get_with_ttl(self):
+        """
+        The value and its ttl are read together.
+        """
+        self.client.set("test", "foo", ex=10)
+        self.assertEqual(self.client.get_with_ttl("test"), ("foo", 10))
+        self.assertEqual(self.client.get_with_ttl("other"), (None, None))
+
+    def test_get_with_ttl_failover(self):
+        """
+        If the pipeline gives a ConnectionError, switch to the backup.
+        """
+        self.client.nodes[1].connection.fail = True
+        self.client.sentinel.masters[1] = ["name", "node2", "ip", "1.2.3.4",
+            "port", "11"]
+        self.assertEqual(self.client.get_with_ttl("test"), (None, None))
+        self.assertEqual(self.client.nodes[1].port, "11")
+
+    def test_get_shared_client(self):
+        """
+        The same client is returned to every caller in a process, and a new
+        one is created after a fork.
+        """
+        try:
+            shared = get_shared_client(["127.0.0.1:6383"])
+            self.assertTrue(get_shared_client(["127.0.0.1:6383"]) is shared)
+            self.assertFalse(get_shared_client(["127.0.0.1:6384"]) is shared)
+            shared.pid = -1  # as if it had been created by a parent process
+            self.assertFalse(get_shared_client(["127.0.0.1:6383"]) is shared)
+        finally:
+            client_module._shared_clients.clear()
+            del client_module._inherited_clients[:]
+
+    def test_mget_mset(self):
+        """
+        Multi-key commands are split up by node.
+        """
+        self.client.mset({"1": "a", "2": "b", "3": "c"})
+        self.assertEqual(self.client.nodes[0].connection.data, {"2": "b"})
+        self.assertEqual(self.client.nodes[1].connection.data,
+            {"1": "a", "3": "c"})
+        self.assertEqual(self.client.mget(["3", "2", "4", "1"]),
+            ["c", "b", None, "a"])
+        self.assertEqual(self.client.mget("2", "1"), ["b", "a"])
+
+    def test_delete(self):
+        """
+        Deleting keys on several nodes returns the total number deleted.
+        """
+        self.client.mset({"1": "a", "2": "b", "3": "c"})
+        self.assertEqual(self.client.delete("1", "2", "4"), 2)
+        self.assertEqual(self.client.nodes[0].connection.data, {})
+        self.assertEqual(self.client.nodes[1].connection.data, {"3": "c"})
+
+    def test_execute_batch(self):
+        """
+        Batched commands are pipelined per node and their results returned
+        in order.
+        """
+        results = self.client.execute_batch([
+            ("set", "1", ("a",), {"ex": 10}),
+            ("set", "2", ("b",), {}),
+            ("get", "1", (), {}),
+            ("get", "2", (), {}),
+        ])
+        self.assertEqual(results, [True, True, "a", "b"])
+        self.assertEqual(self.client.nodes[1].connection.ttls, {"1": 10})
+
+    def test_eval_cross_node(self):
+        """
+        Scripts can only touch keys on a single node.
+        """
+        self.assertRaises(DataError, self.client.eval, "return 1", 2,
+            "test{1}", "test{2}")
+
+    def test_execute_command(self):
+        """
+        Test that raw commands are routed, split and merged by their keys.
+        """
+        nodes = self.client.nodes
+        self.assertTrue(self.client.execute_command("MSET", "1", "a", "2", "b"))
+        self.assertEqual(nodes[1].connection.data, {"1": "a"})
+        self.assertEqual(nodes[0].connection.data, {"2": "b"})
+        self.assertEqual(self.client.execute_command("MGET", "1", "2", "3"),
+                         ["a", "b", None])
+        self.assertEqual(self.client.execute_command("GET", "2"), "b")
+        self.assertRaises(DataError, self.client.execute_command,
+                          "RENAME", "1", "2")
+        # Commands missing from the key-spec table aren't guessed at, and
+        # connection state can't be kept on pooled connections.
+        self.assertRaises(DataError, self.client.execute_command,
+                          "NEWCOMMAND", "1")
+        for command in ("SELECT", "select", "AUTH", "MULTI"):
+            self.assertRaises(DataError, self.client.execute_command,
+                              command, "1")
+        self.assertEqual(self.client.execute_command("DEL", "1", "2", "3"), 2)
+        results = self.client.execute_command("FLUSHDB")
+        self.assertTrue(isinstance(results, NodeResults))
+        self.assertEqual(results, {"node1": True, "node2": True})
+        self.assertTrue(results.aggregate)
+
+    def test_health_checker(self):
+        """
+        Test that the health checker tracks latency and marks failed nodes.
+        """
+        checker = HealthChecker(self.client)
+        checker.check()
+        node = self.client.nodes[0]
+        self.assertFalse(node.is_down)
+        self.assertTrue(node.latency is not None)
+        self.assertTrue("127.0.0.1:6383" in checker.sentinel_latency)
+
+        # Masters are PINGed over a connection with the checker's timeouts.
+        probe = checker._node_probes["node1"][1]
+        self.assertEqual(probe.kwargs, {"socket_timeout": 1.0,
+                                        "socket_connect_timeout": 1.0})
+        self.assertEqual(node.connection.connection_pool.created, [])
+
+        node.connection.fail = True
+        checker.check()
+        self.assertTrue(node.is_down)
+        self.assertFalse(self.client.nodes[1].is_down)
+        self.assertFalse(probe.connected)
+        node.connection.fail = False
+        node.connection.stall = 0.1
+        checker.timeout = 0.01
+        checker.check()
+        self.assertTrue(node.is_down)
+        self.assertEqual(probe.pending, [])
+        node.connection.stall = 0
+        checker.check()
+        self.assertFalse(node.is_down)
+
+        # Commands for a down node go to the master the checker found.
+        self.client.set("2", "foo")
+        node.connection.fail = True
+        self.client.sentinel.masters[0] = ["name", "node1", "ip", "1.2.3.4",
+                                           "port", "11"]
+        checker.check()
+        self.assertEqual(self.client.nodes[0].port, "11")
+        checker.check()
+        self.assertTrue(checker._node_probes["node1"][1] is not probe)
+        self.assertFalse(probe.connected)
+        self.client.set("2", "bar")
+        self.assertEqual(node.connection.data, {"2": "foo"})
+        self.assertEqual(self.client.get("2"), "bar")
+
+        self.client.sentinel_addresses.remove("127.0.0.1:6384")
+        checker.check()
+        self.assertEqual(list(checker._probes), ["127.0.0.1:6383"])
+        checker.stop()
+
+    def test_warm_up(self):
+        """
+        Test that warming up opens new pooled connections to every node.
+        """
+        self.client.warm_up(3, timeout=5)
+        for node in self.client.nodes:
+            pool = node.connection.connection_pool
+            self.assertEqual(len(pool.created), 3)
+            self.assertEqual(len(pool.available), 3)
+            self.assertTrue(all(c.connected for c in pool.created))
+            if redis.VERSION >= (5, 3):  # the command name is deprecated
+                self.assertEqual(pool.command_names, [None] * 3)
+
+    def test_topology_cache(self):
+        """
+        Test that a saved topology is used at startup and then revalidated.
+        """
+        path = os.path.join(tempfile.mkdtemp(), "topology.json")
+        client = DisredisClient(["127.0.0.1:6383"], topology_cache=path)
+        self.assertEqual(load_topology(path),
+                         [("node1", "1.2.3.4", "1"), ("node2", "1.2.3.4", "2")])
+
+        save_topology(path, [Node("node1", "5.6.7.8", "1"),
+                             Node("node2", "5.6.7.8", "2")])
+        DisredisClient.redis_client_class = SlowSentinel
+        client = DisredisClient(["127.0.0.1:6383"], topology_cache=path)
+        self.assertEqual([node.host for node in client.nodes],
+                         ["5.6.7.8", "5.6.7.8"])
+        slots = client._slots
+        with client._nodes_lock:
+            SlowSentinel.answer.set()
+            time.sleep(0.05)
+            self.assertEqual([node.host for node in client.nodes],
+                             ["5.6.7.8", "5.6.7.8"])
+            self.assertTrue(client._slots is slots)
+        client._revalidation.join(5)
+        self.assertEqual([node.host for node in client.nodes],
+                         ["1.2.3.4", "1.2.3.4"])
+        self.assertEqual(load_topology(path)[0], ("node1", "1.2.3.4", "1"))
+
+    def test_weights(self):
+        """
+        Test that masters own a share of the keys in proportion to their
+        weight.
+        """
+        client = DisredisClient(["127.0.0.1:6383"], weights={"node2": 3})
+        counts = {"node1": 0, "node2": 0}
+        for i in range(1000):
+            counts[client.get_node_for_key(str(i)).name] += 1
+        self.assertTrue(200 < counts["node1"] < 300)
+
+        # Without weights, keys are sharded as they always have been.
+        client = DisredisClient(["127.0.0.1:6383"], weights={})
+        self.assertEqual(client.get_node_for_key("2").name, "node1")
+        self.assertEqual(client.get_node_for_key("3").name, "node2")
+
+    def test_distribution_report(self):
+        """
+        Test the report of expected and actual key and memory distribution.
+        """
+        client = DisredisClient(["127.0.0.1:6383"], weights={"node1": 3})
+        client.nodes[0].connection.data = {"a": "a", "b": "b", "c": "c"}
+        client.nodes[1].connection.data = {"d": "d"}
+        report = distribution_report(client)
+        self.assertEqual([row["expected"] for row in report], [0.75, 0.25])
+        self.assertEqual([row["keys"] for row in report], [3, 1])
+        self.assertEqual([row["memory_share"] for row in report],
+                         [0.75, 0.25])
+
+    def test_space_saving(self):
+        """
+        Test that the space-saving sketch keeps the most frequent items.
+        """
+        sketch = SpaceSaving(3)
+        for item in "aaaaabbbbbbcd":
+            sketch.add(item)
+        self.assertEqual([item for item, count, error in sketch.top(2)],
+                         ["b", "a"])
+        self.assertEqual(len(sketch.counts), 3)
+        self.assertEqual(sketch.top()[-1], ("d", 2, 1))
+
+    def test_profiler(self):
+        """
+        Test that the profiler counts requests and bytes by node and hashtag.
+        """
+        self.client.profiler = KeyProfiler(sample_rate=1)
+        self.client.set("user{1}:name", "abc")
+        self.client.get("user{1}:name")
+        self.client.get("2")
+        report = self.client.profiler.report()
+        self.assertEqual(report["node_requests"], {"node1": 1, "node2": 2})
+        self.assertEqual(report["top_requests"][0], (b"1", 2, 0))
+        self.assertEqual(report["top_bytes"][0], (b"1", 30, 0))
+
+    def test_keyspace_report(self):
+        """
+        Test that the keyspace analyzer finds the biggest hashtags.
+        """
+        self.client.nodes[0].connection.data = {"{a}1": "x", "{a}2": "x",
+                                                "{b}": "xxxxxxxx"}
+        self.client.nodes[1].connection.data = {"c": "x"}
+        report = keyspace_report(self.client, sample_every=1)
+        self.assertEqual(report["nodes"]["node1"]["keys"], 3)
+        self.assertEqual(report["nodes"]["node1"]["estimated_bytes"], 100)
+        self.assertEqual(report["top_keys"][0], (b"a", 2, 0))
+        self.assertEqual(report["top_bytes"][0], (b"b", 80, 0))
+        self.assertEqual(report["key_skew"], 1.5)
+
+    def test_pipeline(self):
+        """
+        Test that a pipeline that isn't a transaction can span nodes.
+        """
+        pipe = self.client.pipeline(transaction=False)
+        pipe.set("1", "a").set("2", "b").get("1").get("2")
+        self.assertEqual(pipe.execute(), [True, True, "a", "b"])
+        self.assertEqual(len(pipe), 0)
+
+    def test_transaction(self):
+        """
+        Test that transactions run on the node shared by all of their keys
+        and are retried when a watched key changes.
+        """
+        pipe = self.client.pipeline()
+        pipe.set("a{1}", "a").set("b{1}", "b")
+        self.assertEqual(pipe.execute(), [True, True])
+        self.assertEqual(self.client.nodes[1].connection.data,
+                         {"a{1}": "a", "b{1}": "b"})
+        pipe.set("a{1}", "a").set("b{2}", "b")
+        self.assertRaises(DataError, pipe.execute)
+
+        calls = []
+
+        def append(pipe):
+            calls.append(1)
+            value = pipe.get("a{1}")
+            if len(calls) == 1:
+                self.client.set("a{1}", "changed")
+            pipe.multi()
+            pipe.set("b{1}", value + "!")
+        self.assertEqual(self.client.transaction(append, "a{1}"), [True])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.client.get("b{1}"), "changed!")
+        self.assertRaises(DataError, self.client.transaction, append,
+                          "a{1}", "b{2}")
+
+    def test_transaction_failover(self):
+        """
+        Test that a transaction whose connection is lost is retried on the
+        node's new master, but fails if the master hasn't changed.
+        """
+        self.client.set("a{1}", "a")
+        calls = []
+
+        def append(pipe):
+            calls.append(1)
+            value = pipe.get("a{1}")
+            if len(calls) == 1:
+                pipe._pipe.connection.fail = True
+            pipe.multi()
+            pipe.set("b{1}", value + "!")
+        self.assertRaises(ConnectionError, self.client.transaction, append,
+                          "a{1}")
+        self.assertEqual(len(calls), 1)
+
+        node = self.client.nodes[1]
+        self.client.sentinel.masters[1] = ["name", "node2", "ip", "1.2.3.4",
+                                           "port", "11"]
+        self.client.nodes[1].connection.fail = False
+        self.client._master_lookups.clear()
+        del calls[:]
+
+        def failover(pipe):
+            calls.append(1)
+            if len(calls) == 1:
+                pipe._pipe.connection.fail = True
+                pipe.get("a{1}")
+            pipe.multi()
+            pipe.set("b{1}", "failed over")
+        self.assertEqual(self.client.transaction(failover, "a{1}"), [True])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.client.nodes[1].port, "11")
+        self.assertEqual(self.client.nodes[1].connection.data,
+                         {"b{1}": "failed over"})
+        self.assertEqual(node.connection.data, {"a{1}": "a"})
+
+    def test_redlock(self):
+        """
+        Test that a redlock is held on a majority of the nodes.
+        """
+        self.client.nodes.append(Node("node3", "1.2.3.4", "3"))
+        lock = self.client.redlock("lock", timeout=10)
+        other = self.client.redlock("lock", timeout=10)
+        self.assertTrue(lock.acquire())
+        self.assertFalse(other.acquire(blocking=False))
+        self.assertTrue(lock.extend())
+        lock.release()
+        self.assertRaises(LockError, lock.release)
+
+        # One node already held by someone else still leaves a majority.
+        self.client.nodes[0].connection.data["lock"] = "someone"
+        self.assertTrue(other.acquire(blocking=False))
+        other.release()
+        # Two don't, and the partial lock is cleaned up.
+        self.client.nodes[1].connection.data["lock"] = "someone"
+        self.assertFalse(other.acquire(blocking=True, blocking_timeout=0.05))
+        self.assertFalse("lock" in self.client.nodes[2].connection.data)
+        stats = self.client.redlock_metrics.stats()
+        self.assertEqual(stats["acquired"], 2)
+        self.assertTrue(stats["failed"] >= 2)
+
+    def test_sharded_counter(self):
+        """
+        Test that a sharded counter is spread over the nodes and summed.
+        """
+        counter = self.client.sharded_counter("views")
+        self.assertEqual(
+            set(self.client.get_node_for_key(key).name
+                for key in counter.keys),
+            set(["node1", "node2"]))
+        for i in range(20):
+            counter.incr()
+        counter.decr(5)
+        self.assertEqual(counter.value(), 15)
+        self.assertEqual(len(self.client.sharded_counter("views", 4).keys), 4)
+
+        cached = self.client.sharded_counter("views", cache_ttl=60)
+        self.assertEqual(cached.value(), 15)
+        counter.incr()
+        self.assertEqual(cached.value(), 15)
+        self.assertEqual(counter.value(), 16)
+        counter.delete()
+        self.assertEqual(counter.value(), 0)
+
+    def test_partitioned_hash(self):
+        """
+        Test that a partitioned hash spreads its fields over the nodes.
+        """
+        users = self.client.partitioned_hash("users", buckets=4)
+        self.assertEqual(
+            set(self.client.get_node_for_key(key).name for key in users.keys),
+            set(["node1", "node2"]))
+        for i in range(10):
+            users.hset("user%d" % i, i)
+        self.assertTrue(all(self.client.nodes[index].connection.data
+                            for index in (0, 1)))
+        self.assertEqual(users.hget("user3"), 3)
+        users.hmset({"user10": 10, "user11": 11})
+        self.assertEqual(users.hmget(["user1", "user11", "missing"]),
+                         [1, 11, None])
+        self.assertEqual(users.hlen(), 12)
+        self.assertEqual(users.hdel("user10", "user11", "missing"), 2)
+        self.assertEqual(sorted(users.hscan_iter()),
+                         [("user%d" % i, i) for i in range(10)])
+        self.assertEqual(users.hgetall(),
+                         dict(("user%d" % i, i) for i in range(10)))
+        users.delete()
+        self.assertEqual(users.hlen(), 0)
+
+    def test_partitioned_sorted_set(self):
+        """
+        Test that a partitioned sorted set merges the ranges of its shards.
+        """
+        board = self.client.partitioned_sorted_set("board")
+        self.assertEqual(
+            set(self.client.get_node_for_key(key).name for key in board.keys),
+            set(["node1", "node2"]))
+        scores = []
+        for i in range(10):
+            scores.extend([i * 10, "player%d" % i])
+        self.assertEqual(board.zadd(*scores[:10]), 5)
+        self.assertEqual(board.zadd(dict(zip(scores[11::2], scores[10::2]))),
+                         5)
+        self.assertEqual(board.zadd(player9=90), 0)
+        self.assertTrue(all(self.client.nodes[index].connection.data
+                            for index in (0, 1)))
+        self.assertEqual(board.zincrby("player0", 95), 95)
+        self.assertEqual(board.zcard(), 10)
+        self.assertEqual(board.zrevrange(0, 2),
+                         ["player0", "player9", "player8"])
+        self.assertEqual(board.zrevrange(1, 2, withscores=True),
+                         [("player9", 90.0), ("player8", 80.0)])
+        self.assertEqual(board.zrange(0, 1), ["player1", "player2"])
+        self.assertEqual(board.zrange(-2, -1), ["player9", "player0"])
+        self.assertEqual(board.zrevrange(0, -1)[-1], "player1")
+        self.assertEqual(board.zrevrank("player0"), 0)
+        self.assertEqual(board.zrevrank("player7"), 3)
+        self.assertEqual(board.zrank("player7"), 6)
+        self.assertEqual(board.zrank("missing"), None)
+        self.assertEqual(board.zrem("player0", "missing"), 1)
+        self.assertEqual(board.zcount(50, "+inf"), 5)
+        board.delete()
+        self.assertEqual(board.zcard(), 0)
+
+    def test_bulk_load(self):
+        """
+        Test that a bulk load writes every key to its node, even when one of
+        the nodes fails over during the load.
+        """
+        failed = self.client.nodes[1]
+        failed.connection.fail = True
+        self.client.sentinel.masters[1] = ["name", "node2", "ip", "1.2.3.4",
+            "port", "11"]
+        records = read_records(["%d\t%d\n" % (i, i) for i in range(25)])
+        stats = bulk_load(self.client, records, batch_size=4, queue_size=1)
+        self.assertEqual(stats["loaded"], 25)
+        self.assertEqual(stats["failed"], 0)
+        self.assertNotEqual(failed, self.client.nodes[1])
+        for i in range(25):
+            node = self.client.get_node_for_key(str(i))
+            self.assertEqual(node.connection.data[str(i)], str(i))
+        self.assertEqual(sum(stats["nodes"].values()), 25)
+
+    def test_snapshot(self):
+        """
+        Test that a snapshot is imported onto the owners of its keys under
+        the importing client's weights.
+        """
+        for i in range(11):
+            self.client.set(str(i), "value%d" % i, ex=60 if i % 2 else None)
+        # Key 10 expires between its DUMP and its PTTL.
+        connection = self.client.get_node_for_key("10").connection
+        pttl = connection.pttl
+        connection.pttl = lambda key: -2 if key == "10" else pttl(key)
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "snapshot")
+        try:
+            stats = export_snapshot(self.client, path, batch_size=3)
+            self.assertEqual(stats["keys"], 10)
+            self.assertEqual(sum(stats["nodes"].values()), 10)
+            self.assertEqual(os.listdir(directory), ["snapshot"])
+
+            other = DisredisClient(["127.0.0.1:6383"],
+                                   weights={"node1": 0})
+            stats = import_snapshot(other, path, batch_size=4)
+            self.assertEqual(stats["nodes"], {"node2": 10})
+            # Keys are read back as bytes, as Redis returns them.
+            data = other.nodes[1].connection.data
+            self.assertEqual(data, dict((str(i).encode("utf-8"),
+                                         "value%d" % i) for i in range(10)))
+            self.assertEqual(other.nodes[1].connection.ttls[b"3"], 60)
+            self.assertEqual(other.nodes[1].connection.ttls[b"4"], None)
+            self.assertRaises(ResponseError, import_snapshot, other, path,
+                              replace=False)
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
+            os.rmdir(directory)
+
+    def test_hedged_reads(self):
+        """
+        Test that a read a master is slow to answer is answered by its
+        replica, within the hedging budget.
+        """
+        hedged = HedgedReads(budget=0.25, min_samples=5)
+        client = DisredisClient(["127.0.0.1:6383"], hedged_reads=hedged)
+        client.set("1", "master")
+        for i in range(5):
+            self.assertEqual(client.get("1"), "master")
+        self.assertTrue(hedged.delay("node2") >= hedged.min_delay)
+
+        # The replica is looked up in the background.
+        node = client.nodes[1]
+        self.assertEqual(hedged._replica(client, node), None)
+        for i in range(100):
+            replica = hedged._replica(client, node)
+            if replica is not None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(replica.port, "102")
+        self.assertEqual(hedged.workers._threads, 1)
+        replica.connection.data["1"] = "replica"
+        node.connection.stall = 0.2
+        start = time.time()
+        self.assertEqual(client.get("1"), "replica")
+        self.assertTrue(time.time() - start < 0.2)
+        self.assertEqual(client.get("1"), "replica")
+        # A third hedge in eight reads would be over the budget.
+        self.assertEqual(client.get("1"), "master")
+        stats = hedged.stats()
+        self.assertEqual((stats["reads"], stats["hedged"],
+                          stats["replica_wins"]), (8, 2, 2))
+        # Writes are never hedged.
+        self.assertEqual(client.set("2", "value"), True)
+        # Reads are sent without a hedge when no worker is free.
+        hedged.workers = Workers(0)
+        self.assertEqual(client.get("1"), "master")
+        self.assertEqual(hedged.stats()["hedged"], 2)
+
+    def test_hooks(self):
+        """
+        Test that hooks are called around commands, and that the slowlog
+        keeps the slow ones.
+        """
+        class Recorder(object):
+            def __init__(self):
+                self.calls = []
+
+            def before(self, trace):
+                self.calls.append(("before", trace.command, trace.key))
+
+            def after(self, trace):
+                self.calls.append(("after", trace.command, trace.key,
+                                   trace.node.name, trace.error is None))
+        recorder = Recorder()
+        slowlog = SlowLog(threshold=0.05, capacity=2, key_length=4)
+        self.client.add_hook(recorder)
+        self.client.add_hook(slowlog)
+        self.client.set("1", "foo")
+        self.assertEqual(recorder.calls, [("before", "set", "1"),
+                                          ("after", "set", "1", "node2",
+                                           True)])
+        self.client.mget(["1", "2"])
+        self.assertEqual(sorted(call[:3] for call in recorder.calls[2:]),
+                         [("after", "mget", None), ("after", "mget", None),
+                          ("before", "mget", None), ("before", "mget", None)])
+        self.assertEqual(len(slowlog), 0)
+
+        self.client.nodes[1].connection.stall = 0.05
+        self.client.get("{1}abcdef")
+        self.client.nodes[1].connection.stall = 0
+        self.client.get("3")
+        entries = slowlog.entries()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual((entries[0]["command"], entries[0]["key"],
+                          entries[0]["node"], entries[0]["retried"]),
+                         ("get", "{1}a", "node2", False))
+
+        slowlog.threshold = 0
+        self.client.nodes[1].connection.fail = True
+        self.client.sentinel.masters[1] = ["name", "node2", "ip", "1.2.3.4",
+            "port", "11"]
+        self.client.get("1")
+        entry = slowlog.entries()[0]
+        self.assertEqual((entry["key"], entry["retried"], entry["failover"],
+                          entry["error"]), ("1", True, True, None))
+        self.client.set("3", "bar")
+        self.assertEqual(len(slowlog), 2)
+        self.assertEqual(slowlog.entries()[0]["key"], "3")
+        self.client.remove_hook(recorder)
+        count = len(recorder.calls)
+        self.client.get("1")
+        self.assertEqual(len(recorder.calls), count)
+
+    def test_write_buffer(self):
+        """
+        Test that buffered writes are merged and flushed per node.
+        """
+        buffer = self.client.write_buffer(max_items=6, flush_interval=None)
+        for i in range(10):
+            buffer.incr("1")
+            buffer.hincrby("2", "field", 2)
+        buffer.sadd("3", "a", "b")
+        buffer.sadd("3", "b", "c")
+        self.assertEqual(len(buffer), 5)
+        self.assertEqual(self.client.nodes[1].connection.data, {})
+        buffer.zincrby("2", "member", 5)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(self.client.nodes[1].connection.data,
+                         {"1": 10, "3": set(["a", "b", "c"])})
+        self.assertEqual(self.client.nodes[0].connection.data,
+                         {"2": {"field": 20, "member": 5}})
+        buffer.incr("1", 5)
+        buffer.close()
+        self.assertEqual(self.client.nodes[1].connection.data["1"], 15)
+        self.assertEqual(buffer.stats()["sent"], 5)
+
+        # Only the writes that Redis refuses are dropped.
+        buffer.incr("1")
+        buffer.incr("3")
+        buffer.flush()
+        self.assertEqual(self.client.nodes[1].connection.data["1"], 16)
+        stats = buffer.stats()
+        self.assertEqual((stats["sent"], stats["dropped"]), (6, 1))
+
+        # The client keeps its buffer, and neither the exit hook nor the
+        # flushing thread keeps other buffers alive.
+        same = self.client.write_buffer(max_items=6, flush_interval=None)
+        self.assertTrue(same is buffer)
+        other = WriteBuffer(self.client, flush_interval=60)
+        ref = weakref.ref(other)
+        del other
+        gc.collect()
+        self.assertTrue(ref() is None)
+
     def test_get_master(self):
         """
         Returning the master of a node that isn't failed should return the
@@ -183,7 +1294,286 @@ class TestDisredisClient(TestCase):
 
     def test_unavailable_api(self):
         """
-        Api calls that aren't tied to a single key aren't available.
+        Some api calls that aren't tied to a single key aren't available.
+        """
+        self.assertRaises(NotImplementedError, self.client.bgsave)
+
+    def test_fan_out(self):
+        """
+        Test that server commands are run on every node and aggregated.
+        """
+        for key in ["1", "2", "3"]:
+            self.client.set(key, key)
+        dbsize = self.client.dbsize()
+        self.assertEqual(dbsize, {"node1": 1, "node2": 2})
+        self.assertEqual(dbsize.aggregate, 3)
+        info = self.client.info()
+        self.assertEqual(info["node2"]["db0"], {"keys": 2})
+        self.assertEqual(info.aggregate, {"used_memory": 300,
+                                          "redis_version": "2.8.4",
+                                          "db0": {"keys": 3}})
+        self.assertTrue(self.client.ping().aggregate)
+        self.assertTrue(self.client.flushdb().aggregate)
+        self.assertEqual(self.client.dbsize().aggregate, 0)
+
+    def test_merge_info(self):
+        """
+        Test that only counters, rates, memory and keyspace fields of INFO
+        are added up across nodes.
+        """
+        first = {"keyspace_hits": 5, "total_commands_processed": 10,
+                 "used_memory": 100, "used_memory_human": "100B",
+                 "instantaneous_ops_per_sec": 7, "uptime_in_seconds": 50,
+                 "mem_fragmentation_ratio": 1.5, "process_id": 12,
+                 "hz": 10, "loading": 0, "role": "master",
+                 "db0": {"keys": 2, "expires": 1, "avg_ttl": 30},
+                 "cmdstat_get": {"calls": 4, "usec_per_call": 2.0}}
+        second = {"keyspace_hits": 1, "total_commands_processed": 2,
+                  "used_memory": 50, "used_memory_human": "50B",
+                  "instantaneous_ops_per_sec": 3, "uptime_in_seconds": 20,
+                  "mem_fragmentation_ratio": 1.1, "process_id": 13,
+                  "hz": 10, "loading": 0, "role": "master",
+                  "db0": {"keys": 3, "expires": 0, "avg_ttl": 10},
+                  "db1": {"keys": 1, "expires": 0, "avg_ttl": 0},
+                  "cmdstat_get": {"calls": 1, "usec_per_call": 2.0}}
+        self.assertEqual(merge_info([first, second]), {
+            "keyspace_hits": 6, "total_commands_processed": 12,
+            "used_memory": 150, "instantaneous_ops_per_sec": 10,
+            "uptime_in_seconds": 20, "mem_fragmentation_ratio": 1.5,
+            "hz": 10, "loading": 0, "role": "master",
+            "db0": {"keys": 5, "expires": 1},
+            "db1": {"keys": 1, "expires": 0, "avg_ttl": 0},
+            "cmdstat_get": {"calls": 5, "usec_per_call": 2.0}})
+
+
+    def test_coalesce_reads(self):
+        """
+        Concurrent identical reads share a single call to the node.
+        """
+        client = DisredisClient(["127.0.0.1:6383"], coalesce_reads=True)
+        client.set("test", "foo")
+        connection = client.get_node_for_key("test").connection
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_get(key):
+            calls.append(key)
+            started.set()
+            release.wait()
+            return connection.data.get(key)
+        connection.get = slow_get
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            client.get("test"))) for i in range(5)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, ["test"])
+        self.assertEqual(results, ["foo"] * 5)
+
+    def test_coalesce_copies(self):
+        """
+        Callers sharing a read each get their own copy of a mutable result.
+        """
+        client = DisredisClient(["127.0.0.1:6383"], coalesce_reads=True)
+        client.hset("test", "field", "foo")
+        connection = client.get_node_for_key("test").connection
+        started = threading.Event()
+        release = threading.Event()
+        hgetall = connection.hgetall
+
+        def slow_hgetall(name):
+            started.set()
+            release.wait()
+            return hgetall(name)
+        connection.hgetall = slow_hgetall
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            client.hgetall("test"))) for i in range(2)]
+        threads[0].start()
+        started.wait()
+        threads[1].start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [{"field": "foo"}] * 2)
+        self.assertTrue(results[0] is not results[1])
+
+    def test_coalesce_after_fork(self):
+        """
+        Calls in flight when the process forks aren't waited for in the child.
+        """
+        flight = coalesce.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+
+        def stuck():
+            started.set()
+            release.wait()
+        thread = threading.Thread(target=flight.do, args=("key", stuck))
+        thread.start()
+        started.wait()
+        coalesce._after_fork()  # as run in the child by os.fork()
+        self.assertEqual(flight.do("key", lambda: "foo"), "foo")
+        release.set()
+        thread.join()
+
+    def test_get_or_compute(self):
+        """
+        A missing value is computed once, stored, and then read back.
+        """
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return "bar"
+        self.assertEqual(self.client.get_or_compute("test", compute), "bar")
+        self.assertEqual(self.client.get_or_compute("test", compute), "bar")
+        self.assertEqual(calls, [1])
+        self.assertEqual(self.client.nodes[1].connection.data, {"test": "bar"})
+
+    def test_get_or_compute_locked(self):
+        """
+        While another client holds the lock, wait for its value instead of
+        computing it again.
+        """
+        self.client.nodes[0].connection.data["test:lock"] = "locked"
+        self.client.nodes[1].connection.data["test:lock"] = "locked"
+
+        def store():
+            time.sleep(0.05)
+            self.client.set("test", "theirs")
+        thread = threading.Thread(target=store)
+        thread.start()
+        value = self.client.get_or_compute("test", lambda: "ours",
+            lock_timeout=5, sleep=0.01)
+        thread.join()
+        self.assertEqual(value, "theirs")
+
+        # If their value never appears, ours is computed and stored.
+        self.client.nodes[0].connection.data["test:2:lock"] = "locked"
+        self.client.nodes[1].connection.data["test:2:lock"] = "locked"
+        self.assertEqual(self.client.get_or_compute("test:2", lambda: "ours",
+            lock_timeout=0.05, sleep=0.01), "ours")
+        self.assertEqual(self.client.get("test:2"), "ours")
+
+    def test_codec(self):
+        """
+        Large values are compressed on the way in and decompressed on the
+        way out, while small and legacy values are left alone.
+        """
+        codec = ZlibCodec(min_length=100)
+        client = DisredisClient(["127.0.0.1:6383"], codec=codec)
+        client.set("1", b"a" * 1000)
+        client.set("3", b"b")
+        client.hset("2", "field", b"c" * 1000)
+        client.nodes[1].connection.data["legacy"] = b"d"
+        stored = client.nodes[1].connection.data["1"]
+        self.assertTrue(stored.startswith(ZlibCodec.HEADER))
+        self.assertTrue(len(stored) < 100)
+        self.assertEqual(client.nodes[1].connection.data["3"], b"b")
+        self.assertEqual(client.get("1"), b"a" * 1000)
+        self.assertEqual(client.hgetall("2"), {"field": b"c" * 1000})
+        self.assertEqual(client.mget(["1", "3", "legacy"]),
+            [b"a" * 1000, b"b", b"d"])
+        stats = codec.stats()
+        self.assertEqual(stats["values"], 3)
+        self.assertEqual(stats["compressed"], 2)
+        self.assertEqual(stats["raw_bytes"], 2001)
+        self.assertTrue(stats["ratio"] < 0.1)
+
+        # Legacy values are read back as they were stored.
+        for value in (b"\x00", b"\x00x\x9c", b"\x00\x00" * 10,
+                      b"\x00" + zlib.compress(b"e" * 1000),
+                      ZlibCodec.HEADER + b"not zlib"):
+            client.nodes[1].connection.data["legacy"] = value
+            self.assertEqual(client.get("legacy"), value)
+            client.set("3", value)
+            self.assertEqual(client.get("3"), value)
+        self.assertTrue(client.nodes[1].connection.data["3"].startswith(
+            ZlibCodec.HEADER))
+
+
+@skipIf(asyncio_client is None, "needs Python 3 and redis-py 4.2 or newer")
+class TestAsyncDisredisClient(TestCase):
+    """
+    Unit tests for the AsyncDisredisClient class, on two mock sentinels
+    monitoring two mock Redis nodes.
+    """
+    def setUp(self):
+        self.old_client = asyncio_client.AsyncDisredisClient.redis_client_class
+        asyncio_client.AsyncDisredisClient.redis_client_class = MockAsyncRedis
+        asyncio_client.AsyncNode.redis_client_class = MockAsyncRedis
+        self.loop = asyncio.new_event_loop()
+        self.client = asyncio_client.AsyncDisredisClient(
+            ["127.0.0.1:6383", "127.0.0.1:6384"])
+
+    def tearDown(self):
+        asyncio_client.AsyncDisredisClient.redis_client_class = self.old_client
+        asyncio_client.AsyncNode.redis_client_class = self.old_client
+        self.loop.close()
+
+    def wait(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+    def test_routing(self):
+        """
+        Keys are sent to the same nodes as with DisredisClient, and each node
+        is only sent its own keys.
+        """
+        self.assertEqual(self.client.nodes, None)
+        self.assertTrue(self.wait(self.client.set("1", "one", ex=10)))
+        self.assertTrue(self.wait(self.client.set("2", "two")))
+        self.assertEqual([node.name for node in self.client.nodes],
+                         ["node1", "node2"])
+        old_client = DisredisClient.redis_client_class
+        DisredisClient.redis_client_class = MockStrictRedis
+        Node.redis_client_class = MockStrictRedis
+        try:
+            client = DisredisClient(["127.0.0.1:6383"])
+        finally:
+            DisredisClient.redis_client_class = old_client
+            Node.redis_client_class = old_client
+        for key in ("1", "2", "3", "{1}test"):
+            self.assertEqual(self.client.get_node_for_key(key).name,
+                             client.get_node_for_key(key).name)
+        self.assertEqual(self.client.nodes[1].connection.server.data,
+                         {"1": "one"})
+        self.assertEqual(self.client.nodes[0].connection.server.data,
+                         {"2": "two"})
+        self.assertEqual(self.wait(self.client.get("1")), "one")
+        self.assertEqual(self.wait(self.client.get_with_ttl("1")),
+                         ("one", 10))
+        self.assertEqual(self.wait(self.client.get_with_ttl("2")),
+                         ("two", None))
+        self.assertEqual(self.wait(self.client.delete("1", "2", "3")), 2)
+        self.assertEqual(self.wait(self.client.get("1")), None)
+        self.wait(self.client.aclose())
+
+    def test_failover(self):
+        """
+        A command that fails is sent again to the node's new master, and
+        fails for real if Sentinel still reports the old one.
         """
-        self.assertRaises(NotImplementedError, self.client.time)
+        self.wait(self.client.set("1", "one"))
+        self.client.nodes[1].connection.server.fail = True
+        self.client.sentinel.server.masters[1] = [
+            "name", "node2", "ip", "1.2.3.4", "port", "11"]
+        self.assertTrue(self.wait(self.client.set("1", "two")))
+        self.assertEqual(self.client.nodes[1].port, "11")
+        self.assertEqual(self.client.nodes[1].connection.server.data,
+                         {"1": "two"})
 
+        self.client.nodes[1].connection.server.fail = True
+        self.assertRaises(ConnectionError, self.wait,
+                          self.client.get_with_ttl("1"))
+        self.assertEqual(self.client.nodes[1].port, "11")
@@ -0,0 +1,67 @@
+"""
+On-disk snapshots of the cluster topology.
+
+A DisredisClient created with ``topology_cache`` set to a file path saves
+the masters it finds there after every discovery and every change of
+master. A client started when the file exists uses the masters in it right
+away, and checks them against the Sentinels in the background, so workers
+start quickly, and can start at all while the Sentinels are unreachable.
+
+The file is JSON: the time it was saved and, in shard order, the name,
+host, port and last-seen time of each master.
+
+"""
+import json
+import logging
+import os
+import tempfile
+import time
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value
+
+
+def save_topology(path, nodes):
+    """
+    Write the names and addresses of ``nodes`` to ``path``. The snapshot is
+    written to a temporary file that is then renamed over ``path``, so
+    readers never see a partly written one.
+    """
+    now = time.time()
+    snapshot = {
+        "saved": now,
+        "masters": [{"name": _text(node.name), "host": _text(node.host),
+                     "port": _text(node.port), "seen": now}
+                    for node in nodes],
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=".disredis-topology",
+                                     dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(snapshot, f)
+        os.rename(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+
+def load_topology(path):
+    """
+    Returns the masters saved in ``path`` as a list of ``(name, host,
+    port)`` tuples in shard order, or None if there is no usable snapshot.
+    """
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+        return [(master["name"], master["host"], master["port"])
+                for master in snapshot["masters"]] or None
+    except (IOError, OSError):
+        return None
+    except (ValueError, KeyError, TypeError):
+        logger = logging.getLogger('custommade_logging')
+        logger.warning("Ignoring unreadable topology snapshot %s" % path)
+        return None
@@ -0,0 +1,99 @@
+"""
+Hooks around the commands the disredis client sends.
+
+A hook is an object with ``before(trace)`` and ``after(trace)`` methods,
+added to a client with DisredisClient.add_hook() or its ``hooks``
+argument. They are called around every command routed to a node: single
+commands, the per-node parts of execute_batch(), execute_command() and
+pipelines, and the commands run on every node. ``trace`` is a CommandTrace,
+on which a hook can keep attributes of its own, such as a tracing span,
+between the two calls. Hooks are called in the thread sending the command
+and shouldn't raise. Without any hooks, nothing is timed or recorded.
+
+SlowLog is a hook keeping the slowest recent commands, so that the calls
+causing them can be found.
+
+"""
+import threading
+import time
+from collections import deque
+
+
+class CommandTrace(object):
+    """
+    A command being sent to ``node``. ``command`` is its name and ``key``
+    the key it was routed on, when they are known; pipelines have the
+    command "pipeline" and commands run on every node have no key.
+
+    Once the command has finished, ``duration`` is how long it took in
+    seconds, and ``error`` is the exception it raised, if any. ``retried``
+    is set if it was sent again after a ConnectionError, and ``failover``
+    if that was to a new master, which is then ``node``.
+    """
+    def __init__(self, node, command, key):
+        self.node = node
+        self.command = command
+        self.key = key
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+        self.retried = False
+        self.failover = False
+
+
+class SlowLog(object):
+    """
+    A hook keeping the last ``capacity`` commands that took at least
+    ``threshold`` seconds, with their keys cut to ``key_length``
+    characters.
+    """
+    def __init__(self, threshold=0.01, capacity=128, key_length=64):
+        self.threshold = threshold
+        self.key_length = key_length
+        self._lock = threading.Lock()
+        self._entries = deque(maxlen=capacity)
+        self.total = 0
+
+    def before(self, trace):
+        pass
+
+    def after(self, trace):
+        if trace.duration < self.threshold:
+            return
+        key = trace.key
+        if key is not None:
+            if not isinstance(key, bytes):
+                key = "%s" % key
+            key = key[:self.key_length]
+        entry = {
+            "time": trace.start,
+            "node": trace.node.name,
+            "command": trace.command,
+            "key": key,
+            "duration": trace.duration,
+            "retried": trace.retried,
+            "failover": trace.failover,
+            "error": None if trace.error is None else repr(trace.error),
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self.total += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def entries(self):
+        """
+        Returns the logged commands, the most recent first, as dicts with
+        the ``time`` each started, the ``node`` name, the ``command``, the
+        ``key``, the ``duration`` in seconds, whether it was ``retried`` or
+        caused a ``failover``, and the ``error`` it raised.
+        """
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def reset(self):
+        "Forget the logged commands"
+        with self._lock:
+            self._entries.clear()
+            self.total = 0
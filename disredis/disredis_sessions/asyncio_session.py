@@ -0,0 +1,100 @@
+"""
+Redis session store with native async support, for Django 5.0 and newer.
+
+Set SESSION_ENGINE to 'disredis.disredis_sessions.asyncio_session' to use it.
+The async session methods (aload, asave, aexists, adelete, acreate) await an
+AsyncDisredisClient, so async views don't block a thread on session I/O. The
+sync methods behave exactly like the ones in disredis_sessions.session, and
+both store sessions under the same keys in the same format.
+
+"""
+from django.contrib.sessions.backends.base import CreateError
+from django.core.exceptions import ImproperlyConfigured
+from redis.exceptions import ConnectionError
+
+from disredis.disredis_client.asyncio_client import get_shared_client
+from disredis.disredis_sessions import session, settings
+from disredis.disredis_sessions.session import codec
+
+
+class SessionStore(session.SessionStore):
+    """
+    Implements Redis database session store, with async methods.
+    """
+    @property
+    def aserver(self):
+        """
+        The AsyncDisredisClient shared by all sessions on the running event
+        loop.
+        """
+        if settings.SESSION_REDIS_SENTINEL_URLS is None:
+            raise ImproperlyConfigured(
+                "SESSION_REDIS_SENTINEL_URLS must be set to use disredis "
+                "sessions.")
+        return get_shared_client(settings.SESSION_REDIS_SENTINEL_URLS,
+                                 weights=settings.SESSION_REDIS_WEIGHTS)
+
+    async def aload(self):
+        session_data = ttl = None
+        if self.session_key is not None:
+            try:
+                session_data, ttl = await self.aserver.get_with_ttl(
+                    self.get_real_stored_key(self.session_key)
+                )
+            except ConnectionError:
+                pass
+        return self._decode_stored(session_data, ttl)
+
+    async def aexists(self, session_key):
+        return bool(await self.aserver.exists(
+            self.get_real_stored_key(session_key)))
+
+    async def acreate(self):
+        while True:
+            self._session_key = await self._aget_new_session_key()
+
+            try:
+                await self.asave(must_create=True)
+            except CreateError:
+                continue
+
+            self.modified = True
+            return
+
+    async def asave(self, must_create=False):
+        if self.session_key is None:
+            return await self.acreate()
+
+        key = self.get_real_stored_key(
+            await self._aget_or_create_session_key())
+        session_dict = await self._aget_session(no_load=must_create)
+        expiry_age = await self.aget_expiry_age()
+        digest = self._digest(session_dict)
+
+        if not must_create and digest == self._stored_digest:
+            if self._needs_refresh(expiry_age):
+                await self.aserver.expire(key, expiry_age)
+                self._stored_ttl = expiry_age
+            return
+
+        data = codec.encode(self, session_dict)
+        stored = await self.aserver.set(key, data, ex=expiry_age,
+            nx=must_create)
+        if must_create and not stored:
+            raise CreateError
+        self._stored_digest = digest
+        self._stored_ttl = expiry_age
+
+    async def _aget_new_session_key(self):
+        # Like _get_new_session_key, skip the check for a free key.
+        return self._get_new_session_key()
+
+    async def adelete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        try:
+            await self.aserver.delete(self.get_real_stored_key(session_key))
+        except Exception:
+            pass
@@ -0,0 +1,147 @@
+"""
+Codecs that turn a session dictionary into the bytes stored in Redis, and
+those bytes back into a dictionary.
+
+A codec has an ``encode(session, session_dict)`` method returning bytes, a
+``decode(session, data)`` method returning the session dictionary, and a
+``serialize(session, session_dict)`` method returning the session as bytes
+before it is signed, which the backend hashes to tell whether a session
+has changed since it was loaded. Which
+codec the session backend uses is set with the SESSION_REDIS_CODEC setting,
+and SESSION_REDIS_CODEC_OPTIONS is passed to its constructor.
+
+"""
+import logging
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:  # Python 3
+    import pickle
+try:
+    string_types = basestring
+except NameError:  # Python 3
+    string_types = str
+try:
+    from importlib import import_module
+except ImportError:  # Backwards compatibility for Python 2.6
+    from django.utils.importlib import import_module
+
+from django.core.signing import JSONSerializer
+from django.utils.crypto import constant_time_compare, salted_hmac
+try:
+    from django.utils.encoding import force_text
+except ImportError:
+    try:  # Backwards compatibility for Django <1.5
+        from django.utils.encoding import force_unicode as force_text
+    except ImportError:  # Django 4.0 removed force_text
+        from django.utils.encoding import force_str as force_text
+
+
+def get_codec(path, options=None):
+    """
+    Return an instance of the codec class at the dotted ``path``, created
+    with the keyword arguments in ``options``.
+    """
+    module_name, class_name = path.rsplit(".", 1)
+    codec_class = getattr(import_module(module_name), class_name)
+    return codec_class(**(options or {}))
+
+
+class LegacyCodec(object):
+    """
+    Stores sessions exactly as SessionBase.encode() produces them: base64 of
+    a signed, serialized payload.
+    """
+    def encode(self, session, session_dict):
+        return session.encode(session_dict).encode("ascii")
+
+    def decode(self, session, data):
+        return session.decode(force_text(data))
+
+    def serialize(self, session, session_dict):
+        serializer = getattr(session, "serializer", None)
+        if serializer is None:  # Django <1.6 always pickles sessions
+            return pickle.dumps(session_dict, pickle.HIGHEST_PROTOCOL)
+        return serializer().dumps(session_dict)
+
+
+class PickleSerializer(object):
+    """
+    Serializes sessions with the most compact pickle protocol available.
+
+    Anyone who learns the SECRET_KEY can then sign a session that runs code
+    when it is unpickled, so only use this if sessions hold values JSON
+    can't store.
+    """
+    def dumps(self, obj):
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class BinaryCodec(LegacyCodec):
+    """
+    Stores sessions as raw bytes rather than base64: a header byte, an HMAC
+    of the payload, and the serialized session. Payloads of at least
+    ``compress_min_length`` bytes are zlib compressed (pass None to never
+    compress).
+
+    Sessions are serialized as JSON, unless ``serializer`` is another
+    serializer instance or the dotted path of a serializer class, such as
+    'disredis.disredis_sessions.codecs.PickleSerializer'.
+
+    Data that doesn't start with one of this codec's header bytes was
+    written by LegacyCodec and is decoded by it, so existing sessions stay
+    readable after switching codecs.
+    """
+    RAW = b"\x01"
+    COMPRESSED = b"\x02"
+    SIGNATURE_LENGTH = 20  # length of a SHA1 HMAC digest
+
+    def __init__(self, compress_min_length=1024, compress_level=6,
+                 serializer=None):
+        self.compress_min_length = compress_min_length
+        self.compress_level = compress_level
+        if serializer is None:
+            serializer = JSONSerializer()
+        elif isinstance(serializer, string_types):
+            module_name, class_name = serializer.rsplit(".", 1)
+            serializer = getattr(import_module(module_name), class_name)()
+        self.serializer = serializer
+
+    def encode(self, session, session_dict):
+        header = self.RAW
+        payload = self.serialize(session, session_dict)
+        if (self.compress_min_length is not None and
+                len(payload) >= self.compress_min_length):
+            compressed = zlib.compress(payload, self.compress_level)
+            if len(compressed) < len(payload):
+                header, payload = self.COMPRESSED, compressed
+        return header + self._sign(session, payload) + payload
+
+    def serialize(self, session, session_dict):
+        return self.serializer.dumps(session_dict)
+
+    def decode(self, session, data):
+        header = data[:1]
+        if header not in (self.RAW, self.COMPRESSED):
+            return super(BinaryCodec, self).decode(session, data)
+
+        signature = data[1:self.SIGNATURE_LENGTH + 1]
+        payload = data[self.SIGNATURE_LENGTH + 1:]
+        if not constant_time_compare(signature, self._sign(session, payload)):
+            logger = logging.getLogger('django.security.SuspiciousSession')
+            logger.warning("Session data corrupted")
+            return {}
+        try:
+            if header == self.COMPRESSED:
+                payload = zlib.decompress(payload)
+            return self.serializer.loads(payload)
+        except Exception:
+            # Like SessionBase.decode, treat an unreadable session as empty.
+            return {}
+
+    def _sign(self, session, payload):
+        key_salt = "disredis.disredis_sessions" + session.__class__.__name__
+        return salted_hmac(key_salt, payload).digest()
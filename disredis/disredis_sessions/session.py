@@ -1,39 +1,70 @@
-import redis
+import string
+from hashlib import sha1
 
 from django.contrib.sessions.backends.base import SessionBase, CreateError
-try:
-    from django.utils.encoding import force_text
-except ImportError:  # Backwards compatibility for Django <1.5
-    from django.utils.encoding import force_unicode as force_text
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.crypto import get_random_string
+from redis.exceptions import ConnectionError
 
-from disredis.disredis_client.client import DisredisClient
+from disredis.disredis_client.client import get_shared_client
 from disredis.disredis_sessions import settings
+from disredis.disredis_sessions.codecs import get_codec
 
 
-# Avoid new redis connection on each request
-
-if settings.SESSION_REDIS_SENTINEL_URLS is not None:
-    redis_server = DisredisClient(settings.SESSION_REDIS_SENTINEL_URLS)
+codec = get_codec(settings.SESSION_REDIS_CODEC,
+    settings.SESSION_REDIS_CODEC_OPTIONS)
 
 
 class SessionStore(SessionBase):
     """
     Implements Redis database session store.
     """
-    def __init__(self, session_key=None):
-        super(SessionStore, self).__init__(session_key)
-
-        self.server = redis_server
+    # Digest of the serialized session and its ttl as it was loaded from (or
+    # last written to) Redis, used to skip writing a session that hasn't
+    # changed.
+    _stored_digest = None
+    _stored_ttl = None
+
+    @property
+    def server(self):
+        """
+        The DisredisClient shared by all sessions in this process. It is
+        only connected when a session is first used, so Django can start
+        without Redis being reachable, and is rebuilt after a fork.
+        """
+        if settings.SESSION_REDIS_SENTINEL_URLS is None:
+            raise ImproperlyConfigured(
+                "SESSION_REDIS_SENTINEL_URLS must be set to use disredis "
+                "sessions.")
+        return get_shared_client(settings.SESSION_REDIS_SENTINEL_URLS,
+                                 weights=settings.SESSION_REDIS_WEIGHTS)
 
     def load(self):
-        try:
-            session_data = self.server.get(
-                self.get_real_stored_key(self._get_or_create_session_key())
-            )
-            return self.decode(force_text(session_data))
-        except:
-            self.create()
+        session_data = ttl = None
+        if self.session_key is not None:
+            try:
+                session_data, ttl = self.server.get_with_ttl(
+                    self.get_real_stored_key(self.session_key)
+                )
+            except ConnectionError:
+                pass
+        return self._decode_stored(session_data, ttl)
+
+    def _decode_stored(self, session_data, ttl):
+        """
+        Returns the session dictionary for data loaded from Redis, and
+        remembers what was stored so an unchanged session isn't rewritten.
+        """
+        if session_data is None:
+            # The session doesn't exist (or Redis is unreachable). Rather
+            # than writing an empty session now, drop the key so that a new
+            # one is created by save() if anything is stored in the session.
+            self._session_key = None
             return {}
+        session_dict = codec.decode(self, session_data)
+        self._stored_digest = self._digest(session_dict)
+        self._stored_ttl = ttl
+        return session_dict
 
     def exists(self, session_key):
         return self.server.exists(self.get_real_stored_key(session_key))
@@ -51,25 +82,58 @@ class SessionStore(SessionBase):
             return
 
     def save(self, must_create=False):
-        if must_create and self.exists(self._get_or_create_session_key()):
+        if self.session_key is None:
+            return self.create()
+
+        key = self.get_real_stored_key(self._get_or_create_session_key())
+        session_dict = self._get_session(no_load=must_create)
+        expiry_age = self.get_expiry_age()
+        digest = self._digest(session_dict)
+
+        if not must_create and digest == self._stored_digest:
+            # Nothing changed, so only push the expiry back, and only once
+            # enough of it has run out to be worth a round trip.
+            if self._needs_refresh(expiry_age):
+                self.server.expire(key, expiry_age)
+                self._stored_ttl = expiry_age
+            return
+
+        # A single SET covers both cases: with NX it atomically creates the
+        # session only if the key is free, and EX sets the expiry with it.
+        data = codec.encode(self, session_dict)
+        stored = self.server.set(key, data, ex=expiry_age, nx=must_create)
+        if must_create and not stored:
             raise CreateError
+        self._stored_digest = digest
+        self._stored_ttl = expiry_age
+
+    def _digest(self, session_dict):
+        """
+        Returns a digest of the session, taken before it is signed, since
+        signing adds a timestamp that changes every second.
+        """
+        return sha1(codec.serialize(self, session_dict)).digest()
 
-        data = self.encode(self._get_session(no_load=must_create))
-        if redis.VERSION[0] >= 2:
-            self.server.setex(
-                self.get_real_stored_key(self._get_or_create_session_key()),
-                self.get_expiry_age(),
-                data
-            )
-        else:
-            self.server.set(
-                self.get_real_stored_key(self._get_or_create_session_key()),
-                data
-            )
-            self.server.expire(
-                self.get_real_stored_key(self._get_or_create_session_key()),
-                self.get_expiry_age()
-            )
+    def _needs_refresh(self, expiry_age):
+        """
+        Returns True if the stored session's remaining ttl is below the
+        SESSION_REDIS_REFRESH_THRESHOLD, which defaults to half of the
+        session's expiry age.
+        """
+        if self._stored_ttl is None:
+            return True
+        threshold = settings.SESSION_REDIS_REFRESH_THRESHOLD
+        if threshold is None:
+            threshold = expiry_age // 2
+        return self._stored_ttl < threshold
+
+    def _get_new_session_key(self):
+        """
+        Return a new random session key. Unlike the base implementation this
+        doesn't check that the key is free, since the SET NX in save() will
+        already fail with a CreateError for a key that is taken.
+        """
+        return get_random_string(32, string.ascii_lowercase + string.digits)
 
     def delete(self, session_key=None):
         if session_key is None:
@@ -9,4 +9,15 @@ SESSION_REDIS_PASSWORD = getattr(settings, 'SESSION_REDIS_PASSWORD', None)
 SESSION_REDIS_UNIX_DOMAIN_SOCKET_PATH = getattr(
     settings, 'SESSION_REDIS_UNIX_DOMAIN_SOCKET_PATH', None
 )
-SESSION_REDIS_SENTINEL_URLS = getattr(settings, 'SESSION_REDIS_SENTINEL_URLS', None)
\ No newline at end of file
+SESSION_REDIS_SENTINEL_URLS = getattr(settings, 'SESSION_REDIS_SENTINEL_URLS', None)
+SESSION_REDIS_REFRESH_THRESHOLD = getattr(
+    settings, 'SESSION_REDIS_REFRESH_THRESHOLD', None
+)
+SESSION_REDIS_CODEC = getattr(
+    settings, 'SESSION_REDIS_CODEC',
+    'disredis.disredis_sessions.codecs.LegacyCodec'
+)
+SESSION_REDIS_CODEC_OPTIONS = getattr(
+    settings, 'SESSION_REDIS_CODEC_OPTIONS', {}
+)
+SESSION_REDIS_WEIGHTS = getattr(settings, 'SESSION_REDIS_WEIGHTS', None)
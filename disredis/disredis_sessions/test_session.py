@@ -0,0 +1,254 @@
+"""
+Tests for the disredis session backends.
+
+"""
+import time
+from unittest import TestCase, skipIf
+
+from django.conf import settings as django_settings
+if not django_settings.configured:
+    django_settings.configure(SECRET_KEY="disredis-tests",
+                              SESSION_REDIS_SENTINEL_URLS=["127.0.0.1:6383"])
+
+from django.contrib.sessions.backends.base import SessionBase
+from django.core import signing
+
+from disredis.disredis_client import client as client_module
+from disredis.disredis_client import test_client
+from disredis.disredis_client.client import DisredisClient, Node
+from disredis.disredis_sessions.codecs import (BinaryCodec, LegacyCodec,
+    PickleSerializer)
+from disredis.disredis_sessions.session import SessionStore
+
+try:
+    import asyncio
+    from disredis.disredis_client import asyncio_client
+    from disredis.disredis_sessions import asyncio_session
+except (ImportError, SyntaxError):  # Python 2, or redis-py older than 4.2
+    asyncio_session = None
+
+
+class RecordingRedis(test_client.MockStrictRedis):
+    """
+    A mock Redis connection that records the writes sent to it.
+    """
+    commands = []
+
+    def set(self, key, value, ex=None, px=None, nx=False, xx=False):
+        self.commands.append("set")
+        return super(RecordingRedis, self).set(key, value, ex=ex, px=px,
+                                               nx=nx, xx=xx)
+
+    def expire(self, key, time):
+        self.commands.append("expire")
+        return super(RecordingRedis, self).expire(key, time)
+
+
+class Later(object):
+    "Stands in for the time module, ``offset`` seconds in the future"
+    def __init__(self, offset):
+        self.offset = offset
+
+    def time(self):
+        return time.time() + self.offset
+
+
+class TestSessionStore(TestCase):
+    """
+    Unit tests for the session backend, on two mock Redis nodes.
+    """
+    def setUp(self):
+        self.old_client = DisredisClient.redis_client_class
+        DisredisClient.redis_client_class = RecordingRedis
+        Node.redis_client_class = RecordingRedis
+        client_module._shared_clients.clear()
+        del RecordingRedis.commands[:]
+
+    def tearDown(self):
+        DisredisClient.redis_client_class = self.old_client
+        Node.redis_client_class = self.old_client
+        client_module._shared_clients.clear()
+        signing.time = time
+
+    def test_save_load(self):
+        """
+        Test that a new session is created with a single SET and loaded.
+        """
+        session = SessionStore()
+        session["user"] = 1
+        session.save()
+        self.assertEqual(RecordingRedis.commands, ["set"])
+        self.assertEqual(SessionStore(session.session_key)["user"], 1)
+
+    def test_skip_unchanged_save(self):
+        """
+        Test that an unchanged session isn't written again, even once the
+        timestamp in its signature would have changed.
+        """
+        session = SessionStore()
+        session["user"] = 1
+        session.save()
+        signing.time = Later(10)
+        loaded = SessionStore(session.session_key)
+        self.assertEqual(loaded["user"], 1)
+        loaded.save()
+        self.assertEqual(RecordingRedis.commands, ["set"])
+
+        loaded["user"] = 2
+        loaded.save()
+        self.assertEqual(RecordingRedis.commands, ["set", "set"])
+        self.assertEqual(SessionStore(session.session_key)["user"], 2)
+
+    def test_refresh_expiry(self):
+        """
+        Test that an unchanged session only has its expiry pushed back once
+        its remaining ttl is below half of its expiry age.
+        """
+        session = SessionStore()
+        session["user"] = 1
+        session.save()
+        key = session.get_real_stored_key(session.session_key)
+        connection = session.server.get_node_for_key(key).connection
+
+        connection.ttls[key] = session.get_expiry_age() // 2 + 1
+        loaded = SessionStore(session.session_key)
+        loaded.load()
+        loaded.save()
+        self.assertEqual(RecordingRedis.commands, ["set"])
+
+        connection.ttls[key] = session.get_expiry_age() // 2 - 1
+        loaded = SessionStore(session.session_key)
+        loaded.load()
+        loaded.save()
+        self.assertEqual(RecordingRedis.commands, ["set", "expire"])
+        self.assertEqual(connection.ttls[key], session.get_expiry_age())
+
+
+@skipIf(asyncio_session is None, "needs Python 3 and redis-py 4.2 or newer")
+class TestAsyncSessionStore(TestCase):
+    """
+    Unit tests for the async methods of the asyncio session backend, on mock
+    asyncio Redis connections.
+    """
+    def setUp(self):
+        self.old_client = asyncio_client.AsyncDisredisClient.redis_client_class
+        asyncio_client.AsyncDisredisClient.redis_client_class = (
+            test_client.MockAsyncRedis)
+        asyncio_client.AsyncNode.redis_client_class = (
+            test_client.MockAsyncRedis)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        asyncio_client.AsyncDisredisClient.redis_client_class = self.old_client
+        asyncio_client.AsyncNode.redis_client_class = self.old_client
+        self.loop.close()
+
+    def wait(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+    def _server(self, session):
+        "Returns the mock server holding ``session`` and its key"
+        client, = asyncio_client._shared_clients[self.loop].values()
+        key = session.get_real_stored_key(session.session_key)
+        return client.get_node_for_key(key).connection.server, key
+
+    def test_asave_aload(self):
+        """
+        Test that a session is saved and loaded, and only written again once
+        it has changed.
+        """
+        session = asyncio_session.SessionStore()
+        session["user"] = 1
+        self.wait(session.asave())
+        server, key = self._server(session)
+        self.assertEqual(server.ttls[key], session.get_expiry_age())
+
+        loaded = asyncio_session.SessionStore(session.session_key)
+        self.assertEqual(self.wait(loaded.aload()), {"user": 1})
+        self.assertEqual(self.wait(loaded.aget("user")), 1)
+        server.fail = True  # nothing should be sent
+        self.wait(loaded.asave())
+
+        server.fail = False
+        self.wait(loaded.aset("user", 2))
+        self.wait(loaded.asave())
+        loaded = asyncio_session.SessionStore(session.session_key)
+        self.assertEqual(self.wait(loaded.aload()), {"user": 2})
+
+        self.wait(loaded.adelete())
+        self.assertEqual(server.data, {})
+
+    def test_aload_failure(self):
+        """
+        Test that a session that can't be read is treated as a new one.
+        """
+        session = asyncio_session.SessionStore()
+        session["user"] = 1
+        self.wait(session.asave())
+        server, key = self._server(session)
+        server.fail = True
+        loaded = asyncio_session.SessionStore(session.session_key)
+        self.assertEqual(self.wait(loaded.aload()), {})
+
+    def test_arefresh_expiry(self):
+        """
+        Test that an unchanged session only has its expiry pushed back once
+        its remaining ttl is below half of its expiry age.
+        """
+        session = asyncio_session.SessionStore()
+        session["user"] = 1
+        self.wait(session.asave())
+        server, key = self._server(session)
+        expiry_age = session.get_expiry_age()
+
+        server.ttls[key] = expiry_age // 2 + 1
+        loaded = asyncio_session.SessionStore(session.session_key)
+        self.wait(loaded.aload())
+        self.wait(loaded.asave())
+        self.assertEqual(server.ttls[key], expiry_age // 2 + 1)
+
+        server.ttls[key] = expiry_age // 2 - 1
+        loaded = asyncio_session.SessionStore(session.session_key)
+        self.wait(loaded.aload())
+        self.wait(loaded.asave())
+        self.assertEqual(server.ttls[key], expiry_age)
+
+
+class TestCodecs(TestCase):
+    """
+    Unit tests for the session codecs.
+    """
+    def test_binary_codec(self):
+        """
+        Test that the BinaryCodec stores JSON by default, compressed once it
+        is long enough, and still reads sessions stored by the LegacyCodec.
+        """
+        session = SessionBase()
+        codec = BinaryCodec(compress_min_length=100)
+        self.assertTrue(isinstance(codec.serializer,
+                                   signing.JSONSerializer))
+        small = {"user": 1}
+        data = codec.encode(session, small)
+        self.assertEqual(data[:1], BinaryCodec.RAW)
+        self.assertTrue(data.endswith(b'{"user":1}'))
+        self.assertEqual(codec.decode(session, data), small)
+        large = {"text": "x" * 1000}
+        data = codec.encode(session, large)
+        self.assertEqual(data[:1], BinaryCodec.COMPRESSED)
+        self.assertEqual(codec.decode(session, data), large)
+        self.assertEqual(codec.decode(session, data[:-1] + b"!"), {})
+        legacy = LegacyCodec().encode(session, small)
+        self.assertEqual(codec.decode(session, legacy), small)
+
+    def test_pickle_serializer(self):
+        """
+        Test that pickling sessions has to be asked for.
+        """
+        session = SessionBase()
+        codec = BinaryCodec(
+            serializer="disredis.disredis_sessions.codecs.PickleSerializer")
+        self.assertTrue(isinstance(codec.serializer, PickleSerializer))
+        value = {"when": set([1, 2])}
+        self.assertEqual(codec.decode(session, codec.encode(session, value)),
+                         value)
+        self.assertRaises(TypeError, BinaryCodec().encode, session, value)